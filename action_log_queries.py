@@ -0,0 +1,130 @@
+"""
+Action log queries
+Hardware Inventory Tracker
+
+The admin action log pages through history newest first with a keyset
+cursor on (timestamp, id), so deep pages cost the same as the first one.
+Per-action counts come from a GROUP BY over the whole filtered set, and
+the filter dropdown values are served from a small in-process cache
+instead of DISTINCT scans on every view. Ranges that reach back past the
+retention horizon also read action_logs_archive (see archive.py).
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import func, tuple_
+from app import db
+from models import ActionLog
+from archive import history_source
+
+ACTION_LOG_PAGE_SIZE = 100
+ACTION_LOG_MAX_PAGE_SIZE = 500
+
+
+def action_log_query(action_type=None, user=None, start=None, end=None):
+    """Filtered ActionLog query, including archived rows when `start` needs them; `end` is exclusive"""
+    log = history_source(ActionLog, start)
+    query = db.session.query(log)
+    if action_type:
+        query = query.filter(log.action_type == action_type)
+    if user:
+        query = query.filter(log.user == user)
+    if start:
+        query = query.filter(log.timestamp >= start)
+    if end:
+        query = query.filter(log.timestamp < end)
+    return query
+
+
+def _log_entity(query):
+    # ActionLog, or its alias over the archive union
+    return query.column_descriptions[0]['entity']
+
+
+def encode_log_cursor(log):
+    """Opaque cursor for the (timestamp, id) sort key of the last row shown"""
+    raw = json.dumps([log.timestamp.isoformat(), log.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_log_cursor(cursor):
+    try:
+        timestamp, log_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def action_log_page(query, before=None, limit=ACTION_LOG_PAGE_SIZE):
+    """
+    One page of the filtered query, newest first.
+
+    Returns (logs, next_cursor); next_cursor is None on the last page.
+    """
+    log = _log_entity(query)
+    sort_key = (log.timestamp, log.id)
+    if before:
+        query = query.filter(tuple_(*sort_key) < tuple_(*decode_log_cursor(before)))
+
+    # Fetch one extra row to know whether another page exists
+    logs = query.order_by(log.timestamp.desc(), log.id.desc()).limit(limit + 1).all()
+    if len(logs) <= limit:
+        return logs, None
+    logs = logs[:limit]
+    return logs, encode_log_cursor(logs[-1])
+
+
+def action_type_counts(query):
+    """{action_type: rows} over the whole filtered set"""
+    log = _log_entity(query)
+    rows = query.with_entities(log.action_type, func.count(log.id))\
+        .group_by(log.action_type).all()
+    return dict(rows)
+
+
+class ActionLogFilterOptions:
+    """
+    Cached action types and users for the filter dropdowns.
+
+    Refreshed from the database at most once per TTL. Writers in this
+    process add their values immediately through remember(); the TTL only
+    bounds how long other workers' new values take to appear.
+    """
+
+    def __init__(self, ttl=300.0):
+        self.ttl = ttl
+        self._action_types = set()
+        self._users = set()
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """(sorted action types, sorted users)"""
+        with self._lock:
+            if time.monotonic() >= self._expires_at:
+                log = history_source(ActionLog)
+                self._action_types = {row[0] for row in
+                                      db.session.query(log.action_type).distinct()}
+                self._users = {row[0] for row in db.session.query(log.user).distinct()}
+                self._expires_at = time.monotonic() + self.ttl
+            return sorted(self._action_types), sorted(self._users)
+
+    def remember(self, action_type, user):
+        with self._lock:
+            self._action_types.add(action_type)
+            self._users.add(user)
+
+    def clear(self):
+        with self._lock:
+            self._action_types = set()
+            self._users = set()
+            self._expires_at = 0.0
+
+
+action_log_filter_options = ActionLogFilterOptions(
+    ttl=float(os.environ.get("ACTION_LOG_FILTER_TTL", 300))
+)
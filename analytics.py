@@ -0,0 +1,261 @@
+"""
+Consumption analytics
+Hardware Inventory Tracker
+
+Usage time series by hardware type, lot, MO or operator per day or week.
+The database does the heavy lifting: one GROUP BY over pull events with
+the timestamp truncated to the bucket, so only (bucket, key) totals come
+back. pandas then pivots those into one zero-filled series per key, keeps
+the top keys and folds the rest into "Other", all as column operations.
+
+Results are cached per worker, keyed by the normalised filters and
+inventory_version(), so every screen showing the same chart shares one
+computation until inventory changes. Concurrent requests for a key that
+is being computed wait for it rather than computing it again.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, case, literal_column
+from app import db
+from models import Box, PullEvent, HardwareType, LotNumber
+from archive import history_source
+from inventory_summary import inventory_version
+
+CONSUMPTION_GROUPS = ('hardware_type', 'lot_number', 'mo', 'operator')
+CONSUMPTION_BUCKETS = {'day': 30, 'week': 12}  # bucket -> default number of buckets
+MAX_CONSUMPTION_BUCKETS = 400
+CONSUMPTION_TOP_KEYS = 10
+MAX_CONSUMPTION_TOP_KEYS = 100
+ANALYTICS_CACHE_SIZE = int(os.environ.get("ANALYTICS_CACHE_SIZE", 128))
+
+OTHER_KEY = 'Other'
+
+
+class AnalyticsError(Exception):
+    """Raised for invalid analytics parameters; the message is user-facing"""
+    pass
+
+
+class AnalyticsCache:
+    """LRU of computed results with single-flight computation per key"""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> result
+        self._pending = {}  # key -> threading.Event while being computed
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another request is computing this key; use its result
+            pending.wait()
+
+        try:
+            result = compute()
+            with self._lock:
+                if self.maxsize > 0:
+                    self._entries[key] = result
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+            return result
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def bucket_start(value, bucket):
+    """Start of the day/week (Monday) containing a naive datetime"""
+    day = datetime(value.year, value.month, value.day)
+    if bucket == 'week':
+        day -= timedelta(days=day.weekday())
+    return day
+
+
+def consumption_range(bucket, start=None, end=None):
+    """
+    Whole-bucket [start, end) for a request; defaults to the last
+    CONSUMPTION_BUCKETS[bucket] buckets including the current one.
+    """
+    step = timedelta(weeks=1) if bucket == 'week' else timedelta(days=1)
+    if end is None:
+        end = bucket_start(datetime.now(timezone.utc).replace(tzinfo=None), bucket) + step
+    elif end != bucket_start(end, bucket):
+        end = bucket_start(end, bucket) + step
+    start = bucket_start(start, bucket) if start else end - step * CONSUMPTION_BUCKETS[bucket]
+    if start >= end:
+        raise AnalyticsError("'from' must be before 'to'")
+    if (end - start) / step > MAX_CONSUMPTION_BUCKETS:
+        raise AnalyticsError(f"At most {MAX_CONSUMPTION_BUCKETS} {bucket}s per request")
+    return start, end
+
+
+def truncate_to_bucket(timestamp, bucket):
+    """SQL expression truncating a timestamp to its day/week start"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.date_trunc(bucket, timestamp)
+    if bucket == 'week':
+        # Forward to Sunday (or stay), then back to that week's Monday
+        return func.date(timestamp, 'weekday 0', '-6 days')
+    return func.date(timestamp)
+
+
+def consumption_query(group_by, bucket, start, end, type_filter=None, lot_filter=None,
+                      mo_filter=None, operator_filter=None):
+    """(bucket, key, pulled, returned, events) rows grouped in the database"""
+    event = history_source(PullEvent, start)
+    bucket_column = truncate_to_bucket(event.timestamp, bucket).label('bucket')
+    key_column = {
+        'hardware_type': HardwareType.name,
+        'lot_number': LotNumber.name,
+        'mo': event.mo,
+        'operator': event.operator,
+    }[group_by].label('key')
+
+    query = db.session.query(
+        bucket_column,
+        key_column,
+        func.sum(case((event.quantity < 0, -event.quantity), else_=0)).label('pulled'),
+        func.sum(case((event.quantity > 0, event.quantity), else_=0)).label('returned'),
+        func.count(literal_column('*')).label('events')
+    ).filter(event.timestamp >= start, event.timestamp < end)
+
+    if group_by in ('hardware_type', 'lot_number') or type_filter or lot_filter:
+        query = query.join(Box, event.box_id == Box.id)\
+            .join(HardwareType, Box.hardware_type_id == HardwareType.id)\
+            .join(LotNumber, Box.lot_number_id == LotNumber.id)
+        if type_filter:
+            query = query.filter(HardwareType.name == type_filter)
+        if lot_filter:
+            query = query.filter(LotNumber.name == lot_filter)
+    if mo_filter:
+        query = query.filter(event.mo == mo_filter)
+    if operator_filter:
+        query = query.filter(event.operator == operator_filter)
+    return query.group_by(bucket_column, key_column)
+
+
+def build_consumption_series(rows, bucket, start, end, top):
+    """
+    Pivot grouped rows into zero-filled per-key series with pandas.
+
+    Keys are ordered by total pulled; keys beyond `top` are summed into
+    OTHER_KEY. Returns the 'buckets', 'series' and 'totals' of the result.
+    """
+    # pandas is slow to import and only needed here; keep it off the boot path
+    import pandas as pd
+
+    index = pd.date_range(start, end, freq='W-MON' if bucket == 'week' else 'D', inclusive='left')
+    frame = pd.DataFrame(rows, columns=['bucket', 'key', 'pulled', 'returned', 'events'])
+    result = {
+        'buckets': [day.strftime('%Y-%m-%d') for day in index],
+        'series': [],
+        'totals': {'pulled': 0, 'returned': 0, 'net': 0, 'events': 0},
+    }
+    if frame.empty:
+        return result
+
+    frame['bucket'] = pd.to_datetime(frame['bucket'])
+    frame['key'] = frame['key'].fillna('(none)').astype(str)
+    frame[['pulled', 'returned', 'events']] = frame[['pulled', 'returned', 'events']].fillna(0).astype('int64')
+
+    totals = frame.groupby('key')[['pulled', 'returned', 'events']].sum()\
+        .sort_values(['pulled', 'events'], ascending=False)
+    keys = list(totals.index[:top])
+    if len(totals) > top:
+        frame.loc[~frame['key'].isin(keys), 'key'] = OTHER_KEY
+        totals = frame.groupby('key')[['pulled', 'returned', 'events']].sum()
+        keys.append(OTHER_KEY)
+
+    pivot = frame.pivot_table(index='bucket', columns='key', values=['pulled', 'returned'],
+                              aggfunc='sum', fill_value=0)
+    pulled = pivot['pulled'].reindex(index=index, columns=keys, fill_value=0).astype('int64')
+    returned = pivot['returned'].reindex(index=index, columns=keys, fill_value=0).astype('int64')
+    net = pulled - returned
+
+    result['series'] = [{
+        'key': key,
+        'pulled': pulled[key].tolist(),
+        'returned': returned[key].tolist(),
+        'net': net[key].tolist(),
+        'total_pulled': int(totals.at[key, 'pulled']),
+        'total_returned': int(totals.at[key, 'returned']),
+        'events': int(totals.at[key, 'events']),
+    } for key in keys]
+    result['totals'] = {
+        'pulled': int(totals['pulled'].sum()),
+        'returned': int(totals['returned'].sum()),
+        'net': int(totals['pulled'].sum() - totals['returned'].sum()),
+        'events': int(totals['events'].sum()),
+    }
+    return result
+
+
+def consumption_report(group_by='hardware_type', bucket='day', start=None, end=None,
+                       type_filter=None, lot_filter=None, mo_filter=None, operator_filter=None,
+                       top=CONSUMPTION_TOP_KEYS):
+    """
+    Consumption time series for the given filters, cached by inventory version.
+
+    start/end are naive UTC datetimes (end exclusive) and are widened to
+    whole buckets. Raises AnalyticsError for invalid parameters.
+    """
+    if group_by not in CONSUMPTION_GROUPS:
+        raise AnalyticsError(f"group_by must be one of: {', '.join(CONSUMPTION_GROUPS)}")
+    if bucket not in CONSUMPTION_BUCKETS:
+        raise AnalyticsError(f"bucket must be one of: {', '.join(CONSUMPTION_BUCKETS)}")
+    if not 1 <= top <= MAX_CONSUMPTION_TOP_KEYS:
+        raise AnalyticsError(f"top must be between 1 and {MAX_CONSUMPTION_TOP_KEYS}")
+    start, end = consumption_range(bucket, start, end)
+    filters = {
+        'group_by': group_by,
+        'bucket': bucket,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'type': type_filter or None,
+        'lot': lot_filter or None,
+        'mo': mo_filter or None,
+        'operator': operator_filter or None,
+        'top': top,
+    }
+
+    def compute():
+        rows = consumption_query(group_by, bucket, start, end, filters['type'], filters['lot'],
+                                 filters['mo'], filters['operator']).all()
+        return dict(build_consumption_series(rows, bucket, start, end, top), filters=filters)
+
+    key = (tuple(filters.values()), inventory_version())
+    return consumption_cache.get_or_compute(key, compute)
+
+
+consumption_cache = AnalyticsCache(maxsize=ANALYTICS_CACHE_SIZE)
@@ -1,20 +1,21 @@
 import os
 import logging
 import json
-from datetime import datetime, timezone
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, session
+from datetime import datetime, timezone, timedelta
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, session,
+                   send_file, Response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
 from werkzeug.middleware.proxy_fix import ProxyFix
-import pandas as pd
-import io
 import re
+import base64
+import click
 from functools import wraps
 from urllib.parse import urlparse
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
 class Base(DeclarativeBase):
     pass
@@ -35,123 +36,55 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 
 # Initialize the app with the extension
 db.init_app(app)
-from sqlalchemy import text
-from models import HardwareType, LotNumber, Box, PullEvent, ActionLog
+from models import HardwareType, LotNumber, Box, PullEvent, ActionLog, PullEventArchive
+from stock_movements import (record_movement, record_batch, validate_movement_header,
+                             StockMovementError)
+from box_cache import box_info_cache
+from box_creation import (generate_box_id, read_import_file, create_boxes, expand_box_range,
+                          BoxImportError, IMPORT_COLUMNS, MAX_IMPORT_ROWS)
+from exports import (build_inventory_xlsx, pull_event_export_rows, PULL_EVENT_COLUMNS,
+                     XLSX_MIMETYPE, TEXT_EXPORT_ENCODERS, TEXT_EXPORT_MIMETYPES)
+from export_jobs import export_jobs, ExportJobError
+from inventory_summary import (adjust_summary, box_contribution, rebuild_inventory_summary,
+                               load_summary_groups, load_filtered_groups)
+from box_search import box_search_clause, search_boxes, search_backend
+from action_log_queries import (action_log_query, action_log_page, action_type_counts,
+                                action_log_filter_options, ACTION_LOG_PAGE_SIZE,
+                                ACTION_LOG_MAX_PAGE_SIZE)
+from audit_log import record_action, audit_log_writer
+from archive import history_source, archive_history, ARCHIVE_HORIZON_DAYS
+from inventory_history import (record_adjustment, record_box_delete, take_checkpoint,
+                               inventory_as_of, InventoryHistoryError)
+from analytics import consumption_report, consumption_cache, AnalyticsError, CONSUMPTION_TOP_KEYS
+from burn_rate import reorder_report, ForecastError, REORDER_STATUSES
+from migrations import current_version, upgrade, LATEST_VERSION
+from sqlite_profile import apply_sqlite_profile, begin_write, chunked
 
-# Auto-migrate on startup
-with app.app_context():
-
-    # Create tables that don’t exist yet
-    db.create_all()
+from metrics import metrics
+from query_budget import query_budget, init_app as init_query_budget
 
-    # Patch the boxes table in-place
-    with db.engine.begin() as conn:
-        # Patch pull_events
-        # Database-agnostic column checking
-        try:
-            dialect_name = conn.dialect.name.lower()
-            if dialect_name == 'postgresql':
-                result = conn.execute(text("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'pull_events' AND table_schema = 'public'
-                """))
-                cols = [row[0] for row in result.fetchall()]
-            elif dialect_name == 'sqlite':
-                result = conn.execute(text("PRAGMA table_info(pull_events)"))
-                cols = [row[1] for row in result.fetchall()]
-            else:
-                cols = []
-        except Exception:
-            cols = []
-
-        # Rename legacy column if present
-        if "quantity_pulled" in cols and "quantity" not in cols:
-            conn.execute(text("ALTER TABLE pull_events RENAME COLUMN quantity_pulled TO quantity"))
-            cols.append("quantity")
-
-        if "qc_operator" in cols and "qc_personnel" not in cols:
-            conn.execute(text("ALTER TABLE pull_events RENAME COLUMN qc_operator TO qc_personnel"))
-            cols.append("qc_personnel")
-
-        # Add any brand-new columns that still don’t exist
-        migrations = {
-            "quantity":    "ALTER TABLE pull_events ADD COLUMN quantity INTEGER DEFAULT 0",
-            "mo":          "ALTER TABLE pull_events ADD COLUMN mo VARCHAR(50)",
-            "operator":    "ALTER TABLE pull_events ADD COLUMN operator VARCHAR(50)",
-            "qc_personnel": "ALTER TABLE pull_events ADD COLUMN qc_personnel VARCHAR(50)",
-        }
-        for col, ddl in migrations.items():
-            if col not in cols:
-                try:
-                    conn.execute(text(ddl))
-                except Exception as e:
-                    # Column might already exist, continue
-                    print(f"Migration warning for {col}: {str(e)}")
-                    pass
-
-        # Also migrate boxes table
-        try:
-            if dialect_name == 'postgresql':
-                result = conn.execute(text("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'boxes' AND table_schema = 'public'
-                """))
-                box_cols = [row[0] for row in result.fetchall()]
-            elif dialect_name == 'sqlite':
-                result = conn.execute(text("PRAGMA table_info(boxes)"))
-                box_cols = [row[1] for row in result.fetchall()]
-            else:
-                box_cols = []
-                
-            if box_cols:
-                box_migrations = {
-                    "operator": "ALTER TABLE boxes ADD COLUMN operator VARCHAR(50)",
-                    "qc_personnel": "ALTER TABLE boxes ADD COLUMN qc_personnel VARCHAR(50)",
-                }
-                for col, ddl in box_migrations.items():
-                    if col not in box_cols:
-                        try:
-                            conn.execute(text(ddl))
-                        except Exception as e:
-                            print(f"Migration warning for boxes.{col}: {str(e)}")
-                            pass
-        except Exception as e:
-            print(f"Boxes migration warning: {str(e)}")
-            pass
+# WAL, busy_timeout and friends for SQLite (SQLITE_PROFILE); no-op elsewhere
+# Request latency and SQL counters for /metrics (METRICS_ENABLED)
+with app.app_context():
+    apply_sqlite_profile(db.engine)
+    metrics.init_app(app, db.engine)
+    init_query_budget(app, db.engine)
 
-        # Also migrate action_logs table
-        try:
-            if dialect_name == 'postgresql':
-                result = conn.execute(text("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'action_logs' AND table_schema = 'public'
-                """))
-                action_cols = [row[0] for row in result.fetchall()]
-            elif dialect_name == 'sqlite':
-                result = conn.execute(text("PRAGMA table_info(action_logs)"))
-                action_cols = [row[1] for row in result.fetchall()]
-            else:
-                action_cols = []
-                
-            if action_cols:
-                action_migrations = {
-                    "qc_personnel": "ALTER TABLE action_logs ADD COLUMN qc_personnel VARCHAR(100)",
-                }
-                for col, ddl in action_migrations.items():
-                    if col not in action_cols:
-                        try:
-                            conn.execute(text(ddl))
-                        except Exception as e:
-                            print(f"Migration warning for action_logs.{col}: {str(e)}")
-                            pass
-        except Exception as e:
-            print(f"Action logs migration warning: {str(e)}")
-            pass
-            
-    print("✅ Database schema auto-migration complete")
+# Apply pending schema migrations. When the schema is current this is a
+# single SELECT; DDL only runs when a deploy introduces new steps. Deploys
+# that run 'flask db-upgrade' (or boot with gunicorn --preload, so the
+# master checks once before forking) can set SCHEMA_CHECK=skip.
+with app.app_context():
+    if os.environ.get("SCHEMA_CHECK", "on") == "skip":
+        pass
+    elif current_version() < LATEST_VERSION:
+        if os.environ.get("SCHEMA_AUTO_MIGRATE", "1") == "1":
+            for step, name in upgrade():
+                app.logger.info(f"Applied schema migration {step}: {name}")
+        else:
+            app.logger.error("Database schema is out of date; run 'flask db-upgrade'")
+    # Once the search index exists, so no request pays for the lookup
+    search_backend()
 
 
 # Add JSON filter for templates
@@ -181,124 +114,53 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def sanitize_box_id_component(component):
-    """Sanitize a component for use in box ID generation"""
-    # Remove special characters and replace spaces with underscores
-    sanitized = re.sub(r'[^\w\-_]', '_', str(component).strip())
-    # Remove multiple consecutive underscores
-    sanitized = re.sub(r'_+', '_', sanitized)
-    # Remove leading/trailing underscores
-    return sanitized.strip('_')
-
-def generate_box_id(hardware_type_name, lot_number_name, box_number):
-    """Generate a unique box ID from components"""
-    type_clean = sanitize_box_id_component(hardware_type_name)
-    lot_clean = sanitize_box_id_component(lot_number_name)
-    box_clean = sanitize_box_id_component(box_number)
-    return f"{type_clean}_{lot_clean}_{box_clean}"
-
 def log_action(action_type, user, box_id=None, hardware_type=None, lot_number=None, 
                previous_quantity=None, quantity_change=None, available_quantity=None,
                operator=None, qc_personnel=None, details=None):
-    """Log an admin action with enhanced tracking"""
+    """
+    Log an admin action with enhanced tracking.
+
+    Call before committing the change being logged: the entry is written
+    with (AUDIT_LOG_MODE=sync) or queued after (batched) that commit, and
+    dropped if it rolls back. It never commits by itself.
+    """
     try:
-        action_log = ActionLog()
-        action_log.action_type = action_type
-        action_log.user = user or operator  # Use operator as user if user not provided
-        action_log.box_id = box_id
-        action_log.hardware_type = hardware_type
-        action_log.lot_number = lot_number
-        action_log.previous_quantity = previous_quantity
-        action_log.quantity_change = quantity_change
-        action_log.available_quantity = available_quantity
-        action_log.operator = operator
-        action_log.qc_personnel = qc_personnel
-        action_log.details = json.dumps(details) if details else None
-        db.session.add(action_log)
-        db.session.commit()
+        record_action({
+            'action_type': action_type,
+            'user': user or operator,  # Use operator as user if user not provided
+            'timestamp': datetime.now(timezone.utc),
+            'box_id': box_id,
+            'hardware_type': hardware_type,
+            'lot_number': lot_number,
+            'previous_quantity': previous_quantity,
+            'quantity_change': quantity_change,
+            'available_quantity': available_quantity,
+            'operator': operator,
+            'qc_personnel': qc_personnel,
+            'details': json.dumps(details) if details else None,
+        })
     except Exception as e:
         app.logger.error(f"Failed to log action: {str(e)}")
         # Don't fail the main operation if logging fails
         pass
 
-def group_boxes_by_type_lot(results):
-    """Group boxes by type code (first 3 digits) and type-lot combination"""
-    from collections import defaultdict
-    
-    type_code_groups = defaultdict(lambda: defaultdict(list))
-    
-    for box, type_name, lot_name in results:
-        # Extract first 3 digits from type name
-        type_code = type_name[:3] if len(type_name) >= 3 else type_name
-        # Use tuple key to avoid collisions with | character
-        type_lot_key = (type_name, lot_name)
-        
-        type_code_groups[type_code][type_lot_key].append({
-            'box': box,
-            'type_name': type_name,
-            'lot_name': lot_name
-        })
-    
-    # Calculate totals for each type-lot group - convert to plain dict
-    grouped_data = {}
-    for type_code, type_lot_groups in type_code_groups.items():
-        grouped_data[type_code] = {}
-        for type_lot_key, boxes_data in type_lot_groups.items():
-            type_name, lot_name = type_lot_key  # Unpack tuple
-            
-            total_initial = sum(bd['box'].initial_quantity for bd in boxes_data)
-            total_remaining = sum(bd['box'].remaining_quantity for bd in boxes_data)
-            
-            # Create string key for template compatibility
-            display_key = f"{type_name}__{lot_name}"  # Use __ as separator
-            grouped_data[type_code][display_key] = {
-                'type_name': type_name,
-                'lot_name': lot_name,
-                'boxes': boxes_data,
-                'total_initial': total_initial,
-                'total_remaining': total_remaining,
-                'box_count': len(boxes_data)
-            }
-    
-    return grouped_data
+def parse_datetime_arg(value, end=False):
+    """
+    Parse an ISO date/datetime query argument into a naive UTC datetime.
 
-def calculate_inventory_stats(grouped_data):
-    """Calculate summary statistics from grouped data with error handling"""
-    total_boxes = sum(g.get('box_count', 0)
-                      for lots in grouped_data.values()
-                      for g in lots.values())
-    
-    available_boxes = 0
-    empty_boxes = 0
-    negative_boxes = 0  # Track anomalous negative quantities
-    
-    for lots in grouped_data.values():
-        for g in lots.values():
-            for b in g.get('boxes', []):
-                remaining = b['box'].remaining_quantity
-                # Handle None or unexpected values
-                if remaining is None:
-                    remaining = 0
-                
-                if remaining > 0:
-                    available_boxes += 1
-                elif remaining == 0:
-                    empty_boxes += 1
-                else:  # negative
-                    empty_boxes += 1
-                    negative_boxes += 1
-    
-    total_remaining = sum(g.get('total_remaining', 0)
-                          for lots in grouped_data.values()
-                          for g in lots.values())
-    
-    return {
-        'total_boxes': total_boxes,
-        'available_boxes': available_boxes,
-        'empty_boxes': empty_boxes,
-        'negative_boxes': negative_boxes,
-        'total_remaining': max(0, total_remaining)  # Ensure non-negative
-    }
+    A bare date used as an upper bound (end=True) means the whole day, so
+    it becomes midnight of the following day for an exclusive comparison.
+    Returns None for empty input and raises ValueError for bad input.
+    """
+    if not value or not value.strip():
+        return None
+    value = value.strip()
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
 
 def build_filtered_query(type_filter=None, lot_filter=None, search_query=None):
     """Build base query with common filters - DRY helper"""
@@ -315,18 +177,72 @@ def build_filtered_query(type_filter=None, lot_filter=None, search_query=None):
     if lot_filter:
         query = query.filter(LotNumber.name == lot_filter)
     if search_query and search_query.strip():
-        search_pattern = f'%{search_query.strip()}%'
-        query = query.filter(
-            db.or_(
-                Box.box_id.ilike(search_pattern),
-                Box.barcode.ilike(search_pattern),
-                HardwareType.name.ilike(search_pattern),
-                LotNumber.name.ilike(search_pattern)
-            )
-        )
+        query = query.filter(box_search_clause(search_query))
     
     return query
 
+# Bulk barcode lookups are chunked to stay under SQLite's bound-parameter limit
+BULK_LOOKUP_MAX_BARCODES = 5000
+
+def box_with_type_and_lot_or_404(box_id):
+    """(box, hardware type, lot number) in one joined query, or 404"""
+    return db.session.query(Box, HardwareType, LotNumber)\
+        .join(HardwareType, Box.hardware_type_id == HardwareType.id)\
+        .join(LotNumber, Box.lot_number_id == LotNumber.id)\
+        .filter(Box.id == box_id).first_or_404()
+
+def box_info_query():
+    """Single joined query for the fields returned by the barcode lookup APIs"""
+    return db.session.query(
+        Box.barcode,
+        Box.box_id,
+        Box.remaining_quantity,
+        HardwareType.name.label('type_name'),
+        LotNumber.name.label('lot_name')
+    ).join(HardwareType, Box.hardware_type_id == HardwareType.id)\
+     .join(LotNumber, Box.lot_number_id == LotNumber.id)
+
+def box_info_from_row(row):
+    """Shape a box_info_query row like the get_box_info response"""
+    return {
+        'found': True,
+        'box_id': row.box_id,
+        'hardware_type': row.type_name,
+        'lot_number': row.lot_name,
+        'remaining_quantity': row.remaining_quantity
+    }
+
+# Per-box problems flashed when a box range is rejected
+RANGE_ERRORS_SHOWN = 10
+
+# Keyset pagination for lazily expanded type/lot groups
+BOX_PAGE_SIZE = 50
+BOX_PAGE_MAX_SIZE = 200
+
+# Search-as-you-type suggestions
+BOX_SEARCH_LIMIT = 10
+BOX_SEARCH_MAX_LIMIT = 50
+
+def encode_box_cursor(type_name, lot_name, box_number, box_pk):
+    """Opaque cursor for the (type name, lot name, box_number, id) sort key"""
+    raw = json.dumps([type_name, lot_name, box_number, box_pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_box_cursor(cursor):
+    """Inverse of encode_box_cursor; raises ValueError on malformed input"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != 4:
+        raise ValueError("Invalid cursor")
+    type_name, lot_name, box_number, box_pk = values
+    # Each value is bound against its sort column, so its type must match
+    if not all(isinstance(value, str) for value in (type_name, lot_name, box_number)) \
+            or not isinstance(box_pk, int) or isinstance(box_pk, bool):
+        raise ValueError("Invalid cursor")
+    return values
+
 @app.route('/')
 def index():
     """Home page with navigation options"""
@@ -366,10 +282,14 @@ def admin_logout():
     return redirect(url_for('index'))
 
 @app.route('/add_box', methods=['GET', 'POST'])
+@query_budget(12)
 def add_box():
     """Add a new box to inventory"""
+    if request.method == 'POST' and request.form.get('box_number_end', '').strip():
+        return add_box_range()
     if request.method == 'POST':
         try:
+            begin_write()
             # Get form data
             hardware_type_name = request.form.get('hardware_type', '').strip()
             new_hardware_type = request.form.get('new_hardware_type', '').strip()
@@ -478,7 +398,10 @@ def add_box():
             new_box.qc_personnel = qc_operator
             
             db.session.add(new_box)
-            db.session.commit()
+            db.session.flush()  # Get the box id for its history
+            record_adjustment('add', new_box, initial_quantity)
+            adjust_summary(hardware_type.id, lot_number.id,
+                           box_contribution(initial_quantity, initial_quantity))
             
             # Log the box addition
             log_action(
@@ -496,6 +419,8 @@ def add_box():
                     'barcode': barcode
                 }
             )
+            db.session.commit()
+            box_info_cache.invalidate(barcode)
             
             flash(f"Box {box_id} added successfully!", 'success')
             return redirect(url_for('add_box'))
@@ -511,7 +436,73 @@ def add_box():
     return render_template('add_box.html', types=types, lots=lots)
 
 
+def add_box_range():
+    """Create a numbered series of boxes from the add box form in one transaction"""
+    form_data = request.form.to_dict()
+    hardware_type = (form_data.get('new_hardware_type') or form_data.get('hardware_type', '')).strip()
+    lot_number = (form_data.get('new_lot_number') or form_data.get('lot_number', '')).strip()
+    try:
+        series = expand_box_range(form_data.get('box_number', ''), form_data.get('box_number_end', ''),
+                                  form_data.get('barcode_template', '').strip())
+        result = create_boxes(
+            [{'row': box_number, 'hardware_type': hardware_type, 'lot_number': lot_number,
+              'box_number': box_number, 'initial_quantity': form_data.get('initial_quantity', ''),
+              'barcode': barcode} for box_number, barcode in series],
+            operator=form_data.get('operator', '').strip(),
+            qc_personnel=form_data.get('qc_operator', '').strip(),
+            source='range'
+        )
+    except BoxImportError as e:
+        flash(str(e), 'error')
+        for error in e.errors[:RANGE_ERRORS_SHOWN]:
+            flash(f"Box {error['row']}: {error['error']}", 'error')
+        if len(e.errors) > RANGE_ERRORS_SHOWN:
+            flash(f"...and {len(e.errors) - RANGE_ERRORS_SHOWN} more problems", 'error')
+    except Exception as e:
+        app.logger.error(f"Error adding box range: {str(e)}")
+        flash("An error occurred while adding the boxes", 'error')
+    else:
+        boxes = result['boxes']
+        flash(f"Added {result['created']} boxes: {boxes[0]['box_id']} to {boxes[-1]['box_id']}", 'success')
+        return redirect(url_for('add_box'))
+
+    types = HardwareType.query.all()
+    lots = LotNumber.query.all()
+    return render_template('add_box.html', types=types, lots=lots, form_data=form_data)
+
+@app.route('/import_boxes', methods=['GET', 'POST'])
+@query_budget(12)
+def import_boxes():
+    """Create many boxes from an uploaded CSV/xlsx file in one transaction"""
+    form_data = {}
+    report = None
+    row_errors = []
+    if request.method == 'POST':
+        form_data = request.form.to_dict()
+        upload = request.files.get('file')
+        try:
+            if not upload or not upload.filename:
+                raise BoxImportError("Choose a .csv or .xlsx file to import")
+            report = create_boxes(
+                read_import_file(upload),
+                operator=form_data.get('operator', '').strip(),
+                qc_personnel=form_data.get('qc_operator', '').strip(),
+                source=f"import:{upload.filename}"
+            )
+            flash(f"Imported {report['created']} boxes from {upload.filename}", 'success')
+        except BoxImportError as e:
+            row_errors = e.errors
+            flash(str(e), 'error')
+        except Exception as e:
+            app.logger.error(f"Error importing boxes: {str(e)}")
+            flash("An error occurred while importing the boxes", 'error')
+
+    return render_template('import_boxes.html', form_data=form_data, report=report,
+                           row_errors=row_errors, columns=IMPORT_COLUMNS,
+                           max_rows=MAX_IMPORT_ROWS)
+
 @app.route('/log_event', methods=['GET', 'POST'])
+@query_budget(6)
 def log_event():
     """Log pull/return event with improved validation"""
     if request.method == 'POST':
@@ -541,70 +532,20 @@ def log_event():
             if event_type not in ('pull', 'return'):
                 errors.append("Invalid event type")
             
-            if not mo:
-                errors.append("Manufacturing Order (MO) is required")
-            
-            if not operator:
-                errors.append("Operator name is required")
-            
-            if not qc_personnel:
-                errors.append("QC Personnel name is required")
-            
-            if operator == qc_personnel:
-                errors.append("Operator and QC Personnel cannot be the same")
-            
-            # Find the box
-            box = None
-            if barcode:
-                box = Box.query.filter_by(barcode=barcode).first()
-                if not box:
-                    errors.append("Box with given barcode not found")
+            errors.extend(validate_movement_header(mo, operator, qc_personnel))
             
             if errors:
                 for error in errors:
                     flash(error, 'danger')
                 return redirect(url_for('log_event'))
             
-            # Calculate quantity change (positive for return, negative for pull)
-            change = quantity if event_type == "return" else -quantity
-            new_qty = box.remaining_quantity + change
-
-            if new_qty < 0:
-                flash("Not enough quantity in box", "danger")
+            # Check-and-decrement, PullEvent and ActionLog in one transaction
+            try:
+                record_movement(barcode, quantity, event_type, mo, operator,
+                                qc_personnel, signature)
+            except StockMovementError as e:
+                flash(str(e), "danger")
                 return redirect(url_for('log_event'))
-
-            # Store previous quantity for action log
-            previous_qty = box.remaining_quantity
-            
-            # Update box quantity
-            box.remaining_quantity = new_qty
-            
-            # Create pull event record
-            pull_event = PullEvent()
-            pull_event.box_id = box.id
-            pull_event.quantity = change
-            pull_event.mo = mo
-            pull_event.operator = operator
-            pull_event.qc_personnel = qc_personnel
-            pull_event.signature = signature
-            db.session.add(pull_event)
-            
-            # Create action log record with proper quantity tracking
-            log_action(
-                action_type        = event_type,
-                user               = operator,
-                box_id             = box.box_id,
-                hardware_type      = box.hardware_type.name,
-                lot_number         = box.lot_number.name,
-                previous_quantity  = previous_qty,
-                quantity_change    = change,
-                available_quantity = box.remaining_quantity,
-                operator           = operator,
-                qc_personnel       = qc_personnel,
-                details            = {"mo": mo, "signature": signature}
-            )
-            
-            db.session.commit()
             
             flash("Event logged successfully!", "success")
             return redirect(url_for('log_event'))
@@ -616,24 +557,42 @@ def log_event():
     
     return render_template('log_event.html')
 
+@app.route('/api/log_events/batch', methods=['POST'])
+def log_event_batch():
+    """Apply all pull/return lines for one MO in a single transaction"""
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'error': "Request body must be a JSON object"}), 400
+    lines = payload.get('lines') or []
+    if not isinstance(lines, list):
+        return jsonify({'success': False, 'error': "'lines' must be a list"}), 400
+    try:
+        applied = record_batch(
+            lines,
+            mo=str(payload.get('mo') or '').strip(),
+            operator=str(payload.get('operator') or '').strip(),
+            qc_personnel=str(payload.get('qc_personnel') or '').strip(),
+            signature=str(payload.get('signature') or '').strip()
+        )
+    except StockMovementError as e:
+        return jsonify({'success': False, 'error': str(e), 'errors': e.errors}), 400
+    except Exception as e:
+        app.logger.error(f"Error logging batch events: {str(e)}")
+        return jsonify({'success': False, 'error': "An error occurred while logging the batch"}), 500
+    
+    return jsonify({'success': True, 'lines': applied})
+
 @app.route('/dashboard')
+@query_budget(4)
 def dashboard():
     """Inventory dashboard with grouped display"""
     # Get filter parameters
     type_filter = request.args.get('type_filter', '')
     lot_filter = request.args.get('lot_filter', '')
     
-    # Use DRY filter helper
-    query = build_filtered_query(type_filter, lot_filter)
-    
-    # Order by type name first, then lot name, then box number
-    results = query.order_by(HardwareType.name, LotNumber.name, Box.box_number).all()
-    
-    # Group boxes using helper function
-    grouped_data = group_boxes_by_type_lot(results)
-    
-    # Calculate statistics
-    total_stats = calculate_inventory_stats(grouped_data)
+    # Group headers and summary cards come from the aggregate table;
+    # each group's boxes are loaded on demand from /api/boxes
+    grouped_data, total_stats = load_summary_groups(type_filter, lot_filter)
     
     # Get unique types and lots for filter dropdowns
     types = HardwareType.query.order_by(HardwareType.name).all()
@@ -648,15 +607,16 @@ def dashboard():
                          lot_filter=lot_filter)
 
 @app.route('/box_logs/<int:box_id>')
+@query_budget(4)
 def box_logs(box_id):
     """View logs for a specific box"""
-    box = Box.query.get_or_404(box_id)
-    hardware_type = HardwareType.query.get(box.hardware_type_id)
-    lot_number = LotNumber.query.get(box.lot_number_id)
+    box, hardware_type, lot_number = box_with_type_and_lot_or_404(box_id)
     
-    # Get pull events for this box (box_id in PullEvent refers to Box.id, not Box.box_id)
-    pull_events = PullEvent.query.filter_by(box_id=box.id)\
-                                .order_by(PullEvent.timestamp.desc()).all()
+    # Get pull events for this box (box_id in PullEvent refers to Box.id, not Box.box_id),
+    # archived ones included
+    event = history_source(PullEvent)
+    pull_events = db.session.query(event).filter(event.box_id == box.id)\
+                                .order_by(event.timestamp.desc()).all()
     
     return render_template('box_logs.html', 
                          box=box, 
@@ -665,6 +625,7 @@ def box_logs(box_id):
                          pull_events=pull_events)
 
 @app.route('/export_excel')
+@query_budget(2)
 def export_excel():
     """Export current inventory to Excel"""
     try:
@@ -672,102 +633,331 @@ def export_excel():
         type_filter = request.args.get('type_filter', '')
         lot_filter = request.args.get('lot_filter', '')
         
-        # Build query
-        query = db.session.query(
-            Box.box_id,
-            HardwareType.name.label('type_name'),
-            LotNumber.name.label('lot_name'),
-            Box.box_number,
-            Box.initial_quantity,
-            Box.remaining_quantity,
-            Box.barcode,
-            Box.created_at
-        ).join(HardwareType, Box.hardware_type_id == HardwareType.id)\
-         .join(LotNumber, Box.lot_number_id == LotNumber.id)
-        
-        # Apply filters
-        if type_filter:
-            query = query.filter(HardwareType.name == type_filter)
-        if lot_filter:
-            query = query.filter(LotNumber.name == lot_filter)
+        # Rows stream from the database into a write-only workbook on disk
+        output, row_count = build_inventory_xlsx(type_filter, lot_filter)
         
-        # Execute query
-        results = query.order_by(Box.box_id).all()
-        
-        # Convert to DataFrame
-        data = []
-        for result in results:
-            data.append({
-                'Box ID': result.box_id,
-                'Hardware Type': result.type_name,
-                'Lot Number': result.lot_name,
-                'Box Number': result.box_number,
-                'Initial Quantity': result.initial_quantity,
-                'Remaining Quantity': result.remaining_quantity,
-                'Barcode': result.barcode,
-                'Created Date': result.created_at.strftime('%Y-%m-%d %H:%M:%S') if result.created_at else ''
-            })
-        
-        if not data:
+        if not row_count:
+            output.close()
             flash("No data to export", 'warning')
             return redirect(url_for('dashboard'))
         
-        df = pd.DataFrame(data)
-        
-        # Create Excel file in memory
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Inventory', index=False)
-            
-            # Get the workbook and worksheet
-            workbook = writer.book
-            worksheet = writer.sheets['Inventory']
-            
-            # Auto-adjust column widths
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-        
-        output.seek(0)
-        
-        # Create response
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename=inventory_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        return response
+        # send_file streams the temp file in chunks and closes (deletes) it after
+        return send_file(
+            output,
+            mimetype=XLSX_MIMETYPE,
+            as_attachment=True,
+            download_name=f'inventory_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+        )
         
     except Exception as e:
         app.logger.error(f"Error exporting Excel: {str(e)}")
         flash("An error occurred while exporting to Excel", 'error')
         return redirect(url_for('dashboard'))
 
+@app.route('/export/pull_events')
+@query_budget(3)
+def export_pull_events():
+    """Stream pull/return history as CSV or NDJSON"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in TEXT_EXPORT_ENCODERS:
+        return jsonify({'error': "format must be 'csv' or 'ndjson'"}), 400
+    
+    try:
+        start = parse_datetime_arg(request.args.get('from'))
+        end = parse_datetime_arg(request.args.get('to'), end=True)
+    except ValueError:
+        return jsonify({'error': "from/to must be ISO dates or datetimes"}), 400
+    
+    rows = pull_event_export_rows(
+        start=start,
+        end=end,
+        type_filter=request.args.get('type', ''),
+        lot_filter=request.args.get('lot', ''),
+        mo_filter=request.args.get('mo', '')
+    )
+    body = TEXT_EXPORT_ENCODERS[export_format](rows, PULL_EVENT_COLUMNS)
+    
+    filename = f'pull_events_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{export_format}'
+    return Response(
+        stream_with_context(body),
+        mimetype=TEXT_EXPORT_MIMETYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+def export_job_response(job):
+    """Public view of a job's state with its status and download links"""
+    data = {key: job[key] for key in ('id', 'kind', 'params', 'status', 'rows_written',
+                                      'total_rows', 'progress', 'error', 'created_at',
+                                      'finished_at')}
+    data['status_url'] = url_for('export_job_status', job_id=job['id'])
+    if job['status'] == 'done':
+        data['download_url'] = url_for('export_job_download', job_id=job['id'])
+    return data
+
+@app.route('/export/jobs', methods=['POST'])
+@query_budget(2)
+def submit_export_job():
+    """Queue a background export; returns a job id to poll"""
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': "Request body must be a JSON object"}), 400
+    params = payload.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': "'params' must be an object"}), 400
+    params = {key: str(value).strip() for key, value in params.items() if value is not None}
+    
+    # Normalise date bounds here so the job runs with exact timestamps
+    try:
+        for key, is_end in (('from', False), ('to', True)):
+            parsed = parse_datetime_arg(params.get(key), end=is_end)
+            params[key] = parsed.isoformat() if parsed else ''
+    except ValueError:
+        return jsonify({'error': "from/to must be ISO dates or datetimes"}), 400
+    
+    try:
+        job = export_jobs.submit(str(payload.get('kind') or ''), params)
+    except ExportJobError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(export_job_response(job)), 202
+
+@app.route('/export/jobs/<job_id>')
+@query_budget(0)
+def export_job_status(job_id):
+    """Progress of a background export"""
+    job = export_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': "Unknown export job"}), 404
+    return jsonify(export_job_response(job))
+
+@app.route('/export/jobs/<job_id>/download')
+@query_budget(0)
+def export_job_download(job_id):
+    """Download the finished artifact of a background export"""
+    job = export_jobs.get(job_id)
+    if job is None or job['status'] != 'done':
+        return jsonify({'error': "Export is not ready"}), 404
+    path = export_jobs.artifact_path(job)
+    if not os.path.exists(path):
+        return jsonify({'error': "Export file has expired"}), 410
+    extension = job['filename'].rsplit('.', 1)[-1]
+    return send_file(path, mimetype=job['mimetype'], as_attachment=True,
+                     download_name=f'{job["kind"]}_{job["id"][:8]}.{extension}')
+
 @app.route('/get_box_info/<barcode>')
+@query_budget(2)
 def get_box_info(barcode):
     """API endpoint to get box info by barcode"""
-    box = Box.query.filter_by(barcode=barcode).first()
-    if box:
-        hardware_type = HardwareType.query.get(box.hardware_type_id)
-        lot_number = LotNumber.query.get(box.lot_number_id)
-        return jsonify({
-            'found': True,
-            'box_id': box.box_id,
-            'hardware_type': hardware_type.name,
-            'lot_number': lot_number.name,
-            'remaining_quantity': box.remaining_quantity
-        })
-    else:
-        return jsonify({'found': False})
+    info = box_info_cache.get(barcode)
+    if info is None:
+        row = box_info_query().filter(Box.barcode == barcode).first()
+        info = box_info_from_row(row) if row else {'found': False}
+        box_info_cache.set(barcode, info)
+    return jsonify(info)
+
+@app.route('/api/boxes/lookup', methods=['POST'])
+@query_budget(2)
+def lookup_boxes():
+    """Resolve many barcodes at once with the same fields as get_box_info"""
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': "Request body must be a JSON object"}), 400
+    barcodes = payload.get('barcodes')
+    if not isinstance(barcodes, list):
+        return jsonify({'error': "'barcodes' must be a list"}), 400
+    
+    # De-duplicate while keeping request order
+    barcodes = list(dict.fromkeys(str(b).strip() for b in barcodes if str(b).strip()))
+    if len(barcodes) > BULK_LOOKUP_MAX_BARCODES:
+        return jsonify({'error': f"At most {BULK_LOOKUP_MAX_BARCODES} barcodes per request"}), 400
+    
+    found = {}
+    for chunk in chunked(barcodes):
+        for row in box_info_query().filter(Box.barcode.in_(chunk)):
+            found[row.barcode] = box_info_from_row(row)
+    
+    results = {barcode: found.get(barcode, {'found': False}) for barcode in barcodes}
+    return jsonify({
+        'results': results,
+        'found_count': len(found),
+        'missing': [b for b in barcodes if b not in found]
+    })
+
+@app.route('/api/boxes')
+@query_budget(2)
+def list_boxes_page():
+    """One keyset-paginated page of boxes, usually for a single type/lot group"""
+    type_name = request.args.get('type_name', '')
+    lot_name = request.args.get('lot_name', '')
+    search_query = request.args.get('search', '')
+    try:
+        limit = min(max(int(request.args.get('limit', BOX_PAGE_SIZE)), 1), BOX_PAGE_MAX_SIZE)
+    except ValueError:
+        limit = BOX_PAGE_SIZE
+    
+    query = build_filtered_query(type_name, lot_name, search_query)
+    sort_key = (HardwareType.name, LotNumber.name, Box.box_number, Box.id)
+    
+    after = request.args.get('after')
+    if after:
+        try:
+            query = query.filter(tuple_(*sort_key) > tuple_(*decode_box_cursor(after)))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(*sort_key).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    boxes = [{
+        'id': box.id,
+        'box_id': box.box_id,
+        'type_name': row_type,
+        'lot_name': row_lot,
+        'box_number': box.box_number,
+        'initial_quantity': box.initial_quantity,
+        'remaining_quantity': box.remaining_quantity,
+        'barcode': box.barcode,
+        'logs_url': url_for('box_logs', box_id=box.id),
+        'edit_url': url_for('edit_box', box_id=box.id),
+        'delete_url': url_for('delete_box', box_id=box.id)
+    } for box, row_type, row_lot in rows]
+    
+    next_cursor = None
+    if has_more:
+        last_box, last_type, last_lot = rows[-1]
+        next_cursor = encode_box_cursor(last_type, last_lot, last_box.box_number, last_box.id)
+    
+    return jsonify({'boxes': boxes, 'next_cursor': next_cursor})
+
+@app.route('/api/boxes/search')
+@query_budget(2)
+@admin_required
+def search_boxes_api():
+    """Top matching boxes for the manage boxes search field, best first"""
+    term = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', BOX_SEARCH_LIMIT)), 1), BOX_SEARCH_MAX_LIMIT)
+    except ValueError:
+        limit = BOX_SEARCH_LIMIT
+    
+    hits = [{
+        'id': row.id,
+        'box_id': row.box_id,
+        'barcode': row.barcode,
+        'type_name': row.type_name,
+        'lot_name': row.lot_name,
+        'remaining_quantity': row.remaining_quantity,
+        'logs_url': url_for('box_logs', box_id=row.id),
+        'edit_url': url_for('edit_box', box_id=row.id)
+    } for row in search_boxes(term, limit)]
+    
+    return jsonify({'query': term.strip(), 'results': hits})
+
+@app.route('/api/inventory/as_of')
+@query_budget(8)
+def inventory_as_of_api():
+    """Per-type/lot and per-box quantities at a point in time (?at=2024-01-31)"""
+    try:
+        at = parse_datetime_arg(request.args.get('at', ''), end=True)
+    except ValueError:
+        return jsonify({'error': "Invalid 'at'; use an ISO date or datetime"}), 400
+    if at is None:
+        return jsonify({'error': "'at' is required"}), 400
+    try:
+        return jsonify(inventory_as_of(
+            at,
+            type_name=request.args.get('type_name', '').strip() or None,
+            lot_name=request.args.get('lot_name', '').strip() or None,
+            include_boxes=request.args.get('boxes', '1') != '0'
+        ))
+    except InventoryHistoryError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/analytics/consumption')
+@query_budget(4)
+def consumption_analytics():
+    """Pulled/returned quantities per day or week by type, lot, MO or operator"""
+    try:
+        start = parse_datetime_arg(request.args.get('from'))
+        end = parse_datetime_arg(request.args.get('to'), end=True)
+    except ValueError:
+        return jsonify({'error': "from/to must be ISO dates or datetimes"}), 400
+    try:
+        top = int(request.args.get('top', CONSUMPTION_TOP_KEYS))
+    except ValueError:
+        return jsonify({'error': "top must be a number"}), 400
+    
+    try:
+        report = consumption_report(
+            group_by=request.args.get('group_by', 'hardware_type'),
+            bucket=request.args.get('bucket', 'day'),
+            start=start,
+            end=end,
+            type_filter=request.args.get('type', ''),
+            lot_filter=request.args.get('lot', ''),
+            mo_filter=request.args.get('mo', ''),
+            operator_filter=request.args.get('operator', ''),
+            top=top
+        )
+    except AnalyticsError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(report)
+
+@app.route('/reorder')
+@query_budget(5)
+def reorder():
+    """Days until stock-out per type/lot at the recent burn rate"""
+    type_filter = request.args.get('type_filter', '')
+    lot_filter = request.args.get('lot_filter', '')
+    status_filter = request.args.get('status', '')
+    if status_filter not in REORDER_STATUSES:
+        status_filter = ''
+    
+    report = reorder_report(type_filter, lot_filter, status_filter)
+    return render_template('reorder.html',
+                         report=report,
+                         statuses=REORDER_STATUSES,
+                         type_filter=type_filter,
+                         lot_filter=lot_filter,
+                         status_filter=status_filter)
+
+@app.route('/api/reorder')
+@query_budget(5)
+def reorder_api():
+    """Stock-out projection per type/lot as JSON, most urgent first"""
+    try:
+        report = reorder_report(
+            type_filter=request.args.get('type', '').strip(),
+            lot_filter=request.args.get('lot', '').strip(),
+            status=request.args.get('status', '').strip()
+        )
+    except ForecastError as e:
+        return jsonify({'error': str(e)}), 400
+    report.pop('hardware_types')
+    report.pop('lot_numbers')
+    return jsonify(report)
+
+@app.route('/admin/box_cache_stats')
+@admin_required
+def box_cache_stats():
+    """Hit/miss counters for the barcode lookup cache"""
+    return jsonify(box_info_cache.stats())
+
+@app.route('/admin/audit_log_stats')
+@admin_required
+def audit_log_stats():
+    """Queue depth and write counters for the audit log writer"""
+    return jsonify(audit_log_writer.stats())
+
+@app.route('/admin/analytics_cache_stats')
+@admin_required
+def analytics_cache_stats():
+    """Analytics result cache counters, for checking charts are being shared"""
+    return jsonify(consumption_cache.stats())
 
 @app.route('/manage_boxes')
+@query_budget(4)
 @admin_required
 def manage_boxes():
     """List and manage all boxes with grouping"""
@@ -776,17 +966,12 @@ def manage_boxes():
     lot_filter = request.args.get('lot_filter', '')
     search_query = request.args.get('search', '')
     
-    # Use DRY filter helper
-    query = build_filtered_query(type_filter, lot_filter, search_query)
-    
-    # Order by type name first, then lot name, then box number
-    results = query.order_by(HardwareType.name, LotNumber.name, Box.box_number).all()
-    
-    # Group boxes using helper function
-    grouped_data = group_boxes_by_type_lot(results)
-    
-    # Calculate statistics with pre-computed lot counts for template
-    total_stats = calculate_inventory_stats(grouped_data)
+    if search_query.strip():
+        # Search narrows the box set, so aggregate the matches in SQL
+        query = build_filtered_query(type_filter, lot_filter, search_query)
+        grouped_data, total_stats = load_filtered_groups(query)
+    else:
+        grouped_data, total_stats = load_summary_groups(type_filter, lot_filter)
     
     # Pre-compute lot counts for each type code to avoid Jinja complexity
     type_code_stats = {}
@@ -811,12 +996,13 @@ def manage_boxes():
                          search_query=search_query)
 
 @app.route('/edit_box/<int:box_id>', methods=['GET', 'POST'])
+@query_budget(12)
 @admin_required
 def edit_box(box_id):
     """Edit an existing box - FULL ADMIN ACCESS"""
-    box = Box.query.get_or_404(box_id)
-    hardware_type = HardwareType.query.get(box.hardware_type_id)
-    lot_number = LotNumber.query.get(box.lot_number_id)
+    if request.method == 'POST':
+        begin_write()
+    box, hardware_type, lot_number = box_with_type_and_lot_or_404(box_id)
     
     if request.method == 'POST':
         try:
@@ -902,6 +1088,10 @@ def edit_box(box_id):
                                      lot_number=lot_number, form_data=form_data, types=types, lots=lots)
             
             # Update box with new values
+            old_barcode = box.barcode
+            old_remaining = box.remaining_quantity
+            adjust_summary(box.hardware_type_id, box.lot_number_id,
+                           box_contribution(box.initial_quantity, box.remaining_quantity, -1))
             if target_hardware_type:
                 box.hardware_type_id = target_hardware_type.id
             if target_lot_number:
@@ -915,7 +1105,9 @@ def edit_box(box_id):
             if target_hardware_type and target_lot_number:
                 box.box_id = generate_box_id(target_hardware_type.name, target_lot_number.name, new_box_number)
             
-            db.session.commit()
+            adjust_summary(box.hardware_type_id, box.lot_number_id,
+                           box_contribution(box.initial_quantity, box.remaining_quantity))
+            record_adjustment('edit', box, new_current_quantity - old_remaining)
             
             # Log the box edit action
             admin_user = session.get('admin_username', 'Unknown Admin')
@@ -931,8 +1123,12 @@ def edit_box(box_id):
                     'new_barcode': new_barcode
                 }
             )
+            # Read before the commit expires the box, which would reload it
+            box_label = box.box_id
+            db.session.commit()
+            box_info_cache.invalidate(old_barcode, new_barcode)
             
-            flash(f"Box {box.box_id} updated successfully!", 'success')
+            flash(f"Box {box_label} updated successfully!", 'success')
             return redirect(url_for('manage_boxes'))
             
         except Exception as e:
@@ -947,26 +1143,29 @@ def edit_box(box_id):
                          lot_number=lot_number, types=types, lots=lots)
 
 @app.route('/delete_box/<int:box_id>', methods=['POST'])
+@query_budget(13)
 @admin_required
 def delete_box(box_id):
     """Delete a box and all its pull events"""
     try:
-        box = Box.query.get_or_404(box_id)
+        begin_write()
+        box, hardware_type, lot_number = box_with_type_and_lot_or_404(box_id)
         box_id_name = box.box_id
         
-        # Check if box has any pull events
-        pull_events_count = PullEvent.query.filter_by(box_id=box_id).count()
+        # Check if box has any pull events, archived ones included
+        pull_events_count = PullEvent.query.filter_by(box_id=box_id).count() + \
+            PullEventArchive.query.filter_by(box_id=box_id).count()
         
-        # Delete all pull events first (due to foreign key constraint)
+        # Keep its movements for as-of queries, then delete all pull events
+        # first (due to foreign key constraint)
+        record_box_delete(box)
         PullEvent.query.filter_by(box_id=box_id).delete()
-        
-        # Get box details for logging before deletion
-        hardware_type = HardwareType.query.get(box.hardware_type_id)
-        lot_number = LotNumber.query.get(box.lot_number_id)
+        PullEventArchive.query.filter_by(box_id=box_id).delete()
         
         # Delete the box
+        adjust_summary(box.hardware_type_id, box.lot_number_id,
+                       box_contribution(box.initial_quantity, box.remaining_quantity, -1))
         db.session.delete(box)
-        db.session.commit()
         
         # Log the box deletion action
         admin_user = session.get('admin_username', 'Unknown Admin')
@@ -982,6 +1181,8 @@ def delete_box(box_id):
                 'remaining_quantity': box.remaining_quantity
             }
         )
+        db.session.commit()
+        box_info_cache.invalidate(box.barcode)
         
         flash(f"Box {box_id_name} and {pull_events_count} pull events deleted successfully!", 'success')
         
@@ -993,49 +1194,113 @@ def delete_box(box_id):
     return redirect(url_for('manage_boxes'))
 
 @app.route('/admin/action_log')
+@query_budget(7)
 @admin_required
 def action_log():
-    """Admin-only action log page"""
-    from collections import Counter
-    
+    """Admin-only action log page, newest first with keyset paging"""
     # Get filter parameters
     action_type_filter = request.args.get('action_type', '')
     user_filter = request.args.get('user', '')
+    date_from = request.args.get('from', '')
+    date_to = request.args.get('to', '')
+    before = request.args.get('before', '')
+    try:
+        limit = min(max(int(request.args.get('limit', ACTION_LOG_PAGE_SIZE)), 1),
+                    ACTION_LOG_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = ACTION_LOG_PAGE_SIZE
     
-    # Build query
-    query = ActionLog.query
-    
-    # Apply filters
-    if action_type_filter:
-        query = query.filter(ActionLog.action_type == action_type_filter)
-    if user_filter:
-        query = query.filter(ActionLog.user.ilike(f'%{user_filter}%'))
+    try:
+        start = parse_datetime_arg(date_from)
+        end = parse_datetime_arg(date_to, end=True)
+    except ValueError:
+        flash('Invalid date filter, use YYYY-MM-DD', 'danger')
+        return redirect(url_for('action_log'))
     
-    # Order by most recent first
-    action_logs = query.order_by(ActionLog.timestamp.desc()).limit(500).all()
+    query = action_log_query(action_type_filter, user_filter, start, end)
     
-    # Calculate summary counts
-    counts = Counter(log.action_type for log in action_logs)
+    try:
+        action_logs, next_cursor = action_log_page(query, before or None, limit)
+    except ValueError:
+        flash('Invalid page cursor', 'danger')
+        return redirect(url_for('action_log'))
     
-    # Get unique action types and users for filter dropdowns
-    action_types = db.session.query(ActionLog.action_type).distinct().all()
-    action_types = [at[0] for at in action_types]
+    # Exact counts over the whole filtered set, not just this page
+    counts = action_type_counts(query)
+    total_count = sum(counts.values())
     
-    users = db.session.query(ActionLog.user).distinct().all()
-    users = [u[0] for u in users]
+    action_types, users = action_log_filter_options.get()
     
     return render_template('admin_action_log.html', 
                          action_logs=action_logs,
                          action_types=action_types,
                          users=users,
                          counts=counts,
+                         total_count=total_count,
+                         next_cursor=next_cursor,
+                         is_first_page=not before,
                          action_type_filter=action_type_filter,
-                         user_filter=user_filter)
+                         user_filter=user_filter,
+                         date_from=date_from,
+                         date_to=date_to)
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations"""
+    applied = upgrade()
+    for step, name in applied:
+        print(f"Applied migration {step}: {name}")
+    print(f"✅ Database schema at version {current_version()}")
+
+@app.cli.command('rebuild-summary')
+def rebuild_summary_command():
+    """Recompute the inventory_summary table from the boxes table"""
+    groups = rebuild_inventory_summary()
+    print(f"✅ Inventory summary rebuilt: {groups} type/lot groups")
+
+@app.cli.command('archive-history')
+@click.option('--days', type=int, default=ARCHIVE_HORIZON_DAYS, show_default=True,
+              help='Archive rows older than this many days')
+@click.option('--dry-run', is_flag=True, help='Only count the rows that would move')
+def archive_history_command(days, dry_run):
+    """Move old pull events and action logs into the archive tables"""
+    moved = archive_history(horizon_days=days, dry_run=dry_run)
+    verb = 'would move' if dry_run else 'moved'
+    for table, rows in moved.items():
+        print(f"{table}: {verb} {rows} rows older than {days} days")
+
+@app.cli.command('inventory-checkpoint')
+def inventory_checkpoint_command():
+    """Snapshot every box's quantity for point-in-time queries (run periodically)"""
+    checkpoint = take_checkpoint()
+    print(f"✅ Inventory checkpoint {checkpoint.id} at {checkpoint.taken_at}: {checkpoint.box_count} boxes")
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """EXPLAIN each route's queries and fail if one misses its index"""
+    from query_plans import check_query_plans
+    results = check_query_plans()
+    for result in results:
+        status = 'PASS' if result['ok'] else 'FAIL'
+        print(f"{status}  {result['route']}: {result['description']}")
+        if not result['ok']:
+            print(f"      expected one of: {', '.join(result['expected'])}")
+            for line in result['plan']:
+                print(f"      {line}")
+    failed = sum(not result['ok'] for result in results)
+    print(f"{len(results) - failed}/{len(results)} queries use their index")
+    if failed:
+        raise SystemExit(1)
+
+@app.route('/metrics')
+@query_budget(0)
+def metrics_endpoint():
+    """Prometheus scrape endpoint; set METRICS_TOKEN to require a bearer token"""
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return 'Unauthorized', 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-# Create tables
-with app.app_context():
-    db.create_all()
-    
 @app.route('/healthz')
 def health_check():
     return 'OK', 200
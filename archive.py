@@ -0,0 +1,105 @@
+"""
+History retention and archival
+Hardware Inventory Tracker
+
+pull_events and action_logs only grow. `flask archive-history` moves rows
+older than the retention horizon into the cold pull_events_archive and
+action_logs_archive tables (same columns, same ids), so the hot tables
+and their indexes stay small. Run it from cron, e.g. nightly.
+
+Readers go through history_source(): when a requested date range reaches
+back to or before the newest archived row, it returns the model aliased
+over hot UNION ALL archive; otherwise it returns the hot model unchanged,
+so recent-history pages never touch the archive.
+"""
+
+import os
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.orm import aliased
+from app import db
+from models import PullEvent, ActionLog, PullEventArchive, ActionLogArchive
+
+ARCHIVE_HORIZON_DAYS = int(os.environ.get("ARCHIVE_HORIZON_DAYS", 365))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", 5000))
+
+# hot model -> cold model
+ARCHIVES = {
+    PullEvent: PullEventArchive,
+    ActionLog: ActionLogArchive,
+}
+
+
+def archive_cutoff(horizon_days=None):
+    """Rows with a timestamp before this (naive UTC) are due for archiving"""
+    if horizon_days is None:
+        horizon_days = ARCHIVE_HORIZON_DAYS
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=horizon_days)
+
+
+def _column_names(model):
+    return [column.name for column in model.__table__.columns]
+
+
+def _archive_model(hot, cold, cutoff, batch_size, dry_run=False):
+    """Move hot rows older than cutoff into cold in batches; returns rows moved"""
+    hot_table, cold_table = hot.__table__, cold.__table__
+    names = _column_names(hot)
+
+    # The newest row always stays hot: SQLite reuses max(id) + 1 once the
+    # highest id is deleted, which would collide with the archived copy
+    newest_id = db.session.query(func.max(hot.id)).scalar()
+    if newest_id is None:
+        return 0
+    due = db.and_(hot.timestamp < cutoff, hot.id < newest_id)
+
+    if dry_run:
+        return db.session.query(func.count(hot.id)).filter(due).scalar()
+
+    moved = 0
+    while True:
+        # Upper id of the next batch, so insert and delete select the same rows
+        batch = select(hot.id).where(due).order_by(hot.id).limit(batch_size).subquery()
+        last_id = db.session.execute(select(func.max(batch.c.id))).scalar()
+        if last_id is None:
+            return moved
+        in_batch = db.and_(due, hot.id <= last_id)
+
+        db.session.execute(insert(cold_table).from_select(
+            names, select(*[hot_table.c[name] for name in names]).where(in_batch)))
+        result = db.session.execute(delete(hot_table).where(in_batch))
+        db.session.commit()
+        moved += result.rowcount
+
+
+def archive_history(horizon_days=None, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    """
+    Archive pull events and action logs older than the horizon.
+
+    Each batch is copied and deleted in one transaction, so an interrupted
+    run loses nothing and can simply be rerun. Returns {table: rows}.
+    """
+    cutoff = archive_cutoff(horizon_days)
+    return {hot.__tablename__: _archive_model(hot, cold, cutoff, batch_size, dry_run)
+            for hot, cold in ARCHIVES.items()}
+
+
+def history_source(hot, start=None):
+    """
+    The entity to query history from for a range beginning at `start`.
+
+    Returns `hot` itself unless the range can include archived rows
+    (start is None or not after the newest archived timestamp), in which
+    case it returns `hot` aliased over hot UNION ALL archive. Queries
+    filter and order on the returned entity's columns as usual.
+    """
+    cold = ARCHIVES[hot]
+    watermark = db.session.query(func.max(cold.timestamp)).scalar()
+    if watermark is None or (start is not None and start > watermark):
+        return hot
+
+    names = _column_names(hot)
+    combined = select(*[hot.__table__.c[name] for name in names]).union_all(
+        select(*[cold.__table__.c[name] for name in names])
+    ).subquery(f'{hot.__tablename__}_all')
+    return aliased(hot, combined)
@@ -0,0 +1,169 @@
+"""
+Admin audit trail writer
+Hardware Inventory Tracker
+
+log_action() entries ride on the caller's transaction instead of costing
+a commit of their own. They are handed over only when the caller's
+session commits, and dropped if it rolls back, so the trail never records
+a change that did not happen. What happens then depends on
+AUDIT_LOG_MODE:
+
+- sync: the ActionLog row is added to the caller's session and commits
+  atomically with the change it describes.
+- batched (default): the entry goes onto a bounded in-memory queue and a
+  background thread bulk-inserts queued entries in batches. When the
+  queue is full the entry is written directly instead of being dropped.
+  The queue is flushed on interpreter exit and from gunicorn's
+  worker_exit hook; a hard kill can lose at most one batch interval.
+
+Pull/return ActionLog rows are not written here: stock_movements inserts
+them in the same transaction as their PullEvent.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+from app import app, db
+from models import ActionLog
+from action_log_queries import action_log_filter_options
+
+AUDIT_LOG_MODE = os.environ.get("AUDIT_LOG_MODE", "batched")
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", 10000))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 500))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", 1.0))  # seconds
+
+# Key in Session.info for entries waiting on the caller's commit
+PENDING_KEY = 'audit_log_pending'
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogWriter:
+    """Bounded queue of ActionLog value dicts drained by one writer thread"""
+
+    def __init__(self, maxsize=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.overflowed = 0
+        self.failed = 0
+
+    def _ensure_thread(self):
+        # Started lazily, and again in a forked worker, where the parent's
+        # thread does not exist
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, values):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(values)
+        except queue.Full:
+            self.overflowed += 1
+            self._write([values])
+
+    def _write(self, batch):
+        try:
+            with app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(insert(ActionLog), batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} audit log entries: {str(e)}")
+
+    def _next_batch(self, timeout):
+        """Block up to timeout for the first entry, then take what is queued"""
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch(self.flush_interval)
+            stop = None in batch
+            batch = [values for values in batch if values is not None]
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def flush(self, timeout=5.0):
+        """Write everything queued so far and stop the writer thread"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+
+    def stats(self):
+        return {
+            'mode': AUDIT_LOG_MODE,
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'overflowed': self.overflowed,
+            'failed': self.failed,
+        }
+
+
+audit_log_writer = AuditLogWriter()
+atexit.register(audit_log_writer.flush)
+
+
+def record_action(values):
+    """
+    Stage an ActionLog entry on the current transaction.
+
+    It is written (sync) or queued (batched) when db.session commits and
+    discarded if it rolls back.
+    """
+    if AUDIT_LOG_MODE == 'sync':
+        db.session.add(ActionLog(**values))
+    db.session.info.setdefault(PENDING_KEY, []).append(values)
+
+
+def record_actions(entries):
+    """
+    Stage many ActionLog entries on the current transaction.
+
+    Like record_action(), but sync mode writes them with one bulk insert.
+    """
+    if AUDIT_LOG_MODE == 'sync':
+        db.session.execute(insert(ActionLog), entries)
+    db.session.info.setdefault(PENDING_KEY, []).extend(entries)
+
+
+@event.listens_for(Session, 'after_commit')
+def _release_pending(session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if not pending:
+        return
+    for values in pending:
+        if AUDIT_LOG_MODE != 'sync':
+            audit_log_writer.enqueue(values)
+        action_log_filter_options.remember(values['action_type'], values['user'])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(PENDING_KEY, None)
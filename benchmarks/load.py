@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark
+Hardware Inventory Tracker
+
+Replays the scan-and-pull workflow against the Flask test client (in
+process, on a freshly seeded database) or against a running server:
+barcode scans via /get_box_info, pull/return POSTs to /log_event,
+dashboard and manage_boxes views, and Excel exports, mixed by weight and
+issued from concurrent worker threads. Reports throughput and
+p50/p95/p99 latency per route and can save the results as JSON for
+comparing runs.
+
+The seeded dataset uses predictable barcodes (LOAD000000, ...), so a
+server can be benchmarked by seeding its database first:
+
+    DATABASE_URL=sqlite:////tmp/load.db python benchmarks/load.py --boxes 20000 --seed-only
+    DATABASE_URL=sqlite:////tmp/load.db gunicorn main:app -w 4 &
+    python benchmarks/load.py --url http://127.0.0.1:8000 --boxes 20000 --concurrency 16
+
+Usage:
+    python benchmarks/load.py --boxes 5000 --events 20000 --requests 2000 --concurrency 8
+    python benchmarks/load.py --mix scan=80,log_event=20 --json load.json
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = 'scan=60,log_event=30,dashboard=4,manage_boxes=4,export_excel=2'
+
+# Fraction of scans that go to the hot fraction of boxes, as on a busy line
+HOT_SCAN_SHARE = 0.8
+HOT_BOX_FRACTION = 0.2
+
+SEED_CHUNK_SIZE = 5000
+
+
+def barcode_for(n):
+    return f'LOAD{n:06d}'
+
+
+def seed_dataset(boxes, types, lots, events, seed=0):
+    """Replace the database contents with a generated dataset of the given size"""
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert, delete
+    from app import app, db
+    from models import (HardwareType, LotNumber, Box, PullEvent, ActionLog, InventorySummary,
+                        PullEventArchive, ActionLogArchive, BoxAdjustment, InventoryCheckpoint,
+                        BoxQuantitySnapshot)
+    from inventory_summary import rebuild_inventory_summary
+    from inventory_history import adjustment_values, take_checkpoint
+
+    rng = random.Random(seed)
+    with app.app_context():
+        for model in (PullEvent, PullEventArchive, ActionLog, ActionLogArchive, BoxQuantitySnapshot,
+                      InventoryCheckpoint, BoxAdjustment, InventorySummary, Box, HardwareType, LotNumber):
+            db.session.execute(delete(model))
+
+        db.session.execute(insert(HardwareType), [{'name': f'LOAD_TYPE_{n:03d}'} for n in range(types)])
+        db.session.execute(insert(LotNumber), [{'name': f'LOAD_LOT_{n:03d}'} for n in range(lots)])
+        type_rows = db.session.query(HardwareType.id, HardwareType.name).order_by(HardwareType.id).all()
+        lot_rows = db.session.query(LotNumber.id, LotNumber.name).order_by(LotNumber.id).all()
+
+        now = datetime.utcnow()
+        # Boxes arrive before the year of generated events
+        created_at = now - timedelta(days=366)
+        for start in range(0, boxes, SEED_CHUNK_SIZE):
+            rows = []
+            for n in range(start, min(start + SEED_CHUNK_SIZE, boxes)):
+                type_id, type_name = type_rows[n % types]
+                lot_id, lot_name = lot_rows[(n // types) % lots]
+                initial = rng.randint(100, 5000)
+                rows.append({
+                    'box_id': f'{type_name}_{lot_name}_{n:06d}',
+                    'hardware_type_id': type_id,
+                    'lot_number_id': lot_id,
+                    'box_number': f'{n:06d}',
+                    'initial_quantity': initial,
+                    # Large enough that benchmark pulls never run a box dry
+                    'remaining_quantity': initial + 1000000,
+                    'barcode': barcode_for(n),
+                    'created_at': created_at,
+                })
+            db.session.execute(insert(Box), rows)
+
+        box_ids = [row[0] for row in db.session.query(Box.id)]
+        moved = dict.fromkeys(box_ids, 0)
+        for start in range(0, events, SEED_CHUNK_SIZE):
+            rows = [{
+                'box_id': rng.choice(box_ids),
+                'quantity': rng.choice((-1, -1, -1, -5, 2)),
+                'qc_personnel': 'load-qc',
+                'operator': 'load-operator',
+                'mo': f'MO-{rng.randrange(1000):04d}',
+                'timestamp': now - timedelta(minutes=rng.randrange(525600)),
+            } for _ in range(start, min(start + SEED_CHUNK_SIZE, events))]
+            for row in rows:
+                moved[row['box_id']] += row['quantity']
+            db.session.execute(insert(PullEvent), rows)
+
+        # The 'add' each box would have had, so as-of replays end at its current quantity
+        box_rows = db.session.query(Box.id, Box.box_id, Box.hardware_type_id, Box.lot_number_id,
+                                    Box.remaining_quantity).order_by(Box.id).all()
+        for start in range(0, len(box_rows), SEED_CHUNK_SIZE):
+            db.session.execute(insert(BoxAdjustment), [
+                dict(adjustment_values('add', box, box.remaining_quantity - moved[box.id]),
+                     timestamp=created_at)
+                for box in box_rows[start:start + SEED_CHUNK_SIZE]])
+        db.session.commit()
+        rebuild_inventory_summary()
+        take_checkpoint()
+
+
+class TestClientTarget:
+    """Requests through the Flask test client, one client per worker"""
+
+    def __init__(self):
+        from app import app
+        self.client = app.test_client()
+
+    def login_admin(self):
+        with self.client.session_transaction() as flask_session:
+            flask_session['is_admin'] = True
+            flask_session['admin_username'] = 'admin'
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpTarget:
+    """Requests to a running server, with a cookie jar per worker"""
+
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def login_admin(self):
+        self.request('POST', '/admin_login', {'username': 'admin', 'password': 'admin123'})
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read() or b'')
+
+
+def scan(target, rng, boxes):
+    if rng.random() < HOT_SCAN_SHARE:
+        n = rng.randrange(max(int(boxes * HOT_BOX_FRACTION), 1))
+    else:
+        n = rng.randrange(boxes)
+    return target.request('GET', f'/get_box_info/{barcode_for(n)}')
+
+
+def log_event(target, rng, boxes):
+    return target.request('POST', '/log_event', {
+        'barcode': barcode_for(rng.randrange(boxes)),
+        'quantity': str(rng.randint(1, 3)),
+        'event_type': rng.choice(('pull', 'pull', 'pull', 'return')),
+        'mo': f'MO-{rng.randrange(1000):04d}',
+        'operator': 'load-operator',
+        'qc_personnel': 'load-qc',
+    })
+
+
+def dashboard(target, rng, boxes):
+    return target.request('GET', '/dashboard')
+
+
+def manage_boxes(target, rng, boxes):
+    return target.request('GET', '/manage_boxes')
+
+
+def export_excel(target, rng, boxes):
+    return target.request('GET', '/export_excel')
+
+
+WORKLOADS = {
+    'scan': scan,
+    'log_event': log_event,
+    'dashboard': dashboard,
+    'manage_boxes': manage_boxes,
+    'export_excel': export_excel,
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in WORKLOADS:
+            raise argparse.ArgumentTypeError(
+                f"unknown workload '{name}' (choose from {', '.join(WORKLOADS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return round(values[index], 2)
+
+
+def run_load(make_target, mix, boxes, total_requests, concurrency, warmup, seed):
+    """Issue the mixed workload; returns {workload: [(latency_ms, status, bytes)]} and wall time"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    counter = {'issued': 0}
+    errors = []
+
+    def worker(worker_id):
+        rng = random.Random(seed * 1000 + worker_id)
+        try:
+            target = make_target()
+            target.login_admin()
+            for _ in range(warmup):
+                scan(target, rng, boxes)
+        except Exception as e:
+            with lock:
+                errors.append(f'setup: {e}')
+            barrier.abort()
+            return
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            return
+        while True:
+            with lock:
+                if counter['issued'] >= total_requests:
+                    return
+                counter['issued'] += 1
+            name = rng.choices(names, weights)[0]
+            began = time.perf_counter()
+            try:
+                status, size = WORKLOADS[name](target, rng, boxes)
+            except Exception as e:
+                status, size = None, 0
+                with lock:
+                    errors.append(f'{name}: {e}')
+            elapsed = (time.perf_counter() - began) * 1000
+            with lock:
+                samples[name].append((elapsed, status, size))
+
+    barrier = threading.Barrier(concurrency + 1)
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        for thread in threads:
+            thread.join()
+        raise SystemExit(f"Worker setup failed: {errors[0] if errors else 'unknown error'}")
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started, errors
+
+
+def summarize(samples, wall_seconds):
+    routes = {}
+    for name, rows in samples.items():
+        if not rows:
+            continue
+        latencies = [row[0] for row in rows]
+        statuses = {}
+        for _, status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        failed = sum(1 for _, status, _ in rows if status is None or status >= 400)
+        routes[name] = {
+            'requests': len(rows),
+            'errors': failed,
+            'throughput_rps': round(len(rows) / wall_seconds, 2),
+            'latency_ms': {
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'mean': round(statistics.mean(latencies), 2),
+                'max': round(max(latencies), 2),
+            },
+            'mean_bytes': round(statistics.mean(row[2] for row in rows)),
+            'statuses': statuses,
+        }
+    return routes
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--boxes', type=int, default=2000, help='boxes in the dataset')
+    parser.add_argument('--types', type=int, default=20, help='hardware types in the dataset')
+    parser.add_argument('--lots', type=int, default=10, help='lot numbers in the dataset')
+    parser.add_argument('--events', type=int, default=10000, help='pull events in the dataset')
+    parser.add_argument('--requests', type=int, default=1000, help='measured requests in total')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent worker threads')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured scans per worker first')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'workload weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-seed', action='store_true',
+                        help='use the database as it is (it must hold a dataset of --boxes)')
+    parser.add_argument('--seed-only', action='store_true',
+                        help='seed DATABASE_URL and exit, for benchmarking a server')
+    parser.add_argument('--json', dest='json_path', help='write results to this file')
+    args = parser.parse_args()
+
+    workdir = None
+    if not args.url:
+        if 'DATABASE_URL' not in os.environ:
+            workdir = tempfile.TemporaryDirectory(prefix='load-benchmark-')
+            os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(workdir.name, "load.db")}'
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        sys.path.insert(0, PROJECT_ROOT)
+
+    if not args.url and not args.no_seed or args.seed_only:
+        began = time.perf_counter()
+        seed_dataset(args.boxes, args.types, args.lots, args.events, args.seed)
+        print(f"Seeded {args.boxes} boxes, {args.events} pull events "
+              f"in {time.perf_counter() - began:.1f}s")
+        if args.seed_only:
+            return
+
+    if args.url:
+        make_target = lambda: HttpTarget(args.url)
+    else:
+        make_target = TestClientTarget
+
+    samples, wall_seconds, errors = run_load(make_target, args.mix, args.boxes, args.requests,
+                                             args.concurrency, args.warmup, args.seed)
+    routes = summarize(samples, wall_seconds)
+    total = sum(route['requests'] for route in routes.values())
+
+    report = {
+        'target': args.url or 'testclient',
+        'revision': git_revision(),
+        'dataset': {'boxes': args.boxes, 'types': args.types, 'lots': args.lots,
+                    'events': args.events},
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(total / wall_seconds, 2),
+        'routes': routes,
+        'exceptions': errors[:20],
+    }
+
+    print(f"Target: {report['target']}  concurrency {args.concurrency}  "
+          f"{total} requests in {wall_seconds:.2f}s ({report['throughput_rps']} req/s)")
+    print(f"{'route':<14}{'reqs':>7}{'errs':>6}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, route in routes.items():
+        latency = route['latency_ms']
+        print(f"{name:<14}{route['requests']:>7}{route['errors']:>6}{route['throughput_rps']:>9}"
+              f"{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}")
+    for error in errors[:5]:
+        print(f"  {error}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if workdir:
+        workdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
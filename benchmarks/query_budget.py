@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Query budget check
+Hardware Inventory Tracker
+
+Seeds a small and a large dataset (fresh SQLite files), requests every
+budgeted route against each through the test client with
+QUERY_BUDGET_MODE=raise, and counts the SQL statements each request
+issues. A route fails if it goes over its @query_budget or if its count
+changes with the dataset size, which is how an N+1 query shows up.
+Batch routes issue a statement per distinct box in the batch by design,
+so they have no budget and are only checked for a constant count, using
+the same batch shape against both datasets.
+Routes that never touch the database (index, admin login/logout,
+healthz and the /admin/*_stats counters) are not requested; every other
+route is.
+Exits non-zero on any failure, so it can run in CI.
+
+Usage:
+    python benchmarks/query_budget.py
+    python benchmarks/query_budget.py --small 20 --large 3000 --json budgets.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter against one dataset; prints one JSON line
+CHILD_SCRIPT = """
+import io, json, sys, threading, time
+sys.path.append('benchmarks')
+from load import seed_dataset, barcode_for
+from sqlalchemy import event
+from app import app, db
+from models import Box
+from box_cache import box_info_cache
+from action_log_queries import action_log_filter_options
+from analytics import consumption_cache
+from burn_rate import burn_rate_forecast
+from export_jobs import export_jobs
+
+boxes = int(sys.argv[1])
+seed_dataset(boxes, types=max(boxes // 50, 2), lots=max(boxes // 100, 2), events=boxes * 5)
+
+main_thread = threading.get_ident()
+counter = {'statements': 0}
+with app.app_context():
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def count(*args):
+        if threading.get_ident() == main_thread:
+            counter['statements'] += 1
+    box_pks = [pk for pk, in db.session.query(Box.id).order_by(Box.id).limit(3)]
+
+client = app.test_client()
+with client.session_transaction() as flask_session:
+    flask_session['is_admin'] = True
+    flask_session['admin_username'] = 'admin'
+
+movement = {'mo': 'MO-1', 'operator': 'op', 'qc_personnel': 'qc'}
+IMPORT_CSV = 'hardware_type,lot_number,box_number,initial_quantity,barcode\\n' + ''.join(
+    f'BUDGET_IMPORT_TYPE,BUDGET_IMPORT_LOT,{n:03d},10,BUDGET-IMPORT-{n}\\n' for n in range(5))
+
+# A finished background export for the status/download routes
+job_id = client.post('/export/jobs', json={'kind': 'pull_events_csv', 'params': {}}).get_json()['id']
+for _ in range(600):
+    if export_jobs.get(job_id)['status'] in ('done', 'failed'):
+        break
+    time.sleep(0.05)
+ROUTES = [
+    ('get_box_info', 'GET', f'/get_box_info/{barcode_for(1)}', None, None),
+    ('lookup_boxes', 'POST', '/api/boxes/lookup', None,
+     {'barcodes': [barcode_for(n) for n in range(min(boxes, 50))]}),
+    ('list_boxes_page', 'GET', '/api/boxes?type_name=LOAD_TYPE_000&lot_name=LOAD_LOT_000', None, None),
+    ('search_boxes_api', 'GET', '/api/boxes/search?q=LOAD00', None, None),
+    ('dashboard', 'GET', '/dashboard', None, None),
+    ('manage_boxes', 'GET', '/manage_boxes', None, None),
+    ('manage_boxes (search)', 'GET', '/manage_boxes?search=LOAD_TYPE_001', None, None),
+    ('box_logs', 'GET', f'/box_logs/{box_pks[0]}', None, None),
+    ('edit_box', 'GET', f'/edit_box/{box_pks[0]}', None, None),
+    ('action_log', 'GET', '/admin/action_log', None, None),
+    ('log_event', 'POST', '/log_event',
+     dict(movement, barcode=barcode_for(2), quantity='1', event_type='pull'), None),
+    ('log_event_batch', 'POST', '/api/log_events/batch', None,
+     dict(movement, lines=[{'barcode': barcode_for(n % 2), 'quantity': 1, 'event_type': 'pull'}
+                           for n in range(20)])),
+    ('add_box', 'POST', '/add_box', {
+        'hardware_type': 'LOAD_TYPE_000', 'lot_number': 'LOAD_LOT_000', 'box_number': 'NEW-1',
+        'initial_quantity': '10', 'barcode': 'BUDGET-NEW-1', 'operator': 'op',
+        'qc_operator': 'qc'}, None),
+    ('add_box (range)', 'POST', '/add_box', {
+        'new_hardware_type': 'BUDGET_TYPE', 'new_lot_number': 'BUDGET_LOT', 'box_number': '001',
+        'box_number_end': '050', 'barcode_template': 'BUDGET-{box}', 'initial_quantity': '10',
+        'operator': 'op', 'qc_operator': 'qc'}, None),
+    ('edit_box (save)', 'POST', f'/edit_box/{box_pks[1]}', {
+        'hardware_type': 'LOAD_TYPE_000', 'lot_number': 'LOAD_LOT_000', 'box_number': 'EDITED',
+        'barcode': barcode_for(1), 'initial_quantity': '10', 'current_quantity': '5'}, None),
+    ('edit_box (move)', 'POST', f'/edit_box/{box_pks[1]}', {
+        'hardware_type': 'LOAD_TYPE_001', 'lot_number': 'LOAD_LOT_001', 'box_number': 'EDITED',
+        'barcode': barcode_for(1), 'initial_quantity': '10', 'current_quantity': '5'}, None),
+    # Most expensive save: creates a type and a lot and changes the barcode
+    ('edit_box (new type)', 'POST', f'/edit_box/{box_pks[1]}', {
+        'new_hardware_type': 'BUDGET_EDIT_TYPE', 'new_lot_number': 'BUDGET_EDIT_LOT',
+        'box_number': 'EDITED', 'barcode': 'BUDGET-EDITED', 'initial_quantity': '10',
+        'current_quantity': '5'}, None),
+    ('delete_box', 'POST', f'/delete_box/{box_pks[2]}', None, None),
+    ('inventory_as_of_api', 'GET', '/api/inventory/as_of?at=2100-01-01', None, None),
+    ('consumption_analytics', 'GET', '/api/analytics/consumption?group_by=lot_number&bucket=week', None, None),
+    ('reorder', 'GET', '/reorder', None, None),
+    ('reorder_api', 'GET', '/api/reorder?status=reorder', None, None),
+    ('export_excel', 'GET', '/export_excel', None, None),
+    ('import_boxes', 'POST', '/import_boxes', {
+        'file': (io.BytesIO(IMPORT_CSV.encode()), 'budget.csv'), 'operator': 'op',
+        'qc_operator': 'qc'}, None),
+    ('export_pull_events', 'GET', '/export/pull_events?format=ndjson&mo=MO-0001', None, None),
+    ('submit_export_job', 'POST', '/export/jobs', None,
+     {'kind': 'pull_events_ndjson', 'params': {'mo': 'MO-0002'}}),
+    ('export_job_status', 'GET', f'/export/jobs/{job_id}', None, None),
+    ('export_job_download', 'GET', f'/export/jobs/{job_id}/download', None, None),
+    ('metrics_endpoint', 'GET', '/metrics', None, None),
+]
+
+results = []
+for name, method, path, form, payload in ROUTES:
+    # No warm-up request: a route's first request in a process must fit its budget too
+    box_info_cache.clear()
+    action_log_filter_options.clear()
+    consumption_cache.clear()
+    burn_rate_forecast.clear()
+    counter['statements'] = 0
+    error = None
+    try:
+        response = client.open(path, method=method, data=form, json=payload)
+        # Drain streamed bodies so the statements they issue are counted too
+        response.get_data()
+        response.close()
+        status = response.status_code
+    except Exception as e:
+        status, error = None, f'{type(e).__name__}: {e}'
+    view = app.view_functions.get(name.split(' ')[0])
+    results.append({'route': name, 'status': status, 'statements': counter['statements'],
+                    'budget': getattr(view, 'query_budget', None), 'error': error})
+print(json.dumps(results))
+"""
+
+
+def run_dataset(boxes, workdir):
+    env = dict(os.environ,
+               DATABASE_URL=f'sqlite:///{os.path.join(workdir, f"budget_{boxes}.db")}',
+               EXPORT_DIR=os.path.join(workdir, f'exports_{boxes}'),
+               QUERY_BUDGET_MODE='raise', AUDIT_LOG_MODE='sync', LOG_LEVEL='WARNING',
+               PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, str(boxes)],
+                            cwd=PROJECT_ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"Query budget run for {boxes} boxes failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--small', type=int, default=20, help='boxes in the small dataset')
+    parser.add_argument('--large', type=int, default=2000, help='boxes in the large dataset')
+    parser.add_argument('--json', dest='json_path', help='write results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='query-budget-') as workdir:
+        small = run_dataset(args.small, workdir)
+        large = run_dataset(args.large, workdir)
+
+    report = []
+    failures = 0
+    print(f"{'route':<24}{'small':>7}{'large':>7}{'budget':>8}  result")
+    for s, l in zip(small, large):
+        problems = []
+        if s['error'] or l['error']:
+            problems.append(s['error'] or l['error'])
+        if s['statements'] != l['statements']:
+            problems.append('count grows with data')
+        if s['budget'] is not None and max(s['statements'], l['statements']) > s['budget']:
+            problems.append('over budget')
+        failures += bool(problems)
+        budget = '-' if s['budget'] is None else s['budget']
+        print(f"{s['route']:<24}{s['statements']:>7}{l['statements']:>7}{budget:>8}  "
+              f"{'; '.join(problems) or 'ok'}")
+        report.append({'route': s['route'], 'budget': s['budget'],
+                       'small': s, 'large': l, 'problems': problems})
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'small_boxes': args.small, 'large_boxes': args.large, 'routes': report},
+                      f, indent=2)
+    if failures:
+        raise SystemExit(f"{failures} route(s) failed their query budget")
+
+
+if __name__ == '__main__':
+    main()
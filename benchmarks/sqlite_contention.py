@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+SQLite write-contention benchmark
+Hardware Inventory Tracker
+
+Starts several worker processes against one SQLite file, like gunicorn
+workers, and has each apply pull/return movements through
+record_movement() (mixed with barcode reads) for a fixed time. Reports
+throughput, error rate and latency per SQLITE_PROFILE, so the production
+profile (WAL, busy_timeout, BEGIN IMMEDIATE) can be compared with the
+driver defaults. Each profile gets its own fresh database file.
+
+Usage:
+    python benchmarks/sqlite_contention.py --workers 8 --seconds 10
+    python benchmarks/sqlite_contention.py --profile production --json contention.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs once per database: migrate and create the boxes movements hit
+SETUP_SCRIPT = """
+import sys
+from sqlalchemy import insert
+from app import app, db
+from models import HardwareType, LotNumber, Box
+from inventory_summary import rebuild_inventory_summary
+boxes = int(sys.argv[1])
+with app.app_context():
+    hardware_type = HardwareType(name='BENCH_TYPE')
+    lot_number = LotNumber(name='BENCH_LOT')
+    db.session.add_all([hardware_type, lot_number])
+    db.session.flush()
+    db.session.execute(insert(Box), [{
+        'box_id': f'BENCH_TYPE_BENCH_LOT_{n:05d}',
+        'hardware_type_id': hardware_type.id,
+        'lot_number_id': lot_number.id,
+        'box_number': f'{n:05d}',
+        'initial_quantity': 1000000,
+        'remaining_quantity': 1000000,
+        'barcode': f'BENCH{n:05d}',
+    } for n in range(boxes)])
+    db.session.commit()
+    rebuild_inventory_summary()
+"""
+
+# Runs inside each worker process; prints one JSON line
+WORKER_SCRIPT = """
+import json, random, sys, time
+from app import app, db
+from stock_movements import record_movement, find_box_for_movement
+boxes, start_at, seconds, read_ratio, seed = (int(sys.argv[1]), float(sys.argv[2]),
+                                              float(sys.argv[3]), float(sys.argv[4]), int(sys.argv[5]))
+rng = random.Random(seed)
+latencies, errors, writes, reads = [], {}, 0, 0
+with app.app_context():
+    while time.time() < start_at:
+        time.sleep(0.001)
+    deadline = start_at + seconds
+    while time.time() < deadline:
+        barcode = f'BENCH{rng.randrange(boxes):05d}'
+        began = time.perf_counter()
+        try:
+            if rng.random() < read_ratio:
+                find_box_for_movement(barcode)
+                db.session.commit()
+                reads += 1
+            else:
+                record_movement(barcode, 1, rng.choice(('pull', 'return')), 'MO-BENCH',
+                                'bench', 'bench')
+                writes += 1
+            latencies.append((time.perf_counter() - began) * 1000)
+        except Exception as e:
+            db.session.rollback()
+            message = str(getattr(e, 'orig', e)) or type(e).__name__
+            errors[message] = errors.get(message, 0) + 1
+print(json.dumps({'writes': writes, 'reads': reads, 'errors': errors, 'latencies_ms': latencies}))
+"""
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return round(values[index], 2)
+
+
+def run_profile(profile, args, workdir):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f'sqlite:///{os.path.join(workdir, f"{profile}.db")}',
+        'SQLITE_PROFILE': profile,
+        'LOG_LEVEL': 'WARNING',
+    })
+    subprocess.run([sys.executable, '-c', SETUP_SCRIPT, str(args.boxes)],
+                   cwd=PROJECT_ROOT, env=env, check=True)
+
+    start_at = time.time() + 2.0  # time for every worker to import the app
+    workers = [
+        subprocess.Popen(
+            [sys.executable, '-c', WORKER_SCRIPT, str(args.boxes), str(start_at),
+             str(args.seconds), str(args.read_ratio), str(n)],
+            cwd=PROJECT_ROOT, env=env, stdout=subprocess.PIPE, text=True
+        ) for n in range(args.workers)
+    ]
+    results = []
+    for worker in workers:
+        stdout, _ = worker.communicate()
+        results.append(json.loads(stdout.strip().splitlines()[-1]))
+
+    writes = sum(r['writes'] for r in results)
+    reads = sum(r['reads'] for r in results)
+    errors = {}
+    for r in results:
+        for message, count in r['errors'].items():
+            errors[message] = errors.get(message, 0) + count
+    failed = sum(errors.values())
+    latencies = [value for r in results for value in r['latencies_ms']]
+    attempted = writes + reads + failed
+    return {
+        'profile': profile,
+        'workers': args.workers,
+        'seconds': args.seconds,
+        'writes': writes,
+        'reads': reads,
+        'writes_per_sec': round(writes / args.seconds, 1),
+        'ops_per_sec': round((writes + reads) / args.seconds, 1),
+        'errors': failed,
+        'error_rate': round(failed / attempted, 4) if attempted else 0.0,
+        'error_messages': errors,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': round(max(latencies), 2) if latencies else None,
+            'mean': round(statistics.mean(latencies), 2) if latencies else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8, help='concurrent worker processes')
+    parser.add_argument('--seconds', type=float, default=10.0, help='measured duration per profile')
+    parser.add_argument('--boxes', type=int, default=200, help='boxes the movements are spread over')
+    parser.add_argument('--read-ratio', type=float, default=0.5,
+                        help='fraction of operations that are barcode reads')
+    parser.add_argument('--profile', action='append', choices=('default', 'production'),
+                        help='profile to run (repeatable; default: both)')
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    reports = []
+    with tempfile.TemporaryDirectory(prefix='sqlite-contention-') as workdir:
+        for profile in args.profile or ['default', 'production']:
+            report = run_profile(profile, args, workdir)
+            reports.append(report)
+            latency = report['latency_ms']
+            print(f"{profile:<11} {report['writes_per_sec']:>8} writes/s  "
+                  f"{report['ops_per_sec']:>8} ops/s  errors {report['errors']} "
+                  f"({report['error_rate']:.2%})  p50 {latency['p50']} ms  "
+                  f"p95 {latency['p95']} ms  p99 {latency['p99']} ms")
+            for message, count in sorted(report['error_messages'].items(), key=lambda e: -e[1]):
+                print(f"            {count:>6}  {message}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
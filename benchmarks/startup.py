@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark
+Hardware Inventory Tracker
+
+Starts a fresh Python process per run, imports the app and issues the first
+request through the Flask test client, reporting import time and
+first-request latency. Each run is a new interpreter, like an autoscaled
+instance coming up.
+
+Usage:
+    python benchmarks/startup.py --runs 10 --route /dashboard
+    python benchmarks/startup.py --env SCHEMA_CHECK=skip --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter; prints one JSON line
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+client = app_module.app.test_client()
+response = client.get(sys.argv[1])
+done = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (done - imported) * 1000,
+    'status': response.status_code,
+    'heavy_modules': sorted(m for m in ('pandas', 'openpyxl', 'numpy') if m in sys.modules),
+}))
+"""
+
+
+def run_once(route, env):
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, route],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'min': round(values[0], 2),
+        'median': round(statistics.median(values), 2),
+        'max': round(values[-1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--route', default='/healthz')
+    parser.add_argument('--env', action='append', default=[],
+                        help='extra KEY=VALUE for the child process (repeatable)')
+    parser.add_argument('--json', dest='json_path', help='write results to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    for pair in args.env:
+        key, _, value = pair.partition('=')
+        env[key] = value
+
+    runs = [run_once(args.route, env) for _ in range(args.runs)]
+    report = {
+        'route': args.route,
+        'runs': args.runs,
+        'env': args.env,
+        'import_ms': summarize([r['import_ms'] for r in runs]),
+        'first_request_ms': summarize([r['first_request_ms'] for r in runs]),
+        'statuses': sorted({r['status'] for r in runs}),
+        'heavy_modules_loaded': runs[-1]['heavy_modules'],
+    }
+
+    print(f"Route:              {report['route']} ({args.runs} cold runs)")
+    print(f"Import time (ms):   {report['import_ms']}")
+    print(f"First request (ms): {report['first_request_ms']}")
+    print(f"Heavy modules:      {', '.join(report['heavy_modules_loaded']) or 'none'}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+In-process barcode lookup cache
+Hardware Inventory Tracker
+
+Scanner pages call /get_box_info/<barcode> on every scan. Resolved box info
+is kept here in a bounded LRU with a TTL so repeat scans are a dictionary
+lookup. Every write path that changes a box invalidates its barcode
+explicitly; the TTL only bounds staleness across gunicorn workers, since
+each worker process holds its own cache.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class BoxInfoCache:
+    """Thread-safe LRU cache of box info dicts keyed by barcode"""
+
+    def __init__(self, maxsize=2048, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # barcode -> (expires_at, info)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, barcode):
+        """Return cached info for a barcode, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(barcode)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[barcode]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(barcode)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, barcode, info):
+        """Store info for a barcode, evicting the least recently used entry"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[barcode] = (time.monotonic() + self.ttl, info)
+            self._entries.move_to_end(barcode)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *barcodes):
+        """Drop the given barcodes; call after any write that changes a box"""
+        with self._lock:
+            for barcode in barcodes:
+                if barcode and self._entries.pop(barcode, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for checking the cache is actually absorbing scans"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+box_info_cache = BoxInfoCache(
+    maxsize=int(os.environ.get("BOX_CACHE_SIZE", 2048)),
+    ttl=float(os.environ.get("BOX_CACHE_TTL", 30)),
+)
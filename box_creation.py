@@ -0,0 +1,390 @@
+"""
+Bulk box creation
+Hardware Inventory Tracker
+
+Creates many boxes in one transaction: a shipment uploaded as a CSV or
+xlsx file, or a numbered range entered on the add box form. Every row is
+validated before anything is written. One query per chunk of rows checks
+barcodes and box IDs for uniqueness, types and lots are looked up with IN
+queries and the missing ones inserted in bulk, and the boxes, their
+box_adjustments rows and the summary deltas are written with bulk inserts
+and a single commit. The box_add audit entries go through
+audit_log.record_actions, so they follow AUDIT_LOG_MODE like add_box's.
+Problems are reported per row and nothing is written unless every row is
+valid.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import string
+from collections import defaultdict
+from itertools import zip_longest
+from datetime import datetime, timezone
+from sqlalchemy import insert, select, or_
+from app import db
+from models import HardwareType, LotNumber, Box, BoxAdjustment
+from inventory_summary import adjust_summary, box_contribution, merge_deltas
+from box_cache import box_info_cache
+from audit_log import record_actions
+from sqlite_profile import begin_write, chunked, IN_CHUNK_SIZE
+
+MAX_IMPORT_ROWS = int(os.environ.get("MAX_IMPORT_ROWS", "5000"))
+
+# Accepted header spellings per field, compared lower-cased with spaces as underscores
+IMPORT_COLUMNS = {
+    'hardware_type': ('hardware_type', 'type'),
+    'lot_number': ('lot_number', 'lot'),
+    'box_number': ('box_number', 'box'),
+    'initial_quantity': ('initial_quantity', 'quantity', 'qty'),
+    'barcode': ('barcode',),
+    'operator': ('operator',),
+    'qc_personnel': ('qc_personnel', 'qc_operator', 'qc'),
+}
+REQUIRED_COLUMNS = ('hardware_type', 'lot_number', 'box_number', 'initial_quantity', 'barcode')
+
+# Column sizes from models.py, checked up front so one long value cannot fail the insert
+MAX_LENGTHS = {
+    'hardware_type': 100,
+    'lot_number': 100,
+    'box_number': 50,
+    'barcode': 100,
+    'operator': 50,
+    'qc_personnel': 50,
+}
+
+
+class BoxImportError(Exception):
+    """Raised when boxes cannot be created; the message is user-facing"""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        # Per-row problems: [{'row': n, 'error': msg}]
+        self.errors = errors or []
+
+
+def sanitize_box_id_component(component):
+    """Sanitize a component for use in box ID generation"""
+    # Remove special characters and replace spaces with underscores
+    sanitized = re.sub(r'[^\w\-_]', '_', str(component).strip())
+    # Remove multiple consecutive underscores
+    sanitized = re.sub(r'_+', '_', sanitized)
+    # Remove leading/trailing underscores
+    return sanitized.strip('_')
+
+
+def generate_box_id(hardware_type_name, lot_number_name, box_number):
+    """Generate a unique box ID from components"""
+    type_clean = sanitize_box_id_component(hardware_type_name)
+    lot_clean = sanitize_box_id_component(lot_number_name)
+    box_clean = sanitize_box_id_component(box_number)
+    return f"{type_clean}_{lot_clean}_{box_clean}"
+
+
+def _cell_text(value):
+    """Cell value as stripped text; whole-number floats from Excel lose their .0"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _csv_rows(stream):
+    try:
+        yield from csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise BoxImportError(f"Could not read the CSV file: {e}")
+
+
+def _xlsx_rows(stream):
+    # openpyxl is slow to import and only needed here; keep it off the boot path
+    from openpyxl import load_workbook
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise BoxImportError(f"Could not read the xlsx file: {e}")
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _header_columns(header):
+    """Map each known field to its column index; raises if required ones are missing"""
+    names = [re.sub(r'\s+', '_', _cell_text(cell).lower()) for cell in header]
+    columns = {}
+    for field, spellings in IMPORT_COLUMNS.items():
+        for index, name in enumerate(names):
+            if name in spellings:
+                columns[field] = index
+                break
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+    if missing:
+        raise BoxImportError(f"Missing column(s): {', '.join(missing)}")
+    return columns
+
+
+def read_import_file(file):
+    """
+    Read an uploaded .csv or .xlsx file into row dicts.
+
+    The first row is the header; blank rows are skipped. Each dict has the
+    IMPORT_COLUMNS fields as text plus 'row', the line number in the file,
+    which is what per-row errors refer to.
+    """
+    filename = (file.filename or '').lower()
+    if filename.endswith('.csv'):
+        rows = _csv_rows(file.stream)
+    elif filename.endswith('.xlsx'):
+        rows = _xlsx_rows(file.stream)
+    else:
+        raise BoxImportError("Upload a .csv or .xlsx file")
+
+    header = next(rows, None)
+    if header is None:
+        raise BoxImportError("The file is empty")
+    columns = _header_columns(header)
+
+    parsed = []
+    for row_number, values in enumerate(rows, start=2):
+        cells = [_cell_text(value) for value in values]
+        if not any(cells):
+            continue
+        if len(parsed) >= MAX_IMPORT_ROWS:
+            raise BoxImportError(f"Imports are limited to {MAX_IMPORT_ROWS} rows")
+        row = {field: cells[index] if index < len(cells) else ''
+               for field, index in columns.items()}
+        row['row'] = row_number
+        parsed.append(row)
+    if not parsed:
+        raise BoxImportError("The file has no box rows")
+    return parsed
+
+
+def _range_parts(box_number):
+    match = re.fullmatch(r'(.*?)(\d+)', box_number)
+    if not match:
+        raise BoxImportError("Range box numbers must end in digits, e.g. 001 or A001")
+    return match.group(1), match.group(2)
+
+
+def expand_box_range(first, last, barcode_template):
+    """
+    Box numbers and barcodes for a numbered range, e.g. 001 to 120.
+
+    The numbers keep the prefix and zero padding of `first`; `last` may be
+    given with or without the prefix. The barcode template is formatted
+    with {box} (the box number as written, e.g. A007) and {n} (the integer,
+    so {n:05d} pads it). Returns [(box_number, barcode), ...].
+    """
+    prefix, first_digits = _range_parts(first.strip())
+    last_prefix, last_digits = _range_parts(last.strip())
+    if last_prefix not in ('', prefix):
+        raise BoxImportError("Both ends of the range must use the same prefix")
+    start, end = int(first_digits), int(last_digits)
+    if end < start:
+        raise BoxImportError("The last box number must not be lower than the first")
+    if end - start + 1 > MAX_IMPORT_ROWS:
+        raise BoxImportError(f"Ranges are limited to {MAX_IMPORT_ROWS} boxes")
+
+    fields = {field for _, field, _, _ in string.Formatter().parse(barcode_template) if field is not None}
+    if not fields or not fields <= {'box', 'n'}:
+        raise BoxImportError("The barcode template must contain {box} or {n} and no other fields")
+
+    boxes = []
+    for n in range(start, end + 1):
+        box_number = f"{prefix}{n:0{len(first_digits)}d}"
+        try:
+            barcode = barcode_template.format(box=box_number, n=n)
+        except (ValueError, IndexError) as e:
+            raise BoxImportError(f"Invalid barcode template: {e}")
+        boxes.append((box_number, barcode))
+    return boxes
+
+
+def _validate_row(row, operator, qc_personnel):
+    """Normalised box values for one row and its list of problems"""
+    errors = []
+    values = {
+        'hardware_type': row.get('hardware_type', '').strip(),
+        'lot_number': row.get('lot_number', '').strip(),
+        'box_number': row.get('box_number', '').strip(),
+        'barcode': row.get('barcode', '').strip(),
+        'operator': row.get('operator', '').strip() or operator,
+        'qc_personnel': row.get('qc_personnel', '').strip() or qc_personnel,
+    }
+
+    if not values['hardware_type']:
+        errors.append("Hardware type is required")
+    if not values['lot_number']:
+        errors.append("Lot number is required")
+    if not values['box_number']:
+        errors.append("Box number is required")
+    if not values['barcode']:
+        errors.append("Barcode is required")
+
+    try:
+        values['initial_quantity'] = int(row.get('initial_quantity', ''))
+        if values['initial_quantity'] <= 0:
+            errors.append("Initial quantity must be greater than 0")
+    except (ValueError, TypeError):
+        errors.append("Initial quantity must be a valid number")
+
+    if not values['operator']:
+        errors.append("Operator name is required")
+    if not values['qc_personnel']:
+        errors.append("QC Personnel name is required")
+    if values['operator'] and values['operator'] == values['qc_personnel']:
+        errors.append("Operator and QC Personnel cannot be the same")
+
+    for field, limit in MAX_LENGTHS.items():
+        if len(values[field]) > limit:
+            errors.append(f"{field.replace('_', ' ').capitalize()} is longer than {limit} characters")
+
+    values['box_id'] = generate_box_id(values['hardware_type'], values['lot_number'],
+                                       values['box_number'])
+    return values, errors
+
+
+def _ids_by_name(model, names):
+    """{name: id} for existing rows, inserting the missing names in bulk"""
+    query = select(model.name, model.id)
+    ids = {}
+    for chunk in chunked(names):
+        ids.update(db.session.execute(query.where(model.name.in_(chunk))).all())
+    missing = sorted(names - ids.keys())
+    if missing:
+        db.session.execute(insert(model), [{'name': name} for name in missing])
+        for chunk in chunked(missing):
+            ids.update(db.session.execute(query.where(model.name.in_(chunk))).all())
+    return ids, missing
+
+
+def create_boxes(rows, operator='', qc_personnel='', source=None):
+    """
+    Validate and create boxes from row dicts in one transaction.
+
+    Rows carry the IMPORT_COLUMNS fields and a 'row' number; operator and
+    qc_personnel fill rows that leave them blank. Barcodes and box IDs must
+    be unique within the rows and against the database. Missing hardware
+    types and lot numbers are created. On any problem nothing is written
+    and BoxImportError lists every row error. Returns a dict with the
+    created boxes and the types/lots that were added.
+    """
+    errors = []
+    boxes = []
+    first_row_by_barcode = {}
+    first_row_by_box_id = {}
+    for row in rows:
+        values, row_errors = _validate_row(row, operator, qc_personnel)
+        values['row'] = row['row']
+        barcode, box_id = values['barcode'], values['box_id']
+        if barcode in first_row_by_barcode:
+            row_errors.append(f"Barcode {barcode} is also on row {first_row_by_barcode[barcode]}")
+        elif barcode:
+            first_row_by_barcode[barcode] = values['row']
+        if box_id in first_row_by_box_id:
+            row_errors.append(f"Box ID {box_id} is also on row {first_row_by_box_id[box_id]}")
+        elif values['box_number']:
+            first_row_by_box_id[box_id] = values['row']
+        errors.extend({'row': values['row'], 'error': error} for error in row_errors)
+        boxes.append(values)
+    if not boxes:
+        raise BoxImportError("No boxes to create")
+
+    try:
+        begin_write()
+        # Each query answers both uniqueness checks for a chunk of barcodes and
+        # box IDs; each IN uses its unique index, and together they stay
+        # within the bound-parameter limit
+        existing = []
+        half = IN_CHUNK_SIZE // 2
+        for barcodes, box_ids in zip_longest(chunked(first_row_by_barcode, half),
+                                             chunked(first_row_by_box_id, half), fillvalue=[]):
+            existing.extend(db.session.execute(
+                select(Box.barcode, Box.box_id).where(or_(Box.barcode.in_(barcodes),
+                                                          Box.box_id.in_(box_ids)))
+            ))
+        existing_barcodes = {row.barcode for row in existing}
+        existing_box_ids = {row.box_id for row in existing}
+        for values in boxes:
+            if values['barcode'] in existing_barcodes:
+                errors.append({'row': values['row'], 'error': "Barcode already exists"})
+            if values['box_id'] in existing_box_ids:
+                errors.append({'row': values['row'],
+                               'error': "A box with this Type/Lot/Box combination already exists"})
+        if errors:
+            bad_rows = len({error['row'] for error in errors})
+            raise BoxImportError(f"{bad_rows} of {len(boxes)} boxes have errors; nothing was added",
+                                 errors=sorted(errors, key=lambda e: e['row']))
+
+        type_ids, new_types = _ids_by_name(HardwareType, {b['hardware_type'] for b in boxes})
+        lot_ids, new_lots = _ids_by_name(LotNumber, {b['lot_number'] for b in boxes})
+
+        box_rows = []
+        action_logs = []
+        summary_deltas = defaultdict(list)
+        logged_at = datetime.now(timezone.utc)
+        for values in boxes:
+            quantity = values['initial_quantity']
+            type_id = type_ids[values['hardware_type']]
+            lot_id = lot_ids[values['lot_number']]
+            box_rows.append({
+                'box_id': values['box_id'],
+                'hardware_type_id': type_id,
+                'lot_number_id': lot_id,
+                'box_number': values['box_number'],
+                'initial_quantity': quantity,
+                'remaining_quantity': quantity,
+                'barcode': values['barcode'],
+                'operator': values['operator'],
+                'qc_personnel': values['qc_personnel'],
+            })
+            details = {'barcode': values['barcode']}
+            if source:
+                details['source'] = source
+            action_logs.append({
+                'action_type': 'box_add',
+                'user': values['operator'],
+                'timestamp': logged_at,
+                'box_id': values['box_id'],
+                'hardware_type': values['hardware_type'],
+                'lot_number': values['lot_number'],
+                'previous_quantity': 0,
+                'quantity_change': quantity,
+                'available_quantity': quantity,
+                'operator': values['operator'],
+                'qc_personnel': values['qc_personnel'],
+                'details': json.dumps(details),
+            })
+            summary_deltas[(type_id, lot_id)].append(box_contribution(quantity, quantity))
+
+        box_pks = dict(db.session.execute(
+            insert(Box).returning(Box.barcode, Box.id), box_rows
+        ).all())
+        db.session.execute(insert(BoxAdjustment), [
+            dict(box_pk=box_pks[row['barcode']], kind='add', quantity_change=row['initial_quantity'],
+                 box_id=row['box_id'], hardware_type_id=row['hardware_type_id'],
+                 lot_number_id=row['lot_number_id'])
+            for row in box_rows
+        ])
+        # Same path as add_box, so AUDIT_LOG_MODE and the filter options apply
+        record_actions(action_logs)
+        for (type_id, lot_id), deltas in summary_deltas.items():
+            adjust_summary(type_id, lot_id, merge_deltas(*deltas))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    box_info_cache.invalidate(*first_row_by_barcode)
+
+    return {
+        'created': len(boxes),
+        'hardware_types_created': new_types,
+        'lot_numbers_created': new_lots,
+        'boxes': [{'row': b['row'], 'box_id': b['box_id'], 'barcode': b['barcode']} for b in boxes],
+    }
@@ -0,0 +1,207 @@
+"""
+Indexed box search
+Hardware Inventory Tracker
+
+Substring search over box_id, barcode, hardware type and lot name, served
+by an index instead of a full-table ILIKE scan:
+
+- SQLite: an FTS5 table `boxes_search` with the trigram tokenizer, keyed
+  by boxes.id and kept in sync by triggers on boxes.
+- PostgreSQL: pg_trgm GIN indexes on the four searched columns, queried
+  per table so each ILIKE can use its own index.
+
+Terms shorter than a trigram, and databases where neither feature is
+available, fall back to the original ILIKE filter.
+"""
+
+from sqlalchemy import select, text, literal_column, func, or_, union, case
+from app import db
+from models import HardwareType, LotNumber, Box
+
+# Trigram indexes cannot answer patterns shorter than three characters
+MIN_INDEXED_TERM_LENGTH = 3
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS boxes_search "
+    "USING fts5(box_id, barcode, type_name, lot_name, tokenize='trigram')",
+
+    "CREATE TRIGGER IF NOT EXISTS boxes_search_ai AFTER INSERT ON boxes BEGIN "
+    "INSERT INTO boxes_search(rowid, box_id, barcode, type_name, lot_name) VALUES ("
+    "new.id, new.box_id, new.barcode, "
+    "(SELECT name FROM hardware_types WHERE id = new.hardware_type_id), "
+    "(SELECT name FROM lot_numbers WHERE id = new.lot_number_id)); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS boxes_search_ad AFTER DELETE ON boxes BEGIN "
+    "DELETE FROM boxes_search WHERE rowid = old.id; "
+    "END",
+
+    # Only the searched columns; quantity updates from scans never touch FTS
+    "CREATE TRIGGER IF NOT EXISTS boxes_search_au "
+    "AFTER UPDATE OF box_id, barcode, hardware_type_id, lot_number_id ON boxes BEGIN "
+    "DELETE FROM boxes_search WHERE rowid = old.id; "
+    "INSERT INTO boxes_search(rowid, box_id, barcode, type_name, lot_name) VALUES ("
+    "new.id, new.box_id, new.barcode, "
+    "(SELECT name FROM hardware_types WHERE id = new.hardware_type_id), "
+    "(SELECT name FROM lot_numbers WHERE id = new.lot_number_id)); "
+    "END",
+
+    "DELETE FROM boxes_search",
+
+    "INSERT INTO boxes_search(rowid, box_id, barcode, type_name, lot_name) "
+    "SELECT b.id, b.box_id, b.barcode, t.name, l.name FROM boxes b "
+    "JOIN hardware_types t ON t.id = b.hardware_type_id "
+    "JOIN lot_numbers l ON l.id = b.lot_number_id",
+]
+
+POSTGRESQL_SEARCH_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_boxes_box_id_trgm ON boxes USING gin (box_id gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_boxes_barcode_trgm ON boxes USING gin (barcode gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_hardware_types_name_trgm ON hardware_types USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_lot_numbers_name_trgm ON lot_numbers USING gin (name gin_trgm_ops)",
+]
+
+_backend = None
+
+
+def create_search_index(conn):
+    """Migration step: build the dialect's search index where supported"""
+    if conn.dialect.name == 'sqlite':
+        try:
+            with conn.begin_nested():
+                for ddl in SQLITE_SEARCH_DDL:
+                    conn.execute(text(ddl))
+        except Exception:
+            # SQLite built without FTS5 or older than 3.34 (no trigram tokenizer)
+            pass
+    elif conn.dialect.name == 'postgresql':
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                for ddl in POSTGRESQL_SEARCH_DDL:
+                    conn.execute(text(ddl))
+        except Exception:
+            # pg_trgm not installable by this role
+            pass
+
+
+def search_backend():
+    """'fts5', 'trigram' or 'like', detected once per process (at app startup)"""
+    global _backend
+    if _backend is None:
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            found = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'boxes_search'"
+            )).first()
+            _backend = 'fts5' if found else 'like'
+        elif dialect == 'postgresql':
+            found = db.session.execute(text(
+                "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_boxes_box_id_trgm'"
+            )).first()
+            _backend = 'trigram' if found else 'like'
+        else:
+            _backend = 'like'
+    return _backend
+
+
+def _fts_phrase(term):
+    """Quote a term as an FTS5 phrase so punctuation is matched literally"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _like_clause(term):
+    pattern = _like_pattern(term)
+    return or_(
+        Box.box_id.ilike(pattern, escape='\\'),
+        Box.barcode.ilike(pattern, escape='\\'),
+        HardwareType.name.ilike(pattern, escape='\\'),
+        LotNumber.name.ilike(pattern, escape='\\')
+    )
+
+
+def _fts_matches(term):
+    return select(literal_column('rowid')).select_from(text('boxes_search'))\
+        .where(text('boxes_search MATCH :fts_query').bindparams(fts_query=_fts_phrase(term)))
+
+
+def _trigram_matches(term):
+    pattern = _like_pattern(term)
+    return union(
+        select(Box.id).where(or_(Box.box_id.ilike(pattern, escape='\\'),
+                                 Box.barcode.ilike(pattern, escape='\\'))),
+        select(Box.id).join(HardwareType, Box.hardware_type_id == HardwareType.id)
+                      .where(HardwareType.name.ilike(pattern, escape='\\')),
+        select(Box.id).join(LotNumber, Box.lot_number_id == LotNumber.id)
+                      .where(LotNumber.name.ilike(pattern, escape='\\')),
+    )
+
+
+def box_search_clause(term):
+    """
+    Filter for build_filtered_query; the query must already join
+    HardwareType and LotNumber (needed by the ILIKE fallback).
+    """
+    term = term.strip()
+    backend = search_backend() if len(term) >= MIN_INDEXED_TERM_LENGTH else 'like'
+    if backend == 'fts5':
+        return Box.id.in_(_fts_matches(term))
+    if backend == 'trigram':
+        return Box.id.in_(_trigram_matches(term))
+    return _like_clause(term)
+
+
+def search_boxes(term, limit=10):
+    """
+    Top `limit` boxes for a search-as-you-type box, best matches first.
+
+    Prefix matches on box_id or barcode rank ahead of other substring
+    matches; within each tier FTS5 orders by bm25 and PostgreSQL by
+    trigram similarity.
+    """
+    term = term.strip()
+    if not term:
+        return []
+
+    query = db.session.query(
+        Box.id,
+        Box.box_id,
+        Box.barcode,
+        Box.remaining_quantity,
+        HardwareType.name.label('type_name'),
+        LotNumber.name.label('lot_name')
+    ).join(HardwareType, Box.hardware_type_id == HardwareType.id)\
+     .join(LotNumber, Box.lot_number_id == LotNumber.id)
+
+    prefix = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    prefix_first = case(
+        (or_(Box.box_id.ilike(prefix, escape='\\'), Box.barcode.ilike(prefix, escape='\\')), 0),
+        else_=1
+    )
+
+    backend = search_backend() if len(term) >= MIN_INDEXED_TERM_LENGTH else 'like'
+    if backend == 'fts5':
+        ranked = select(literal_column('rowid').label('box_pk'), literal_column('rank').label('score'))\
+            .select_from(text('boxes_search'))\
+            .where(text('boxes_search MATCH :fts_query').bindparams(fts_query=_fts_phrase(term)))\
+            .subquery()
+        query = query.join(ranked, ranked.c.box_pk == Box.id)\
+                     .order_by(prefix_first, ranked.c.score, Box.box_id)
+    elif backend == 'trigram':
+        similarity = func.greatest(
+            func.similarity(Box.box_id, term),
+            func.similarity(Box.barcode, term),
+            func.similarity(HardwareType.name, term),
+            func.similarity(LotNumber.name, term)
+        )
+        query = query.filter(Box.id.in_(_trigram_matches(term)))\
+                     .order_by(prefix_first, similarity.desc(), Box.box_id)
+    else:
+        query = query.filter(_like_clause(term)).order_by(prefix_first, Box.box_id)
+
+    return query.limit(limit).all()
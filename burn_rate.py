@@ -0,0 +1,219 @@
+"""
+Burn-rate forecasting
+Hardware Inventory Tracker
+
+Projects, for every hardware type/lot, how many days its remaining stock
+lasts at the recent pull rate. Each worker keeps net consumption (pulls
+minus returns) as a day x type/lot matrix covering the longest rate
+window, so the rate for every window and every type/lot comes from one
+pandas pass over the matrix rather than a query per type. Remaining
+quantities come from the inventory_summary table.
+
+The matrix is updated incrementally. When inventory_version() changes,
+only the days since the last refresh are aggregated again in SQL, with one
+GROUP BY over the timestamp index, and those days are replaced in the
+matrix. Every BURN_RATE_REBUILD_SECONDS it is rebuilt from scratch, so
+events of boxes that moved to another type/lot or were deleted are
+attributed again.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func
+from app import db
+from models import Box, PullEvent, HardwareType, LotNumber, InventorySummary
+from archive import history_source
+from inventory_summary import inventory_version
+from analytics import truncate_to_bucket
+
+BURN_RATE_WINDOWS = (7, 28)  # days; the higher rate of the two is projected
+REORDER_LEAD_DAYS = int(os.environ.get("REORDER_LEAD_DAYS", 14))
+BURN_RATE_REBUILD_SECONDS = int(os.environ.get("BURN_RATE_REBUILD_SECONDS", 3600))
+FORECAST_HORIZON_DAYS = 3650  # stock-out dates further out are left blank
+
+# Most urgent first; 'low' covers up to twice the lead time
+REORDER_STATUSES = ('out', 'reorder', 'low', 'ok', 'idle')
+
+SKU_COLUMNS = ['hardware_type_id', 'lot_number_id']
+
+
+class ForecastError(Exception):
+    """Raised for invalid forecast parameters; the message is user-facing"""
+    pass
+
+
+def daily_consumption_query(start):
+    """(type id, lot id, day, net quantity) rows for pull events since `start`"""
+    event = history_source(PullEvent, start)
+    day = truncate_to_bucket(event.timestamp, 'day').label('day')
+    return db.session.query(
+        Box.hardware_type_id,
+        Box.lot_number_id,
+        day,
+        func.sum(event.quantity).label('quantity')
+    ).join(Box, event.box_id == Box.id)\
+     .filter(event.timestamp >= start)\
+     .group_by(Box.hardware_type_id, Box.lot_number_id, day)
+
+
+def _load_days(start):
+    """Consumption matrix (day x (type id, lot id)) since `start`, or None if empty"""
+    import pandas as pd
+
+    frame = pd.DataFrame(daily_consumption_query(start).all(),
+                         columns=SKU_COLUMNS + ['day', 'quantity'])
+    if frame.empty:
+        return None
+    frame['day'] = pd.to_datetime(frame['day'])
+    # Pulls are stored negative, so consumption is the negated sum
+    frame['consumed'] = -frame['quantity'].fillna(0).astype('int64')
+    return frame.pivot_table(index='day', columns=SKU_COLUMNS, values='consumed',
+                             aggfunc='sum', fill_value=0)
+
+
+class BurnRateForecast:
+    """Per-worker consumption matrix and the stock-out projection built from it"""
+
+    def __init__(self, windows=BURN_RATE_WINDOWS, lead_days=REORDER_LEAD_DAYS,
+                 rebuild_seconds=BURN_RATE_REBUILD_SECONDS):
+        self.windows = tuple(sorted(windows))
+        self.lead_days = lead_days
+        self.rebuild_seconds = rebuild_seconds
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._daily = None  # DataFrame: day x (type id, lot id) net consumption
+            self._open_from = None  # start of the oldest day that may still gain events
+            self._rebuilt_at = None
+            self._version = None
+            self._today = None
+            self._forecast = None
+
+    def forecast(self):
+        """Cached forecast, refreshed when inventory has changed or the day has rolled over"""
+        version = inventory_version()
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        today = datetime(now.year, now.month, now.day)
+        with self._lock:
+            if self._forecast is None or version != self._version or today != self._today:
+                self._refresh_daily(today)
+                self._forecast = self._project(now, today)
+                self._version, self._today = version, today
+            return self._forecast
+
+    def _refresh_daily(self, today):
+        import pandas as pd
+
+        start = today - timedelta(days=self.windows[-1] - 1)
+        rebuild = (self._daily is None or
+                   time.monotonic() - self._rebuilt_at >= self.rebuild_seconds)
+        if rebuild:
+            daily = _load_days(start)
+            self._rebuilt_at = time.monotonic()
+        else:
+            since = max(self._open_from, start)
+            fresh = _load_days(since)
+            daily = self._daily[self._daily.index < since]
+            if fresh is not None:
+                daily = pd.concat([daily, fresh]).fillna(0)
+        if daily is None:
+            daily = pd.DataFrame(columns=pd.MultiIndex.from_tuples([], names=SKU_COLUMNS))
+        # Drops days that left the longest window and zero-fills days without events
+        self._daily = daily.reindex(pd.date_range(start, today, freq='D'), fill_value=0)
+        # Today is still open; events committed late may also land on yesterday
+        self._open_from = today - timedelta(days=1)
+
+    def _stock_frame(self):
+        """Current stock per type/lot from the aggregate table, indexed by ids"""
+        import pandas as pd
+
+        rows = db.session.query(
+            InventorySummary.hardware_type_id,
+            InventorySummary.lot_number_id,
+            HardwareType.name,
+            LotNumber.name,
+            InventorySummary.box_count,
+            InventorySummary.available_count,
+            InventorySummary.total_remaining
+        ).join(HardwareType, InventorySummary.hardware_type_id == HardwareType.id)\
+         .join(LotNumber, InventorySummary.lot_number_id == LotNumber.id)\
+         .filter(InventorySummary.box_count > 0).all()
+        return pd.DataFrame(rows, columns=SKU_COLUMNS + [
+            'hardware_type', 'lot_number', 'box_count', 'available_count', 'total_remaining'
+        ]).set_index(SKU_COLUMNS)
+
+    def _project(self, now, today):
+        import numpy as np
+        import pandas as pd
+
+        stock = self._stock_frame()
+        # Windows end now, so today's partial day counts only for the time elapsed
+        elapsed_today = (now - today) / timedelta(days=1)
+        rate_columns = []
+        for window in self.windows:
+            column = f'rate_{window}d'
+            totals = self._daily.iloc[-window:].sum()
+            stock[column] = (totals / (window - 1 + elapsed_today)).clip(lower=0)\
+                .reindex(stock.index, fill_value=0.0)
+            rate_columns.append(column)
+
+        stock['burn_rate'] = stock[rate_columns].max(axis=1)
+        remaining = stock['total_remaining'].fillna(0).clip(lower=0)
+        burning = stock['burn_rate'] > 0
+        stock['days_to_stockout'] = (remaining / stock['burn_rate'].where(burning)).round(1)
+        stock.loc[remaining <= 0, 'days_to_stockout'] = 0.0
+        stock['status'] = np.select(
+            [remaining <= 0, ~burning,
+             stock['days_to_stockout'] <= self.lead_days,
+             stock['days_to_stockout'] <= 2 * self.lead_days],
+            ['out', 'idle', 'reorder', 'low'], default='ok')
+        within_horizon = stock['days_to_stockout'].where(stock['days_to_stockout'] <= FORECAST_HORIZON_DAYS)
+        stock['stockout_date'] = (pd.Timestamp(today) + pd.to_timedelta(within_horizon, unit='D'))\
+            .dt.strftime('%Y-%m-%d')
+        stock[rate_columns + ['burn_rate']] = stock[rate_columns + ['burn_rate']].round(2)
+        stock = stock.sort_values(['days_to_stockout', 'hardware_type', 'lot_number'],
+                                  na_position='last')
+
+        columns = ['hardware_type', 'lot_number', 'box_count', 'available_count', 'total_remaining',
+                   *rate_columns, 'burn_rate', 'days_to_stockout', 'stockout_date', 'status']
+        groups = stock[columns].astype(object).where(stock[columns].notna(), None).to_dict('records')
+        counts = stock['status'].value_counts()
+        return {
+            'as_of': now.isoformat(),
+            'windows': list(self.windows),
+            'lead_days': self.lead_days,
+            'status_counts': {status: int(counts.get(status, 0)) for status in REORDER_STATUSES},
+            'groups': groups,
+            'hardware_types': sorted(stock['hardware_type'].unique().tolist()),
+            'lot_numbers': sorted(stock['lot_number'].unique().tolist()),
+        }
+
+
+def reorder_report(type_filter=None, lot_filter=None, status=None):
+    """
+    Stock-out projection per type/lot, most urgent first.
+
+    Filters apply to the cached forecast, so they cost no queries. Raises
+    ForecastError for an unknown status.
+    """
+    if status and status not in REORDER_STATUSES:
+        raise ForecastError(f"status must be one of: {', '.join(REORDER_STATUSES)}")
+    forecast = burn_rate_forecast.forecast()
+    groups = forecast['groups']
+    if type_filter or lot_filter or status:
+        groups = [group for group in groups
+                  if (not type_filter or group['hardware_type'] == type_filter)
+                  and (not lot_filter or group['lot_number'] == lot_filter)
+                  and (not status or group['status'] == status)]
+    return dict(forecast, groups=groups, filters={
+        'type': type_filter or None,
+        'lot': lot_filter or None,
+        'status': status or None,
+    })
+
+
+burn_rate_forecast = BurnRateForecast()
@@ -0,0 +1,250 @@
+"""
+Background export jobs
+Hardware Inventory Tracker
+
+Large exports run on a bounded thread pool instead of the request thread.
+A job's state lives in a small JSON file next to its artifact in the export
+directory, so any gunicorn worker on the host can report progress or serve
+the download. The job id is derived from the export kind, its filters and
+the inventory version, so resubmitting an unchanged export reuses the
+existing job and its file.
+
+The job file is rewritten on every progress report, so its mtime is the
+job's heartbeat. A queued or running job whose file has not changed for
+EXPORT_STALE_SECONDS is reported as failed (its worker was restarted or
+its thread died) and a new submission runs it again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from app import app, db
+from inventory_summary import inventory_version
+from exports import (inventory_export_query, inventory_export_rows, pull_event_export_query,
+                     pull_event_export_rows, report_progress, write_xlsx, iter_csv, iter_ndjson,
+                     INVENTORY_COLUMNS, PULL_EVENT_COLUMNS, XLSX_MIMETYPE, TEXT_EXPORT_MIMETYPES)
+
+EXPORT_DIR = os.environ.get("EXPORT_DIR", os.path.join(app.instance_path, 'exports'))
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", 2))
+EXPORT_MAX_PENDING = int(os.environ.get("EXPORT_MAX_PENDING", 20))
+EXPORT_ARTIFACT_TTL = int(os.environ.get("EXPORT_ARTIFACT_TTL", 24 * 3600))  # seconds
+EXPORT_STALE_SECONDS = int(os.environ.get("EXPORT_STALE_SECONDS", 15 * 60))
+
+
+class ExportJobError(Exception):
+    """Raised for invalid or rejected job submissions; the message is user-facing"""
+    pass
+
+
+def _parse_iso(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _inventory_xlsx(params, fileobj, progress):
+    rows = inventory_export_rows(params.get('type_filter'), params.get('lot_filter'))
+    write_xlsx(report_progress(rows, progress), INVENTORY_COLUMNS, 'Inventory', fileobj)
+
+
+def _inventory_total(params):
+    return inventory_export_query(params.get('type_filter'), params.get('lot_filter'))\
+        .order_by(None).count()
+
+
+def _pull_event_args(params):
+    return (_parse_iso(params.get('from')), _parse_iso(params.get('to')),
+            params.get('type'), params.get('lot'), params.get('mo'))
+
+
+def _pull_events_writer(encoder):
+    def write(params, fileobj, progress):
+        rows = report_progress(pull_event_export_rows(*_pull_event_args(params)), progress)
+        for chunk in encoder(rows, PULL_EVENT_COLUMNS):
+            fileobj.write(chunk.encode('utf-8'))
+    return write
+
+
+def _pull_events_total(params):
+    return pull_event_export_query(*_pull_event_args(params)).order_by(None).count()
+
+
+# kind -> accepted params, file extension, mimetype, writer, row counter
+EXPORT_KINDS = {
+    'inventory_xlsx': {
+        'params': ('type_filter', 'lot_filter'),
+        'extension': 'xlsx',
+        'mimetype': XLSX_MIMETYPE,
+        'write': _inventory_xlsx,
+        'total': _inventory_total,
+    },
+    'pull_events_csv': {
+        'params': ('from', 'to', 'type', 'lot', 'mo'),
+        'extension': 'csv',
+        'mimetype': TEXT_EXPORT_MIMETYPES['csv'],
+        'write': _pull_events_writer(iter_csv),
+        'total': _pull_events_total,
+    },
+    'pull_events_ndjson': {
+        'params': ('from', 'to', 'type', 'lot', 'mo'),
+        'extension': 'ndjson',
+        'mimetype': TEXT_EXPORT_MIMETYPES['ndjson'],
+        'write': _pull_events_writer(iter_ndjson),
+        'total': _pull_events_total,
+    },
+}
+
+
+class ExportJobRunner:
+    """Submits exports to a bounded pool and tracks them through job files"""
+
+    def __init__(self, export_dir=EXPORT_DIR, max_workers=EXPORT_WORKERS,
+                 max_pending=EXPORT_MAX_PENDING, artifact_ttl=EXPORT_ARTIFACT_TTL,
+                 stale_after=EXPORT_STALE_SECONDS):
+        self.export_dir = export_dir
+        self.max_pending = max_pending
+        self.artifact_ttl = artifact_ttl
+        self.stale_after = stale_after
+        self._executor = None
+        self._max_workers = max_workers
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Created lazily so forked gunicorn workers each start their own threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                thread_name_prefix='export')
+        return self._executor
+
+    def _job_path(self, job_id):
+        return os.path.join(self.export_dir, f'{job_id}.json')
+
+    def artifact_path(self, job):
+        return os.path.join(self.export_dir, job['filename'])
+
+    def _save(self, job):
+        os.makedirs(self.export_dir, exist_ok=True)
+        tmp_path = f'{self._job_path(job["id"])}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._job_path(job['id']))
+
+    def get(self, job_id):
+        """Current state of a job, or None if unknown"""
+        if not job_id.isalnum():
+            return None
+        path = self._job_path(job_id)
+        try:
+            with open(path) as f:
+                job = json.load(f)
+            updated_at = os.path.getmtime(path)
+        except (OSError, ValueError):
+            return None
+        if job['status'] in ('queued', 'running') and time.time() - updated_at > self.stale_after:
+            # Nothing has reported progress for too long; the worker is gone
+            job['status'] = 'failed'
+            job['error'] = "Export stopped responding"
+        return job
+
+    def submit(self, kind, params):
+        """
+        Queue an export and return its job dict.
+
+        An identical export (same kind, filters and inventory version) that
+        is queued, running or done is returned as-is instead of re-running,
+        unless it has gone stale.
+        """
+        spec = EXPORT_KINDS.get(kind)
+        if spec is None:
+            raise ExportJobError(f"Unknown export kind '{kind}'")
+        params = {name: params.get(name) or '' for name in spec['params']}
+
+        version = inventory_version()
+        key = json.dumps([kind, params, version], sort_keys=True)
+        job_id = hashlib.sha256(key.encode()).hexdigest()[:32]
+
+        existing = self.get(job_id)
+        if existing and existing['status'] != 'failed' and (
+                existing['status'] != 'done' or os.path.exists(self.artifact_path(existing))):
+            return existing
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ExportJobError("Too many exports queued, try again shortly")
+            self._pending += 1
+
+        self.prune()
+        job = {
+            'id': job_id,
+            'kind': kind,
+            'params': params,
+            'inventory_version': version,
+            'status': 'queued',
+            'rows_written': 0,
+            'total_rows': None,
+            'progress': 0.0,
+            'filename': f'{job_id}.{spec["extension"]}',
+            'mimetype': spec['mimetype'],
+            'error': None,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'finished_at': None,
+        }
+        self._save(job)
+        self._pool().submit(self._run, dict(job))
+        return job
+
+    def _run(self, job):
+        spec = EXPORT_KINDS[job['kind']]
+        path = self.artifact_path(job)
+        # Per run, so a resubmitted stale job never shares a partial file
+        tmp_path = f'{path}.{uuid.uuid4().hex}.part'
+        try:
+            with app.app_context():
+                job['status'] = 'running'
+                job['total_rows'] = spec['total'](job['params'])
+                self._save(job)
+
+                def progress(rows_written):
+                    job['rows_written'] = rows_written
+                    if job['total_rows']:
+                        job['progress'] = round(min(rows_written / job['total_rows'], 1.0), 4)
+                    self._save(job)
+
+                with open(tmp_path, 'wb') as fileobj:
+                    spec['write'](job['params'], fileobj, progress)
+                db.session.remove()
+
+            os.replace(tmp_path, path)
+            job['status'] = 'done'
+            job['progress'] = 1.0
+        except Exception as e:
+            app.logger.error(f"Export job {job['id']} failed: {str(e)}")
+            job['status'] = 'failed'
+            job['error'] = "Export failed"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            job['finished_at'] = datetime.now(timezone.utc).isoformat()
+            self._save(job)
+            with self._lock:
+                self._pending -= 1
+
+    def prune(self):
+        """Delete job files and artifacts older than the artifact TTL"""
+        if not os.path.isdir(self.export_dir):
+            return
+        cutoff = time.time() - self.artifact_ttl
+        for name in os.listdir(self.export_dir):
+            path = os.path.join(self.export_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+export_jobs = ExportJobRunner()
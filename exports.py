@@ -0,0 +1,260 @@
+"""
+Streaming export engine
+Hardware Inventory Tracker
+
+Rows are streamed from the database in batches and written with openpyxl's
+write-only workbook, which spools worksheet XML to disk instead of building
+cell objects in memory. The finished file is sent to the client in chunks,
+so export memory stays roughly constant regardless of row count.
+"""
+
+import csv
+import io
+import json
+import tempfile
+from itertools import chain, islice
+from app import db
+from models import HardwareType, LotNumber, Box, PullEvent
+from archive import history_source
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+TEXT_EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Rows fetched per round trip when streaming from the database
+EXPORT_BATCH_SIZE = 1000
+
+# Rows inspected to size the columns; the rest are written unseen
+WIDTH_SAMPLE_SIZE = 500
+MAX_COLUMN_WIDTH = 50
+
+INVENTORY_COLUMNS = (
+    'Box ID',
+    'Hardware Type',
+    'Lot Number',
+    'Box Number',
+    'Initial Quantity',
+    'Remaining Quantity',
+    'Barcode',
+    'Created Date',
+)
+
+
+def inventory_export_query(type_filter=None, lot_filter=None):
+    """Filtered, ordered inventory query shared by the export paths"""
+    query = db.session.query(
+        Box.box_id,
+        HardwareType.name.label('type_name'),
+        LotNumber.name.label('lot_name'),
+        Box.box_number,
+        Box.initial_quantity,
+        Box.remaining_quantity,
+        Box.barcode,
+        Box.created_at
+    ).join(HardwareType, Box.hardware_type_id == HardwareType.id)\
+     .join(LotNumber, Box.lot_number_id == LotNumber.id)
+
+    if type_filter:
+        query = query.filter(HardwareType.name == type_filter)
+    if lot_filter:
+        query = query.filter(LotNumber.name == lot_filter)
+    return query.order_by(Box.box_id)
+
+
+def inventory_export_rows(type_filter=None, lot_filter=None):
+    """Yield inventory rows as tuples in INVENTORY_COLUMNS order"""
+    query = inventory_export_query(type_filter, lot_filter)
+    for result in query.yield_per(EXPORT_BATCH_SIZE):
+        yield (
+            result.box_id,
+            result.type_name,
+            result.lot_name,
+            result.box_number,
+            result.initial_quantity,
+            result.remaining_quantity,
+            result.barcode,
+            result.created_at.strftime('%Y-%m-%d %H:%M:%S') if result.created_at else ''
+        )
+
+
+def report_progress(rows, callback, every=EXPORT_BATCH_SIZE):
+    """Pass rows through, calling callback(rows_so_far) every `every` rows and at the end"""
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % every == 0:
+            callback(count)
+    callback(count)
+
+
+def estimate_column_widths(header, sample_rows):
+    """Column widths from the header and a sample of rows, capped like before"""
+    widths = [len(str(name)) for name in header]
+    for row in sample_rows:
+        for index, value in enumerate(row):
+            widths[index] = max(widths[index], len(str(value)))
+    return [min(width + 2, MAX_COLUMN_WIDTH) for width in widths]
+
+
+def write_xlsx(rows, header, sheet_name, fileobj):
+    """
+    Write header + rows to fileobj as an xlsx workbook in write-only mode.
+
+    Returns the number of data rows written. Column widths must be set
+    before the first row in write-only mode, so they are estimated from
+    the first WIDTH_SAMPLE_SIZE rows.
+    """
+    # openpyxl is slow to import and only needed here; keep it off the boot path
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    rows = iter(rows)
+    sample = list(islice(rows, WIDTH_SAMPLE_SIZE))
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_name)
+    for index, width in enumerate(estimate_column_widths(header, sample), start=1):
+        worksheet.column_dimensions[get_column_letter(index)].width = width
+
+    worksheet.append(list(header))
+    count = 0
+    for row in chain(sample, rows):
+        worksheet.append(list(row))
+        count += 1
+
+    workbook.save(fileobj)
+    return count
+
+
+def build_inventory_xlsx(type_filter=None, lot_filter=None):
+    """
+    Export the filtered inventory to a temporary xlsx file.
+
+    Returns (fileobj, row_count) with fileobj rewound; the file is deleted
+    when closed. row_count is 0 when nothing matched.
+    """
+    fileobj = tempfile.TemporaryFile(suffix='.xlsx')
+    try:
+        count = write_xlsx(inventory_export_rows(type_filter, lot_filter),
+                           INVENTORY_COLUMNS, 'Inventory', fileobj)
+    except Exception:
+        fileobj.close()
+        raise
+    fileobj.seek(0)
+    return fileobj, count
+
+
+PULL_EVENT_COLUMNS = (
+    'event_id',
+    'timestamp',
+    'event_type',
+    'quantity',
+    'box_id',
+    'hardware_type',
+    'lot_number',
+    'barcode',
+    'mo',
+    'operator',
+    'qc_personnel',
+    'signature',
+)
+
+
+def pull_event_export_query(start=None, end=None, type_filter=None, lot_filter=None, mo_filter=None):
+    """
+    Filtered, ordered pull-event history query; `end` is exclusive.
+
+    Reads pull_events_archive as well when `start` reaches back into it.
+    """
+    event = history_source(PullEvent, start)
+    query = db.session.query(
+        event.id,
+        event.timestamp,
+        event.quantity,
+        Box.box_id,
+        HardwareType.name.label('type_name'),
+        LotNumber.name.label('lot_name'),
+        Box.barcode,
+        event.mo,
+        event.operator,
+        event.qc_personnel,
+        event.signature
+    ).join(Box, event.box_id == Box.id)\
+     .join(HardwareType, Box.hardware_type_id == HardwareType.id)\
+     .join(LotNumber, Box.lot_number_id == LotNumber.id)
+
+    if start:
+        query = query.filter(event.timestamp >= start)
+    if end:
+        query = query.filter(event.timestamp < end)
+    if type_filter:
+        query = query.filter(HardwareType.name == type_filter)
+    if lot_filter:
+        query = query.filter(LotNumber.name == lot_filter)
+    if mo_filter:
+        query = query.filter(event.mo == mo_filter)
+    return query.order_by(event.timestamp, event.id)
+
+
+def pull_event_export_rows(start=None, end=None, type_filter=None, lot_filter=None, mo_filter=None):
+    """
+    Yield pull-event history as tuples in PULL_EVENT_COLUMNS order.
+
+    stream_results asks the driver for a server-side cursor where it has
+    one (psycopg2), so rows are fetched in batches rather than all at once.
+    """
+    query = pull_event_export_query(start, end, type_filter, lot_filter, mo_filter)\
+        .execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+    for event in query:
+        yield (
+            event.id,
+            event.timestamp.isoformat() if event.timestamp else None,
+            'return' if event.quantity > 0 else 'pull',
+            event.quantity,
+            event.box_id,
+            event.type_name,
+            event.lot_name,
+            event.barcode,
+            event.mo,
+            event.operator,
+            event.qc_personnel,
+            event.signature
+        )
+
+
+def iter_csv(rows, header, batch_size=EXPORT_BATCH_SIZE):
+    """Encode rows as CSV text; the header goes out first, then one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    rows = iter(rows)
+    while True:
+        chunk = buffer.getvalue()
+        if chunk:
+            yield chunk
+        buffer.seek(0)
+        buffer.truncate()
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        writer.writerows(batch)
+
+
+def iter_ndjson(rows, header, batch_size=EXPORT_BATCH_SIZE):
+    """Encode rows as newline-delimited JSON objects keyed by header"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield ''.join(json.dumps(dict(zip(header, row))) + '\n' for row in batch)
+
+
+TEXT_EXPORT_ENCODERS = {
+    'csv': iter_csv,
+    'ndjson': iter_ndjson,
+}
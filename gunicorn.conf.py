@@ -0,0 +1,33 @@
+"""
+Gunicorn settings
+Hardware Inventory Tracker
+
+Picked up automatically by `gunicorn main:app`. With --preload (or
+GUNICORN_PRELOAD=1) the app is imported and the schema version checked
+once in the master; each worker then drops the pooled database
+connections it inherited, since sockets must not be shared across fork.
+On shutdown each worker flushes its queued audit log entries.
+"""
+
+import os
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    from app import app, db
+    from box_cache import box_info_cache
+
+    with app.app_context():
+        # close=False leaves the parent's connections alone and just
+        # forgets them in this process
+        db.engine.dispose(close=False)
+    box_info_cache.clear()
+
+
+def worker_exit(server, worker):
+    from audit_log import audit_log_writer
+
+    audit_log_writer.flush()
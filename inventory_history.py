@@ -0,0 +1,246 @@
+"""
+Point-in-time inventory
+Hardware Inventory Tracker
+
+Answers "what was on the shelf at <time>?" per box and per type/lot.
+Pull events record every movement, and box_adjustments records the other
+changes to a box's remaining quantity: adds, admin edits and deletes
+(a delete also copies the box's pull events there, since delete_box
+removes them). A checkpoint copies every box's state into
+box_quantity_snapshots, so an as-of query loads the latest checkpoint at
+or before the requested time and replays only what happened after it,
+read through the timestamp indexes.
+
+Before the first checkpoint the replay runs backwards from it instead.
+That direction uses each box's type/lot as of the checkpoint, and edits
+made before this history was recorded are not known, so it is a best
+effort for times before the first deploy with checkpoints.
+
+Take checkpoints periodically (e.g. nightly from cron) with
+`flask inventory-checkpoint`; the replay is bounded by the activity since
+the checkpoint.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import select, insert, update, func, literal, text
+from app import db
+from models import (Box, PullEvent, PullEventArchive, BoxAdjustment, InventoryCheckpoint,
+                    BoxQuantitySnapshot, HardwareType, LotNumber)
+from archive import history_source
+from sqlite_profile import begin_write
+
+ADJUSTMENT_COLUMNS = ['box_pk', 'timestamp', 'kind', 'quantity_change', 'box_id',
+                      'hardware_type_id', 'lot_number_id']
+
+
+class InventoryHistoryError(Exception):
+    """Raised when an as-of query cannot be answered; the message is user-facing"""
+    pass
+
+
+def adjustment_values(kind, box, quantity_change):
+    """box_adjustments row for a change to `box` (a Box or a row with the same fields)"""
+    return {
+        'box_pk': box.id,
+        'kind': kind,
+        'quantity_change': quantity_change,
+        'box_id': box.box_id,
+        'hardware_type_id': box.hardware_type_id,
+        'lot_number_id': box.lot_number_id,
+    }
+
+
+def record_adjustment(kind, box, quantity_change, timestamp=None):
+    """Record an add or edit of `box` in the current transaction; does not commit"""
+    values = adjustment_values(kind, box, quantity_change)
+    if timestamp is not None:
+        # Seeders backdate adds to before the history they generate
+        values['timestamp'] = timestamp
+    db.session.execute(insert(BoxAdjustment), [values])
+
+
+def record_box_delete(box):
+    """
+    Record the deletion of `box` before its pull events are removed.
+
+    Its pull events (archived ones included) are copied into box_adjustments
+    as 'movement' rows so as-of queries still see them, followed by a
+    'delete' that takes the box to zero. Does not commit.
+    """
+    for source in (PullEvent, PullEventArchive):
+        db.session.execute(insert(BoxAdjustment).from_select(ADJUSTMENT_COLUMNS, select(
+            source.box_id, source.timestamp, literal('movement'), source.quantity,
+            literal(box.box_id), literal(box.hardware_type_id), literal(box.lot_number_id)
+        ).where(source.box_id == box.id, source.timestamp.isnot(None))))
+    record_adjustment('delete', box, -box.remaining_quantity)
+
+
+def write_checkpoint(conn, taken_at=None):
+    """Copy every box's state into a new checkpoint on `conn`; returns the checkpoint id"""
+    if conn.dialect.name == 'postgresql':
+        # Waits for in-flight box writes and holds new ones off until commit,
+        # so nothing timestamped before taken_at is missing from the copy.
+        # SQLite callers get the same from begin_write().
+        conn.execute(text("LOCK TABLE boxes, pull_events, box_adjustments IN SHARE MODE"))
+    taken_at = taken_at or datetime.now(timezone.utc).replace(tzinfo=None)
+
+    checkpoint_id = conn.execute(
+        insert(InventoryCheckpoint).values(taken_at=taken_at, box_count=0)
+    ).inserted_primary_key[0]
+    copied = conn.execute(insert(BoxQuantitySnapshot).from_select(
+        ['checkpoint_id', 'box_pk', 'box_id', 'hardware_type_id', 'lot_number_id',
+         'remaining_quantity', 'created_at'],
+        select(literal(checkpoint_id), Box.id, Box.box_id, Box.hardware_type_id,
+               Box.lot_number_id, Box.remaining_quantity, Box.created_at)
+    )).rowcount
+    conn.execute(update(InventoryCheckpoint)
+                 .where(InventoryCheckpoint.id == checkpoint_id)
+                 .values(box_count=copied))
+    return checkpoint_id
+
+
+def take_checkpoint():
+    """Write a checkpoint in its own transaction; returns the InventoryCheckpoint"""
+    try:
+        begin_write()
+        checkpoint_id = write_checkpoint(db.session.connection())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return db.session.get(InventoryCheckpoint, checkpoint_id)
+
+
+def nearest_checkpoint(at):
+    """(checkpoint, direction): the latest one at or before `at` (1), else the first one (-1)"""
+    checkpoint = InventoryCheckpoint.query.filter(InventoryCheckpoint.taken_at <= at)\
+        .order_by(InventoryCheckpoint.taken_at.desc()).first()
+    if checkpoint is not None:
+        return checkpoint, 1
+    checkpoint = InventoryCheckpoint.query.order_by(InventoryCheckpoint.taken_at).first()
+    if checkpoint is None:
+        raise InventoryHistoryError("No inventory checkpoint exists yet; run 'flask inventory-checkpoint'")
+    return checkpoint, -1
+
+
+def _box_state(row, remaining_quantity):
+    return {
+        'box_id': row.box_id,
+        'hardware_type_id': row.hardware_type_id,
+        'lot_number_id': row.lot_number_id,
+        'remaining_quantity': remaining_quantity,
+    }
+
+
+def box_quantities_as_of(at):
+    """
+    {box pk: state} for every box that existed just before `at` (naive UTC).
+
+    State is the box_id, type/lot ids and remaining quantity. Returns
+    (states, checkpoint, direction) where direction is 1 when replaying
+    forward from the checkpoint and -1 when replaying backwards.
+    """
+    checkpoint, direction = nearest_checkpoint(at)
+    start, end = (checkpoint.taken_at, at) if direction > 0 else (at, checkpoint.taken_at)
+
+    snapshot = db.session.execute(
+        select(BoxQuantitySnapshot.box_pk, BoxQuantitySnapshot.box_id,
+               BoxQuantitySnapshot.hardware_type_id, BoxQuantitySnapshot.lot_number_id,
+               BoxQuantitySnapshot.remaining_quantity, BoxQuantitySnapshot.created_at)
+        .where(BoxQuantitySnapshot.checkpoint_id == checkpoint.id)
+    )
+    states = {}
+    created_at = {}
+    for row in snapshot:
+        states[row.box_pk] = _box_state(row, row.remaining_quantity)
+        created_at[row.box_pk] = row.created_at
+
+    adjustments = BoxAdjustment.query\
+        .filter(BoxAdjustment.timestamp >= start, BoxAdjustment.timestamp < end)\
+        .order_by(BoxAdjustment.timestamp, BoxAdjustment.id).all()
+    event = history_source(PullEvent, start)
+    movements = db.session.query(event.box_id, func.sum(event.quantity))\
+        .filter(event.timestamp >= start, event.timestamp < end)\
+        .group_by(event.box_id).all()
+
+    if direction > 0:
+        for adjustment in adjustments:
+            state = states.get(adjustment.box_pk)
+            if adjustment.kind == 'add':
+                states[adjustment.box_pk] = _box_state(adjustment, adjustment.quantity_change)
+            elif adjustment.kind == 'delete':
+                states.pop(adjustment.box_pk, None)
+            elif state is not None:
+                state.update(_box_state(adjustment, state['remaining_quantity'] + adjustment.quantity_change))
+    else:
+        for adjustment in reversed(adjustments):
+            if adjustment.kind == 'add':
+                states.pop(adjustment.box_pk, None)
+                continue
+            state = states.get(adjustment.box_pk)
+            if adjustment.kind == 'delete':
+                state = states[adjustment.box_pk] = _box_state(adjustment, 0)
+            if state is not None:
+                state['remaining_quantity'] -= adjustment.quantity_change
+        # Boxes added before box_adjustments existed only have created_at
+        for box_pk, created in created_at.items():
+            if created is not None and created >= at:
+                states.pop(box_pk, None)
+
+    for box_pk, total in movements:
+        state = states.get(box_pk)
+        if state is not None:
+            state['remaining_quantity'] += direction * (total or 0)
+
+    return states, checkpoint, direction
+
+
+def inventory_as_of(at, type_name=None, lot_name=None, include_boxes=True):
+    """
+    Per-type/lot totals (and optionally per-box quantities) just before `at`.
+
+    Returns a JSON-ready dict; type_name/lot_name filter on the names the
+    boxes had at that time.
+    """
+    states, checkpoint, direction = box_quantities_as_of(at)
+
+    type_ids = {state['hardware_type_id'] for state in states.values()}
+    lot_ids = {state['lot_number_id'] for state in states.values()}
+    type_names = dict(db.session.query(HardwareType.id, HardwareType.name)
+                      .filter(HardwareType.id.in_(type_ids))) if type_ids else {}
+    lot_names = dict(db.session.query(LotNumber.id, LotNumber.name)
+                     .filter(LotNumber.id.in_(lot_ids))) if lot_ids else {}
+
+    boxes = []
+    groups = defaultdict(lambda: {'box_count': 0, 'total_remaining': 0})
+    for state in states.values():
+        hardware_type = type_names.get(state['hardware_type_id'])
+        lot_number = lot_names.get(state['lot_number_id'])
+        if (type_name and hardware_type != type_name) or (lot_name and lot_number != lot_name):
+            continue
+        group = groups[(hardware_type or '', lot_number or '')]
+        group['box_count'] += 1
+        group['total_remaining'] += state['remaining_quantity']
+        if include_boxes:
+            boxes.append({
+                'box_id': state['box_id'],
+                'hardware_type': hardware_type,
+                'lot_number': lot_number,
+                'remaining_quantity': state['remaining_quantity'],
+            })
+
+    result = {
+        'as_of': at.isoformat(),
+        'checkpoint': {
+            'id': checkpoint.id,
+            'taken_at': checkpoint.taken_at.isoformat(),
+            'replay': 'forward' if direction > 0 else 'backward',
+        },
+        'groups': [dict(hardware_type=type_key, lot_number=lot_key, **totals)
+                   for (type_key, lot_key), totals in sorted(groups.items())],
+    }
+    if include_boxes:
+        result['boxes'] = sorted(boxes, key=lambda b: (b['hardware_type'] or '', b['lot_number'] or '',
+                                                       b['box_id']))
+    return result
@@ -0,0 +1,216 @@
+"""
+Incrementally maintained inventory aggregates
+Hardware Inventory Tracker
+
+The inventory_summary table holds one row per (hardware type, lot) with box
+counts, quantity totals and available/empty/negative counts. Every stock
+movement and box add/edit/delete applies a delta here inside its own
+transaction, so the dashboard summary cards and group headers are read from
+a handful of rows instead of walking every box.
+"""
+
+from sqlalchemy import select, insert, update, delete, func, case
+from app import db
+from models import HardwareType, LotNumber, Box, PullEvent, InventorySummary
+
+SUMMARY_COUNTERS = (
+    'box_count',
+    'total_initial',
+    'total_remaining',
+    'available_count',
+    'empty_count',
+    'negative_count',
+)
+
+
+def box_contribution(initial_quantity, remaining_quantity, sign=1):
+    """Counters one box adds to (sign=1) or removes from (sign=-1) its group"""
+    remaining = remaining_quantity or 0
+    return {
+        'box_count': sign,
+        'total_initial': sign * (initial_quantity or 0),
+        'total_remaining': sign * remaining,
+        'available_count': sign if remaining > 0 else 0,
+        'empty_count': sign if remaining <= 0 else 0,
+        'negative_count': sign if remaining < 0 else 0,
+    }
+
+
+def merge_deltas(*deltas):
+    """Add counter dicts together"""
+    merged = dict.fromkeys(SUMMARY_COUNTERS, 0)
+    for delta in deltas:
+        for key, value in delta.items():
+            merged[key] += value
+    return merged
+
+
+def movement_delta(previous_quantity, new_quantity):
+    """Counters changed when a box's remaining quantity moves"""
+    return merge_deltas(box_contribution(0, previous_quantity, -1),
+                        box_contribution(0, new_quantity, 1))
+
+
+def _upsert_statement(dialect_name):
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(InventorySummary)
+
+
+def adjust_summary(hardware_type_id, lot_number_id, delta):
+    """
+    Apply a counter delta to one type/lot row, creating it if needed.
+
+    Runs on the current session so it commits or rolls back together with
+    the box write that caused it.
+    """
+    delta = {key: value for key, value in delta.items() if value}
+    if not delta:
+        return
+
+    table = InventorySummary.__table__
+    stmt = _upsert_statement(db.engine.dialect.name)
+    if stmt is not None:
+        values = dict.fromkeys(SUMMARY_COUNTERS, 0)
+        values.update(delta)
+        stmt = stmt.values(hardware_type_id=hardware_type_id,
+                           lot_number_id=lot_number_id,
+                           **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.hardware_type_id, table.c.lot_number_id],
+            set_={key: table.c[key] + stmt.excluded[key] for key in delta}
+        )
+        db.session.execute(stmt)
+        return
+
+    # Portable fallback: update, then insert when the group is new
+    result = db.session.execute(
+        update(table)
+        .where(table.c.hardware_type_id == hardware_type_id)
+        .where(table.c.lot_number_id == lot_number_id)
+        .values({key: table.c[key] + value for key, value in delta.items()})
+    )
+    if result.rowcount == 0:
+        values = dict.fromkeys(SUMMARY_COUNTERS, 0)
+        values.update(delta)
+        db.session.execute(insert(table).values(hardware_type_id=hardware_type_id,
+                                                lot_number_id=lot_number_id,
+                                                **values))
+
+
+def _aggregate_columns():
+    """Set-based equivalents of box_contribution summed over a group"""
+    remaining = func.coalesce(Box.remaining_quantity, 0)
+    return [
+        func.count(Box.id).label('box_count'),
+        func.coalesce(func.sum(Box.initial_quantity), 0).label('total_initial'),
+        func.coalesce(func.sum(remaining), 0).label('total_remaining'),
+        func.sum(case((remaining > 0, 1), else_=0)).label('available_count'),
+        func.sum(case((remaining <= 0, 1), else_=0)).label('empty_count'),
+        func.sum(case((remaining < 0, 1), else_=0)).label('negative_count'),
+    ]
+
+
+def summary_rebuild_statement():
+    """INSERT ... SELECT that recomputes every group from the boxes table"""
+    aggregate = select(
+        Box.hardware_type_id,
+        Box.lot_number_id,
+        *_aggregate_columns()
+    ).group_by(Box.hardware_type_id, Box.lot_number_id)
+    return insert(InventorySummary).from_select(
+        ['hardware_type_id', 'lot_number_id', *SUMMARY_COUNTERS], aggregate
+    )
+
+
+def rebuild_inventory_summary():
+    """Recompute the whole summary table from boxes with one set-based query"""
+    try:
+        db.session.execute(delete(InventorySummary))
+        db.session.execute(summary_rebuild_statement())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return db.session.query(func.count()).select_from(InventorySummary).scalar()
+
+
+def inventory_version():
+    """
+    Cheap fingerprint that changes whenever boxes or pull events change.
+
+    Adds and deletes move the box count/max id, every box UPDATE bumps
+    Box.updated_at, and new events bump the max PullEvent id. Used to key
+    caches of derived data such as export artifacts.
+    """
+    row = db.session.execute(select(
+        select(func.count(Box.id)).scalar_subquery(),
+        select(func.max(Box.id)).scalar_subquery(),
+        select(func.max(Box.updated_at)).scalar_subquery(),
+        select(func.max(PullEvent.id)).scalar_subquery()
+    )).one()
+    return ':'.join('' if value is None else str(value) for value in row)
+
+
+def _build_groups(rows):
+    """
+    Shape aggregate rows (type_name, lot_name + counters) into the
+    type code -> type/lot group structure the templates render, plus the
+    summary card stats.
+    """
+    grouped_data = {}
+    totals = dict.fromkeys(SUMMARY_COUNTERS, 0)
+    for row in rows:
+        type_name, lot_name = row.type_name, row.lot_name
+        type_code = type_name[:3]
+        group = {'type_name': type_name, 'lot_name': lot_name}
+        for key in SUMMARY_COUNTERS:
+            group[key] = getattr(row, key) or 0
+            totals[key] += group[key]
+        grouped_data.setdefault(type_code, {})[f"{type_name}__{lot_name}"] = group
+
+    total_stats = {
+        'total_boxes': totals['box_count'],
+        'available_boxes': totals['available_count'],
+        'empty_boxes': totals['empty_count'],
+        'negative_boxes': totals['negative_count'],
+        'total_remaining': max(0, totals['total_remaining'])
+    }
+    return grouped_data, total_stats
+
+
+def load_summary_groups(type_filter=None, lot_filter=None):
+    """Group headers and summary stats straight from the aggregate table"""
+    query = db.session.query(
+        HardwareType.name.label('type_name'),
+        LotNumber.name.label('lot_name'),
+        *(getattr(InventorySummary, key) for key in SUMMARY_COUNTERS)
+    ).join(HardwareType, InventorySummary.hardware_type_id == HardwareType.id)\
+     .join(LotNumber, InventorySummary.lot_number_id == LotNumber.id)\
+     .filter(InventorySummary.box_count > 0)
+
+    if type_filter:
+        query = query.filter(HardwareType.name == type_filter)
+    if lot_filter:
+        query = query.filter(LotNumber.name == lot_filter)
+
+    return _build_groups(query.order_by(HardwareType.name, LotNumber.name))
+
+
+def load_filtered_groups(box_query):
+    """
+    Group headers and stats for an arbitrary filtered box query.
+
+    Used when a search narrows the box set so the stored aggregates do not
+    apply; the grouping still runs in SQL rather than over loaded boxes.
+    """
+    query = box_query.with_entities(
+        HardwareType.name.label('type_name'),
+        LotNumber.name.label('lot_name'),
+        *_aggregate_columns()
+    ).group_by(HardwareType.name, LotNumber.name)
+    return _build_groups(query.order_by(HardwareType.name, LotNumber.name))
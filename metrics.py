@@ -0,0 +1,172 @@
+"""
+Request and SQL metrics
+Hardware Inventory Tracker
+
+Per-endpoint request latency histograms, response sizes and SQL
+statement counts/time, collected in process and rendered at /metrics in
+the Prometheus text format. SQL is timed with SQLAlchemy cursor events
+and attributed to the endpoint of the request that issued it; statements
+from background threads (export jobs, the audit writer) are counted
+under endpoint="background".
+
+Recording a request costs a few perf_counter() calls and dictionary
+updates under one lock, so it can stay on in production. Each gunicorn
+worker keeps its own counters and a scrape reads one worker; counters
+are labelled with the worker pid so series from different workers do
+not get mixed up. Set METRICS_ENABLED=0 to turn collection off.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a label tuple"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+
+class Metrics:
+    """Collects request/SQL metrics for one app and renders them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_latency = Histogram(LATENCY_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+        self.request_statements = Histogram(STATEMENT_BUCKETS)
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.statements = {}  # endpoint -> [count, seconds]
+
+    def init_app(self, app, engine):
+        if not METRICS_ENABLED:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    @staticmethod
+    def _endpoint():
+        if has_request_context():
+            return request.endpoint or 'unmatched'
+        return 'background'
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_statements = 0
+
+    def _finish_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        # None for streamed responses; their body size is not known here
+        size = response.calculate_content_length()
+        with self._lock:
+            key = (endpoint, request.method, str(response.status_code))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.request_latency.observe((endpoint, request.method), elapsed)
+            self.request_statements.observe((endpoint,), g.get('metrics_statements', 0))
+            if size is not None:
+                self.response_size.observe((endpoint,), size)
+        return response
+
+    # Start times are keyed by execution context, so a statement that fails
+    # can drop its own entry whichever stage it failed in
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', {})[context] = time.perf_counter()
+
+    def _handle_error(self, exception_context):
+        conn = exception_context.connection
+        if conn is not None:
+            conn.info.get('metrics_started', {}).pop(exception_context.execution_context, None)
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('metrics_started', {}).pop(context, None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = self._endpoint()
+        if endpoint != 'background' and 'metrics_statements' in g:
+            g.metrics_statements += 1
+        with self._lock:
+            totals = self.statements.get(endpoint)
+            if totals is None:
+                totals = self.statements[endpoint] = [0, 0.0]
+            totals[0] += 1
+            totals[1] += elapsed
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        pid = str(os.getpid())
+        lines = []
+
+        def labels(**values):
+            values['worker'] = pid
+            inner = ','.join(f'{name}="{_escape(value)}"' for name, value in values.items())
+            return '{' + inner + '}'
+
+        def histogram(name, help_text, histogram, label_names):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for label_values, series in sorted(histogram.series.items()):
+                base = dict(zip(label_names, label_values))
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), series):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{labels(**base, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{labels(**base)} {series[-1]}')
+                lines.append(f'{name}_count{labels(**base)} {cumulative}')
+
+        with self._lock:
+            lines.append('# HELP http_requests_total Requests handled, by endpoint, method and status.')
+            lines.append('# TYPE http_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total'
+                             f'{labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+            histogram('http_request_duration_seconds', 'Time to produce the response.',
+                      self.request_latency, ('endpoint', 'method'))
+            histogram('http_response_size_bytes', 'Response body size (non-streamed responses).',
+                      self.response_size, ('endpoint',))
+            histogram('db_statements_per_request', 'SQL statements issued per request.',
+                      self.request_statements, ('endpoint',))
+
+            lines.append('# HELP db_statements_total SQL statements executed, by endpoint.')
+            lines.append('# TYPE db_statements_total counter')
+            for endpoint, (count, _) in sorted(self.statements.items()):
+                lines.append(f'db_statements_total{labels(endpoint=endpoint)} {count}')
+            lines.append('# HELP db_statement_seconds_total Time spent executing SQL, by endpoint.')
+            lines.append('# TYPE db_statement_seconds_total counter')
+            for endpoint, (_, seconds) in sorted(self.statements.items()):
+                lines.append(f'db_statement_seconds_total{labels(endpoint=endpoint)} {seconds:.6f}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
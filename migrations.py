@@ -0,0 +1,201 @@
+"""
+Versioned schema migrations
+Hardware Inventory Tracker
+
+The schema_version table records which numbered steps have been applied.
+`flask db-upgrade` (or the guarded startup hook) applies any pending steps
+in order, each in its own transaction, while holding a cross-process lock:
+a PostgreSQL advisory lock, or a lock file next to the SQLite database.
+Workers that find the schema current only run one SELECT at boot.
+
+Steps must be safe on a freshly created database as well as on old ones:
+step 1 creates every missing table from the models, so later steps check
+before altering.
+"""
+
+import fcntl
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from sqlalchemy import inspect, text, select, delete
+from app import app, db
+from models import Box, InventorySummary, InventoryCheckpoint
+from inventory_summary import summary_rebuild_statement
+from box_search import create_search_index
+from inventory_history import write_checkpoint
+
+# Arbitrary constant identifying this app's migration lock on PostgreSQL
+ADVISORY_LOCK_KEY = 0x48495454
+
+
+def _columns(conn, table_name):
+    inspector = inspect(conn)
+    if not inspector.has_table(table_name):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table_name)}
+
+
+def _add_missing_columns(conn, table_name, columns):
+    """columns: {name: DDL type}; adds the ones the table lacks"""
+    existing = _columns(conn, table_name)
+    for name, ddl_type in columns.items():
+        if existing and name not in existing:
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl_type}"))
+
+
+def create_missing_tables(conn):
+    db.metadata.create_all(bind=conn, checkfirst=True)
+
+
+def rename_legacy_pull_event_columns(conn):
+    cols = _columns(conn, 'pull_events')
+    if "quantity_pulled" in cols and "quantity" not in cols:
+        conn.execute(text("ALTER TABLE pull_events RENAME COLUMN quantity_pulled TO quantity"))
+    if "qc_operator" in cols and "qc_personnel" not in cols:
+        conn.execute(text("ALTER TABLE pull_events RENAME COLUMN qc_operator TO qc_personnel"))
+
+
+def add_pull_event_columns(conn):
+    _add_missing_columns(conn, 'pull_events', {
+        "quantity": "INTEGER DEFAULT 0",
+        "mo": "VARCHAR(50)",
+        "operator": "VARCHAR(50)",
+        "qc_personnel": "VARCHAR(50)",
+    })
+
+
+def add_box_creator_columns(conn):
+    _add_missing_columns(conn, 'boxes', {
+        "operator": "VARCHAR(50)",
+        "qc_personnel": "VARCHAR(50)",
+    })
+
+
+def add_action_log_qc_column(conn):
+    _add_missing_columns(conn, 'action_logs', {
+        "qc_personnel": "VARCHAR(100)",
+    })
+
+
+def add_box_updated_at(conn):
+    _add_missing_columns(conn, 'boxes', {
+        "updated_at": "TIMESTAMP",
+    })
+
+
+def create_missing_indexes(conn):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+def populate_inventory_summary(conn):
+    has_summary = conn.execute(select(InventorySummary.box_count).limit(1)).first()
+    has_boxes = conn.execute(select(Box.id).limit(1)).first()
+    if has_boxes and not has_summary:
+        conn.execute(delete(InventorySummary))
+        conn.execute(summary_rebuild_statement())
+
+
+def replace_action_log_indexes(conn):
+    # The (timestamp, id) versions below serve the keyset-paginated log
+    for name in ('ix_action_logs_timestamp', 'ix_action_logs_action_type_timestamp',
+                 'ix_action_logs_user_timestamp'):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    create_missing_indexes(conn)
+
+
+def create_first_inventory_checkpoint(conn):
+    # As-of queries replay from a checkpoint, so history starts with one
+    create_missing_tables(conn)
+    if conn.execute(select(InventoryCheckpoint.id).limit(1)).first() is None:
+        write_checkpoint(conn)
+
+
+# Ordered, append-only. Never renumber or edit an applied step; add a new one.
+MIGRATIONS = [
+    (1, "create missing tables", create_missing_tables),
+    (2, "rename legacy pull_events columns", rename_legacy_pull_event_columns),
+    (3, "add pull_events quantity/mo/operator/qc_personnel", add_pull_event_columns),
+    (4, "add boxes operator/qc_personnel", add_box_creator_columns),
+    (5, "add action_logs qc_personnel", add_action_log_qc_column),
+    (6, "add boxes updated_at", add_box_updated_at),
+    (7, "create secondary indexes", create_missing_indexes),
+    (8, "populate inventory_summary", populate_inventory_summary),
+    (9, "create box search index", create_search_index),
+    (10, "replace action_logs indexes with (timestamp, id) keys", replace_action_log_indexes),
+    (11, "create pull_events/action_logs archive tables", create_missing_tables),
+    (12, "create box history tables and the first inventory checkpoint",
+     create_first_inventory_checkpoint),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(200) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def current_version():
+    """Highest applied migration, or 0 for an unversioned database"""
+    with db.engine.connect() as conn:
+        if not inspect(conn).has_table('schema_version'):
+            return 0
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def _sqlite_lock_path():
+    database = db.engine.url.database
+    if not database or database == ':memory:':
+        return os.path.join(app.instance_path, 'migrations.lock')
+    return f'{database}.migrations.lock'
+
+
+@contextmanager
+def migration_lock():
+    """Hold a lock so only one process runs migrations at a time"""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': ADVISORY_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': ADVISORY_LOCK_KEY})
+                conn.commit()
+    else:
+        lock_path = _sqlite_lock_path()
+        os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+        with open(lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def upgrade():
+    """Apply pending migrations under the lock; returns the steps applied"""
+    applied = []
+    with migration_lock():
+        with db.engine.begin() as conn:
+            _ensure_version_table(conn)
+        # Re-read under the lock: another process may have just finished
+        version = current_version()
+        for step, name, migrate in MIGRATIONS:
+            if step <= version:
+                continue
+            with db.engine.begin() as conn:
+                migrate(conn)
+                conn.execute(
+                    text("INSERT INTO schema_version (version, name, applied_at) "
+                         "VALUES (:version, :name, :applied_at)"),
+                    {'version': step, 'name': name,
+                     'applied_at': datetime.now(timezone.utc).replace(tzinfo=None)}
+                )
+            applied.append((step, name))
+    return applied
@@ -26,6 +26,10 @@ class LotNumber(db.Model):
 class Box(db.Model):
     """Box inventory table"""
     __tablename__ = 'boxes'
+    __table_args__ = (
+        # Per type/lot group listing ordered by box number (dashboard, manage_boxes)
+        db.Index('ix_boxes_type_lot_box_number', 'hardware_type_id', 'lot_number_id', 'box_number'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     box_id = db.Column(db.String(200), unique=True, nullable=False)  # Generated from Type_Lot_Box
@@ -38,6 +42,8 @@ class Box(db.Model):
     operator = db.Column(db.String(50))  # Box creation operator
     qc_personnel = db.Column(db.String(50))  # Box creation QC personnel
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc),
+                           onupdate=lambda: datetime.now(timezone.utc), index=True)  # Any change to the row
     
     # Relationships
     hardware_type = db.relationship('HardwareType', backref='boxes')
@@ -49,6 +55,14 @@ class Box(db.Model):
 class PullEvent(db.Model):
     """Pull event log table"""
     __tablename__ = 'pull_events'
+    __table_args__ = (
+        # box_logs history and delete_box count/delete by box
+        db.Index('ix_pull_events_box_id_timestamp', 'box_id', 'timestamp'),
+        # Date-range exports
+        db.Index('ix_pull_events_timestamp', 'timestamp'),
+        # MO-filtered exports
+        db.Index('ix_pull_events_mo_timestamp', 'mo', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     box_id = db.Column(db.Integer, db.ForeignKey('boxes.id'), nullable=False)
@@ -68,6 +82,12 @@ class PullEvent(db.Model):
 class ActionLog(db.Model):
     """Admin action log table"""
     __tablename__ = 'action_logs'
+    __table_args__ = (
+        # Action log page: keyset on (timestamp, id), optionally by action type or user
+        db.Index('ix_action_logs_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_action_logs_action_type_timestamp_id', 'action_type', 'timestamp', 'id'),
+        db.Index('ix_action_logs_user_timestamp_id', 'user', 'timestamp', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     action_type = db.Column(db.String(50), nullable=False)  # 'Pull', 'Return', 'box_add', 'box_edit', 'box_delete'
@@ -94,3 +114,115 @@ class ActionLog(db.Model):
     
     def __repr__(self):
         return f'<ActionLog {self.id}: {self.action_type} by {self.user}>'
+
+class InventorySummary(db.Model):
+    """Per type/lot inventory aggregates, maintained on every box write"""
+    __tablename__ = 'inventory_summary'
+    
+    hardware_type_id = db.Column(db.Integer, db.ForeignKey('hardware_types.id'), primary_key=True)
+    lot_number_id = db.Column(db.Integer, db.ForeignKey('lot_numbers.id'), primary_key=True)
+    box_count = db.Column(db.Integer, nullable=False, default=0)
+    total_initial = db.Column(db.Integer, nullable=False, default=0)
+    total_remaining = db.Column(db.Integer, nullable=False, default=0)
+    available_count = db.Column(db.Integer, nullable=False, default=0)  # remaining > 0
+    empty_count = db.Column(db.Integer, nullable=False, default=0)  # remaining <= 0
+    negative_count = db.Column(db.Integer, nullable=False, default=0)  # remaining < 0
+    
+    def __repr__(self):
+        return f'<InventorySummary {self.hardware_type_id}/{self.lot_number_id}: {self.box_count} boxes>'
+
+class PullEventArchive(db.Model):
+    """Pull events older than the retention horizon, moved out of pull_events"""
+    __tablename__ = 'pull_events_archive'
+    __table_args__ = (
+        db.Index('ix_pull_events_archive_box_id_timestamp', 'box_id', 'timestamp'),
+        db.Index('ix_pull_events_archive_timestamp', 'timestamp'),
+        db.Index('ix_pull_events_archive_mo_timestamp', 'mo', 'timestamp'),
+    )
+    
+    # Rows keep their pull_events id; no FK so the archive never blocks box changes
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    box_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    qc_personnel = db.Column(db.String(50), nullable=False)
+    signature = db.Column(db.String(100), nullable=True)
+    timestamp = db.Column(db.DateTime)
+    mo = db.Column(db.String(50))
+    operator = db.Column(db.String(50))
+    
+    def __repr__(self):
+        return f'<PullEventArchive {self.id} - Box {self.box_id}>'
+
+class ActionLogArchive(db.Model):
+    """Action log rows older than the retention horizon, moved out of action_logs"""
+    __tablename__ = 'action_logs_archive'
+    __table_args__ = (
+        db.Index('ix_action_logs_archive_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_action_logs_archive_action_type_timestamp_id', 'action_type', 'timestamp', 'id'),
+        db.Index('ix_action_logs_archive_user_timestamp_id', 'user', 'timestamp', 'id'),
+    )
+    
+    # Rows keep their action_logs id
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    action_type = db.Column(db.String(50), nullable=False)
+    user = db.Column(db.String(100), nullable=False)
+    timestamp = db.Column(db.DateTime)
+    box_id = db.Column(db.String(200))
+    hardware_type = db.Column(db.String(100))
+    lot_number = db.Column(db.String(100))
+    previous_quantity = db.Column(db.Integer)
+    quantity_change = db.Column(db.Integer)
+    available_quantity = db.Column(db.Integer)
+    operator = db.Column(db.String(100))
+    qc_personnel = db.Column(db.String(100))
+    details = db.Column(db.Text)
+    
+    def __repr__(self):
+        return f'<ActionLogArchive {self.id}: {self.action_type} by {self.user}>'
+
+class BoxAdjustment(db.Model):
+    """Quantity changes that are not pull events: box adds, edits and deletes"""
+    __tablename__ = 'box_adjustments'
+    __table_args__ = (
+        # As-of replay reads the window after (or before) a checkpoint
+        db.Index('ix_box_adjustments_timestamp', 'timestamp'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    box_pk = db.Column(db.Integer, nullable=False)  # boxes.id; no FK so deletes keep their history
+    timestamp = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    kind = db.Column(db.String(20), nullable=False)  # 'add', 'edit', 'delete', 'movement'
+    quantity_change = db.Column(db.Integer, nullable=False)  # Change to remaining_quantity
+    # The box as it was after this change
+    box_id = db.Column(db.String(200), nullable=False)
+    hardware_type_id = db.Column(db.Integer, nullable=False)
+    lot_number_id = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<BoxAdjustment {self.kind} {self.quantity_change:+d} box {self.box_pk}>'
+
+class InventoryCheckpoint(db.Model):
+    """A point in time at which every box's remaining quantity was copied"""
+    __tablename__ = 'inventory_checkpoints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    taken_at = db.Column(db.DateTime, nullable=False, unique=True)
+    box_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<InventoryCheckpoint {self.id} at {self.taken_at}>'
+
+class BoxQuantitySnapshot(db.Model):
+    """One box's state at an inventory checkpoint"""
+    __tablename__ = 'box_quantity_snapshots'
+    
+    checkpoint_id = db.Column(db.Integer, db.ForeignKey('inventory_checkpoints.id'), primary_key=True)
+    box_pk = db.Column(db.Integer, primary_key=True)  # boxes.id
+    box_id = db.Column(db.String(200), nullable=False)
+    hardware_type_id = db.Column(db.Integer, nullable=False)
+    lot_number_id = db.Column(db.Integer, nullable=False)
+    remaining_quantity = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime)  # boxes.created_at, for replaying backwards
+    
+    def __repr__(self):
+        return f'<BoxQuantitySnapshot {self.checkpoint_id}/{self.box_pk}: {self.remaining_quantity}>'
@@ -0,0 +1,77 @@
+"""
+Per-route SQL query budgets
+Hardware Inventory Tracker
+
+Routes declare how many SQL statements one request may issue:
+
+    @app.route('/dashboard')
+    @query_budget(4)
+    def dashboard():
+        ...
+
+Every statement executed while a request is being handled is counted,
+and when the view returns the count is compared with the budget. An N+1
+regression shows up as a route whose count grows with the data and
+blows its budget. QUERY_BUDGET_MODE decides what happens then:
+
+- log (default): log a warning with the route, count and budget
+- raise: raise QueryBudgetExceeded (for benchmarks/query_budget.py, CI
+  and local development)
+- off: do not count
+
+Statements issued while a streamed response is being sent happen after
+this check, so it only sees what a streaming export runs up front.
+benchmarks/query_budget.py reads whole responses and checks the full
+count against the same budget.
+"""
+
+import logging
+import os
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+QUERY_BUDGET_MODE = os.environ.get("QUERY_BUDGET_MODE", "log")
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """A route issued more SQL statements than its declared budget"""
+    pass
+
+
+def query_budget(max_statements):
+    """Declare the statement budget of a view; apply directly under @app.route"""
+    def decorator(view):
+        view.query_budget = max_statements
+        return view
+    return decorator
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+
+
+def init_app(app, engine):
+    if QUERY_BUDGET_MODE == 'off':
+        return
+
+    @app.before_request
+    def start_counting():
+        g.query_count = 0
+
+    @app.after_request
+    def check_budget(response):
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        count = g.pop('query_count', 0)
+        if budget is not None and count > budget:
+            message = (f"{request.endpoint} issued {count} SQL statements "
+                       f"(budget {budget}) for {request.method} {request.path}")
+            if QUERY_BUDGET_MODE == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    event.listen(engine, 'before_cursor_execute', _count_statement)
@@ -0,0 +1,145 @@
+"""
+Query plan checks for the route access paths
+Hardware Inventory Tracker
+
+Runs EXPLAIN (PostgreSQL) or EXPLAIN QUERY PLAN (SQLite) on the queries the
+routes issue and verifies each one is served by the index meant for it.
+Run with `flask check-query-plans`.
+
+On PostgreSQL sequential scans are disabled for the check so that small
+development tables still prove the index is usable, rather than the
+planner preferring a seq scan because the table fits in one page.
+"""
+
+from datetime import datetime
+from sqlalchemy import select, func, text, tuple_
+from app import db, build_filtered_query
+from box_search import search_backend
+from analytics import consumption_query
+from burn_rate import daily_consumption_query
+from models import (HardwareType, LotNumber, Box, PullEvent, ActionLog, PullEventArchive,
+                    BoxAdjustment, InventoryCheckpoint, BoxQuantitySnapshot)
+
+# Unique-constraint indexes are named by the database, not by us
+BARCODE_INDEXES = ('boxes_barcode_key', 'sqlite_autoindex_boxes_2')
+CHECKPOINT_INDEXES = ('inventory_checkpoints_taken_at_key', 'sqlite_autoindex_inventory_checkpoints_1')
+SNAPSHOT_INDEXES = ('box_quantity_snapshots_pkey', 'sqlite_autoindex_box_quantity_snapshots_1')
+
+CURSOR_TIME = datetime(2024, 1, 1)
+
+
+def route_queries():
+    """(route, description, statement, acceptable index names)"""
+    group_page = build_filtered_query('TYPE', 'LOT')\
+        .order_by(HardwareType.name, LotNumber.name, Box.box_number, Box.id)\
+        .limit(51)
+
+    queries = [
+        ('box_logs', "pull events for a box, newest first",
+         select(PullEvent).where(PullEvent.box_id == 1).order_by(PullEvent.timestamp.desc()),
+         ('ix_pull_events_box_id_timestamp',)),
+        ('box_logs', "archived pull events for a box",
+         select(PullEventArchive).where(PullEventArchive.box_id == 1)
+         .order_by(PullEventArchive.timestamp.desc()),
+         ('ix_pull_events_archive_box_id_timestamp',)),
+        ('delete_box', "count pull events for a box",
+         select(func.count()).select_from(PullEvent).where(PullEvent.box_id == 1),
+         ('ix_pull_events_box_id_timestamp',)),
+        ('action_log', "page of actions after a cursor",
+         select(ActionLog).where(tuple_(ActionLog.timestamp, ActionLog.id) < tuple_(CURSOR_TIME, 1))
+         .order_by(ActionLog.timestamp.desc(), ActionLog.id.desc()).limit(101),
+         ('ix_action_logs_timestamp_id',)),
+        ('action_log', "page of actions of one type",
+         select(ActionLog).where(ActionLog.action_type == 'Pull')
+         .order_by(ActionLog.timestamp.desc(), ActionLog.id.desc()).limit(101),
+         ('ix_action_logs_action_type_timestamp_id',)),
+        ('action_log', "page of actions by one user",
+         select(ActionLog).where(ActionLog.user == 'USER')
+         .order_by(ActionLog.timestamp.desc(), ActionLog.id.desc()).limit(101),
+         ('ix_action_logs_user_timestamp_id',)),
+        ('action_log', "counts per action type",
+         select(ActionLog.action_type, func.count(ActionLog.id))
+         .where(ActionLog.timestamp >= CURSOR_TIME).group_by(ActionLog.action_type),
+         ('ix_action_logs_action_type_timestamp_id', 'ix_action_logs_timestamp_id')),
+        ('action_log', "distinct users for the filter dropdown",
+         select(ActionLog.user).distinct(),
+         ('ix_action_logs_user_timestamp_id',)),
+        ('list_boxes_page', "one page of a type/lot group",
+         group_page.statement,
+         ('ix_boxes_type_lot_box_number',)),
+        ('get_box_info', "box by barcode",
+         select(Box.id).where(Box.barcode == 'BARCODE'),
+         BARCODE_INDEXES),
+        ('export_pull_events', "pull events in a date range",
+         select(PullEvent.id).where(PullEvent.timestamp >= text("'2024-01-01'"))
+         .order_by(PullEvent.timestamp),
+         ('ix_pull_events_timestamp',)),
+        ('export_pull_events', "pull events for one MO",
+         select(PullEvent.id).where(PullEvent.mo == 'MO-1').order_by(PullEvent.timestamp),
+         ('ix_pull_events_mo_timestamp',)),
+        ('inventory_as_of_api', "latest checkpoint at or before a time",
+         select(InventoryCheckpoint.id).where(InventoryCheckpoint.taken_at <= CURSOR_TIME)
+         .order_by(InventoryCheckpoint.taken_at.desc()).limit(1),
+         CHECKPOINT_INDEXES),
+        ('inventory_as_of_api', "box states of one checkpoint",
+         select(BoxQuantitySnapshot).where(BoxQuantitySnapshot.checkpoint_id == 1),
+         SNAPSHOT_INDEXES),
+        ('inventory_as_of_api', "box adjustments since the checkpoint",
+         select(BoxAdjustment).where(BoxAdjustment.timestamp >= CURSOR_TIME)
+         .order_by(BoxAdjustment.timestamp, BoxAdjustment.id),
+         ('ix_box_adjustments_timestamp',)),
+        ('inventory_as_of_api', "pull event totals since the checkpoint",
+         select(PullEvent.box_id, func.sum(PullEvent.quantity))
+         .where(PullEvent.timestamp >= CURSOR_TIME).group_by(PullEvent.box_id),
+         ('ix_pull_events_timestamp', 'ix_pull_events_box_id_timestamp')),
+        ('consumption_analytics', "pull events in the chart window, grouped by day",
+         consumption_query('operator', 'day', CURSOR_TIME, datetime(2024, 2, 1)).statement,
+         ('ix_pull_events_timestamp',)),
+        ('reorder', "pull events since the last refresh, grouped by type/lot and day",
+         daily_consumption_query(CURSOR_TIME).statement,
+         ('ix_pull_events_timestamp',)),
+    ]
+
+    # Only checked once migration 9 has built the index this database supports
+    if search_backend() != 'like':
+        queries.append(
+            ('manage_boxes', "substring search",
+             build_filtered_query(search_query='SEARCH').statement,
+             ('boxes_search VIRTUAL TABLE', '_trgm'))
+        )
+    return queries
+
+
+def explain(conn, statement):
+    """Plan lines for a statement on the connection's dialect"""
+    compiled = statement.compile(dialect=conn.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    if conn.dialect.name == 'sqlite':
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).fetchall()
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql(f'EXPLAIN {compiled}', params).fetchall()
+    return [row[0] for row in rows]
+
+
+def check_query_plans():
+    """Explain every route query; returns a list of result dicts"""
+    results = []
+    with db.engine.connect() as conn:
+        with conn.begin():
+            if conn.dialect.name == 'postgresql':
+                conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+            for route, description, statement, indexes in route_queries():
+                plan = explain(conn, statement)
+                plan_text = '\n'.join(plan)
+                results.append({
+                    'route': route,
+                    'description': description,
+                    'expected': indexes,
+                    'ok': any(index in plan_text for index in indexes),
+                    'plan': plan,
+                })
+    return results
@@ -5,7 +5,10 @@ Hardware Inventory Tracker
 """
 
 from app import app, db
-from models import HardwareType, LotNumber, Box, PullEvent
+from models import (HardwareType, LotNumber, Box, PullEvent, InventorySummary, BoxAdjustment,
+                    InventoryCheckpoint, BoxQuantitySnapshot)
+from inventory_summary import rebuild_inventory_summary
+from inventory_history import record_adjustment, take_checkpoint
 from datetime import datetime, timezone, timedelta
 import random
 
@@ -13,7 +16,11 @@ def seed_database():
     """Populate database with realistic sample data"""
     
     with app.app_context():
-        # Clear existing data
+        # Clear existing data, including the as-of history of the old boxes
+        db.session.query(BoxQuantitySnapshot).delete()
+        db.session.query(InventoryCheckpoint).delete()
+        db.session.query(BoxAdjustment).delete()
+        db.session.query(InventorySummary).delete()
         db.session.query(PullEvent).delete()
         db.session.query(Box).delete()
         db.session.query(HardwareType).delete()
@@ -96,6 +103,9 @@ def seed_database():
             {'type': 'IC_OpAmp_741', 'lot': 'LOT2024-005', 'box': '001', 'qty': 200, 'barcode': 'IC741_001E'}
         ]
         
+        # Boxes arrive before the simulated week of pulls below
+        created_at = datetime.now(timezone.utc) - timedelta(days=8)
+        
         boxes = []
         for config in box_configs:
             # Find type and lot objects
@@ -113,12 +123,15 @@ def seed_database():
                 box_number=config['box'],
                 initial_quantity=config['qty'],
                 remaining_quantity=config['qty'],
-                barcode=config['barcode']
+                barcode=config['barcode'],
+                created_at=created_at
             )
             db.session.add(box)
             boxes.append(box)
         
         db.session.flush()  # Get box IDs
+        for box in boxes:
+            record_adjustment('add', box, box.initial_quantity, timestamp=created_at)
         
         # Create some pull events to simulate real usage
         pull_events = [
@@ -176,6 +189,9 @@ def seed_database():
         
         # Commit all changes
         db.session.commit()
+        rebuild_inventory_summary()
+        # As-of queries replay from a checkpoint, so the new history starts with one
+        take_checkpoint()
         
         print("✅ Database seeded successfully!")
         print(f"Created {len(type_objects)} hardware types")
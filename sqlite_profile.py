@@ -0,0 +1,107 @@
+"""
+SQLite engine profile
+Hardware Inventory Tracker
+
+With several gunicorn workers sharing one SQLite file, the default
+rollback journal lets a single writer block every reader, and a busy
+database fails immediately with "database is locked". The production
+profile sets, on every new connection:
+
+- journal_mode=WAL: readers no longer block on the writer
+- synchronous=NORMAL: fsync at checkpoints instead of every commit
+  (safe with WAL; a power loss can drop the last commits, never corrupt)
+- busy_timeout: wait for the write lock instead of failing
+- cache_size, mmap_size, temp_store: keep hot pages and temp b-trees
+  in memory
+
+It also takes transaction control away from the sqlite3 module, so
+SQLAlchemy emits BEGIN itself. Transactions stay deferred, so concurrent
+readers never queue on the write lock, and write paths call begin_write()
+first to get BEGIN IMMEDIATE. A deferred transaction that later tries to
+write fails straight away with SQLITE_BUSY when another writer got there
+first, and busy_timeout does not help with that.
+
+Selected with SQLITE_PROFILE=production (default) or default (driver
+behaviour, no pragmas). Ignored for other databases.
+
+On SQLite builds older than 3.32, which allow only 999 bound parameters
+per statement, bulk inserts are also capped to stay under that limit; IN
+lists over many values go through chunked().
+"""
+
+import os
+import sqlite3
+from sqlalchemy import event
+from app import db
+
+SQLITE_PROFILE = os.environ.get("SQLITE_PROFILE", "production")
+
+SQLITE_PROFILES = {
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),  # milliseconds
+        'cache_size': -64000,  # negative = KiB, so 64 MB per connection
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'default': None,
+}
+
+# Execution option marking a session transaction as a writer
+IMMEDIATE_OPTION = 'sqlite_begin_immediate'
+
+# SQLite before 3.32 allows 999 bound parameters per statement, so IN
+# lists built from request or upload data are split into chunks this size
+IN_CHUNK_SIZE = 900
+
+
+def apply_sqlite_profile(engine, profile=SQLITE_PROFILE):
+    """Register the profile's connect/begin hooks on a SQLite engine"""
+    if engine.dialect.name != 'sqlite':
+        return
+    if sqlite3.sqlite_version_info < (3, 32, 0):
+        # Multi-row bulk INSERTs are sized by parameter count; keep them under the limit
+        engine.dialect.insertmanyvalues_max_parameters = IN_CHUNK_SIZE
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE '{profile}'")
+    pragmas = SQLITE_PROFILES[profile]
+    if pragmas is None:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        # Stop the sqlite3 module from issuing its own BEGIN
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        if conn.get_execution_options().get(IMMEDIATE_OPTION):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+        else:
+            conn.exec_driver_sql('BEGIN')
+
+
+def begin_write():
+    """
+    Start db.session's transaction as a writer (BEGIN IMMEDIATE on SQLite).
+
+    Call before the first query of a write path. A read-only transaction
+    already in progress is ended first so the write lock is taken up front.
+    Elsewhere this only opens the session's connection.
+    """
+    session = db.session()
+    if session.in_transaction() and not (session.new or session.dirty or session.deleted):
+        session.commit()
+    session.connection(execution_options={IMMEDIATE_OPTION: True})
+
+
+def chunked(values, size=IN_CHUNK_SIZE):
+    """Successive lists of at most `size` values, one per IN query"""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
@@ -0,0 +1,191 @@
+/**
+ * Lazily expanded type/lot groups for the dashboard and manage boxes pages
+ * Hardware Inventory Tracker
+ *
+ * Each group is rendered server-side as a <tbody class="box-group"> holding
+ * only its header row. Box rows are fetched page by page from /api/boxes
+ * when the group is expanded.
+ */
+
+class BoxGroupLoader {
+    constructor(table, options = {}) {
+        this.table = table;
+        this.search = options.search || '';
+        this.showAdminActions = !!options.showAdminActions;
+        this.pageSize = options.pageSize || 50;
+    }
+
+    init() {
+        this.table.querySelectorAll('tbody.box-group').forEach(group => {
+            const toggle = group.querySelector('.group-toggle');
+            if (toggle) {
+                toggle.addEventListener('click', () => this.toggle(group));
+            }
+        });
+    }
+
+    async toggle(group) {
+        const expanded = group.dataset.expanded === 'true';
+        group.dataset.expanded = expanded ? 'false' : 'true';
+        group.querySelectorAll('tr.box-row, tr.load-more-row').forEach(row => {
+            row.style.display = expanded ? 'none' : '';
+        });
+        this.updateToggleIcon(group);
+
+        if (!expanded && group.dataset.loaded !== 'true') {
+            await this.loadPage(group);
+        }
+    }
+
+    async expandAll() {
+        const groups = Array.from(this.table.querySelectorAll('tbody.box-group'));
+        for (const group of groups) {
+            if (group.dataset.expanded !== 'true') {
+                await this.toggle(group);
+            }
+            while (group.dataset.nextCursor) {
+                await this.loadPage(group);
+            }
+        }
+    }
+
+    updateToggleIcon(group) {
+        const icon = group.querySelector('.group-toggle i');
+        if (icon) {
+            icon.className = group.dataset.expanded === 'true'
+                ? 'fas fa-chevron-down'
+                : 'fas fa-chevron-right';
+        }
+    }
+
+    async loadPage(group) {
+        if (group.dataset.loading === 'true') {
+            return;
+        }
+        group.dataset.loading = 'true';
+
+        const params = new URLSearchParams({
+            type_name: group.dataset.typeName,
+            lot_name: group.dataset.lotName,
+            limit: this.pageSize
+        });
+        if (this.search) {
+            params.set('search', this.search);
+        }
+        if (group.dataset.nextCursor) {
+            params.set('after', group.dataset.nextCursor);
+        }
+
+        try {
+            const response = await fetch(`/api/boxes?${params}`);
+            const data = await response.json();
+            const loadMore = group.querySelector('tr.load-more-row');
+            if (loadMore) {
+                loadMore.remove();
+            }
+
+            data.boxes.forEach(box => group.appendChild(this.renderRow(box)));
+            group.dataset.loaded = 'true';
+            group.dataset.nextCursor = data.next_cursor || '';
+
+            if (data.next_cursor) {
+                group.appendChild(this.renderLoadMore(group));
+            }
+        } catch (error) {
+            console.error('Error loading boxes:', error);
+        } finally {
+            group.dataset.loading = 'false';
+        }
+    }
+
+    renderLoadMore(group) {
+        const row = document.createElement('tr');
+        row.className = 'load-more-row no-print';
+        row.innerHTML = `
+            <td colspan="9" class="text-center">
+                <button type="button" class="btn btn-sm btn-outline-secondary">
+                    <i class="fas fa-angle-double-down me-1"></i>Load more
+                </button>
+            </td>`;
+        row.querySelector('button').addEventListener('click', () => this.loadPage(group));
+        return row;
+    }
+
+    renderRow(box) {
+        const row = document.createElement('tr');
+        row.className = 'box-row';
+        row.innerHTML = `
+            <td><strong>${escapeHtml(box.box_id)}</strong></td>
+            <td><span class="badge bg-primary">${escapeHtml(box.type_name)}</span></td>
+            <td><span class="badge bg-info">${escapeHtml(box.lot_name)}</span></td>
+            <td>${escapeHtml(box.box_number)}</td>
+            <td>${box.initial_quantity}</td>
+            <td>${this.renderQuantity(box)}</td>
+            <td>${this.renderStatus(box)}</td>
+            <td><span class="barcode-text">${escapeHtml(box.barcode)}</span></td>
+            <td>${this.renderActions(box)}</td>`;
+
+        const deleteForm = row.querySelector('form.delete-box-form');
+        if (deleteForm) {
+            deleteForm.addEventListener('submit', (e) => {
+                if (!confirm(`Are you sure you want to delete box ${box.box_id}?`)) {
+                    e.preventDefault();
+                }
+            });
+        }
+        return row;
+    }
+
+    renderQuantity(box) {
+        const qty = box.remaining_quantity;
+        if (qty < 0) {
+            return `<strong class="quantity-negative">${qty}</strong>`;
+        }
+        const cls = qty === 0 ? 'text-danger' : qty < 10 ? 'text-warning' : 'text-success';
+        return `<strong class="${cls}">${qty}</strong>`;
+    }
+
+    renderStatus(box) {
+        const qty = box.remaining_quantity;
+        if (qty < 0) {
+            return '<span class="badge bg-danger">⚠️ Negative</span>';
+        }
+        if (qty === 0) {
+            return '<span class="badge bg-danger">Empty</span>';
+        }
+        if (qty < box.initial_quantity * 0.2) {
+            return '<span class="badge bg-warning text-dark">Low</span>';
+        }
+        return '<span class="badge bg-success">Available</span>';
+    }
+
+    renderActions(box) {
+        const logsLink = `
+            <a href="${box.logs_url}" class="btn btn-sm btn-outline-secondary" title="View Logs">
+                <i class="fas fa-history"></i>
+            </a>`;
+        if (!this.showAdminActions) {
+            return logsLink;
+        }
+        return `
+            <div class="btn-group btn-group-sm">
+                <a href="${box.edit_url}" class="btn btn-outline-primary" title="Edit Box">
+                    <i class="fas fa-edit"></i>
+                </a>
+                <a href="${box.logs_url}" class="btn btn-outline-secondary" title="View Logs">
+                    <i class="fas fa-history"></i>
+                </a>
+                <form method="POST" action="${box.delete_url}" class="delete-box-form" style="display: inline;">
+                    <button type="submit" class="btn btn-outline-danger" title="Delete Box">
+                        <i class="fas fa-trash"></i>
+                    </button>
+                </form>
+            </div>`;
+    }
+}
+
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = value == null ? '' : String(value);
+    return div.innerHTML;
+}
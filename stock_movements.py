@@ -0,0 +1,306 @@
+"""
+Stock movement service for pull/return events
+Hardware Inventory Tracker
+
+Every change to Box.remaining_quantity caused by a pull or return goes
+through here. The stock check and the decrement happen in one conditional
+UPDATE, so concurrent scanner stations cannot lose an update, and the
+PullEvent and ActionLog rows are written in the same transaction.
+"""
+
+import json
+from collections import defaultdict
+from sqlalchemy import update, select, insert
+from app import db
+from box_cache import box_info_cache
+from action_log_queries import action_log_filter_options
+from sqlite_profile import begin_write, chunked
+from inventory_summary import adjust_summary, merge_deltas, movement_delta
+from models import HardwareType, LotNumber, Box, PullEvent, ActionLog
+
+
+class StockMovementError(Exception):
+    """Raised when a movement cannot be applied; the message is user-facing"""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        # Per-line problems for batch movements: [{'line': n, 'error': msg}]
+        self.errors = errors or []
+
+
+def quantity_change(event_type, quantity):
+    """Signed quantity for an event: negative for pulls, positive for returns"""
+    return quantity if event_type == 'return' else -quantity
+
+
+def _movement_box_query():
+    return select(
+        Box.id,
+        Box.box_id,
+        Box.barcode,
+        Box.hardware_type_id,
+        Box.lot_number_id,
+        HardwareType.name.label('type_name'),
+        LotNumber.name.label('lot_name')
+    ).join(HardwareType, Box.hardware_type_id == HardwareType.id)\
+     .join(LotNumber, Box.lot_number_id == LotNumber.id)
+
+
+def find_box_for_movement(barcode):
+    """Resolve a barcode to the box columns a movement needs, in one query"""
+    return db.session.execute(
+        _movement_box_query().where(Box.barcode == barcode)
+    ).first()
+
+
+def find_boxes_for_movement(barcodes):
+    """Resolve many barcodes with IN queries of IN_CHUNK_SIZE; returns {barcode: row}"""
+    boxes = {}
+    for chunk in chunked(dict.fromkeys(barcodes)):
+        for row in db.session.execute(_movement_box_query().where(Box.barcode.in_(chunk))):
+            boxes[row.barcode] = row
+    return boxes
+
+
+def apply_quantity_change(box_pk, change):
+    """
+    Atomically add `change` to a box's remaining quantity.
+
+    The WHERE clause refuses any change that would take the box below zero,
+    so the check and the write are a single statement. On PostgreSQL the
+    UPDATE takes a row lock and re-evaluates the condition after waiting;
+    on SQLite the statement holds the database write lock. Returns
+    (previous_quantity, new_quantity), or None when stock is insufficient.
+    Does not commit.
+    """
+    stmt = (
+        update(Box)
+        .where(Box.id == box_pk)
+        .where(Box.remaining_quantity + change >= 0)
+        .values(remaining_quantity=Box.remaining_quantity + change)
+        .execution_options(synchronize_session=False)
+    )
+
+    if db.engine.dialect.update_returning:
+        new_qty = db.session.execute(stmt.returning(Box.remaining_quantity)).scalar()
+        if new_qty is None:
+            return None
+    else:
+        result = db.session.execute(stmt)
+        if result.rowcount != 1:
+            return None
+        # Row is write-locked by our UPDATE, so this read is consistent
+        new_qty = db.session.execute(
+            select(Box.remaining_quantity).where(Box.id == box_pk)
+        ).scalar()
+
+    return new_qty - change, new_qty
+
+
+def _pull_event_values(box_pk, change, mo, operator, qc_personnel, signature):
+    return {
+        'box_id': box_pk,
+        'quantity': change,
+        'mo': mo,
+        'operator': operator,
+        'qc_personnel': qc_personnel,
+        'signature': signature,
+    }
+
+
+def _action_log_values(event_type, box_row, previous_qty, change, new_qty,
+                       mo, operator, qc_personnel, signature):
+    return {
+        'action_type': event_type,
+        'user': operator,
+        'box_id': box_row.box_id,
+        'hardware_type': box_row.type_name,
+        'lot_number': box_row.lot_name,
+        'previous_quantity': previous_qty,
+        'quantity_change': change,
+        'available_quantity': new_qty,
+        'operator': operator,
+        'qc_personnel': qc_personnel,
+        'details': json.dumps({"mo": mo, "signature": signature}),
+    }
+
+
+def record_movement(barcode, quantity, event_type, mo, operator, qc_personnel, signature=''):
+    """
+    Apply one pull/return and write its PullEvent and ActionLog rows.
+
+    Everything is committed in a single transaction; on any failure the
+    transaction is rolled back and StockMovementError is raised for
+    validation problems. Returns a dict describing the applied movement.
+    """
+    try:
+        begin_write()
+        box_row = find_box_for_movement(barcode)
+        if box_row is None:
+            raise StockMovementError("Box with given barcode not found")
+
+        change = quantity_change(event_type, quantity)
+        quantities = apply_quantity_change(box_row.id, change)
+        if quantities is None:
+            raise StockMovementError("Not enough quantity in box")
+        previous_qty, new_qty = quantities
+        adjust_summary(box_row.hardware_type_id, box_row.lot_number_id,
+                       movement_delta(previous_qty, new_qty))
+
+        pull_event = PullEvent(**_pull_event_values(
+            box_row.id, change, mo, operator, qc_personnel, signature))
+        action_log = ActionLog(**_action_log_values(
+            event_type, box_row, previous_qty, change, new_qty,
+            mo, operator, qc_personnel, signature))
+        db.session.add(pull_event)
+        db.session.add(action_log)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    box_info_cache.invalidate(barcode)
+    action_log_filter_options.remember(event_type, operator)
+
+    return {
+        'box_pk': box_row.id,
+        'box_id': box_row.box_id,
+        'hardware_type': box_row.type_name,
+        'lot_number': box_row.lot_name,
+        'previous_quantity': previous_qty,
+        'quantity_change': change,
+        'remaining_quantity': new_qty,
+    }
+
+
+def validate_movement_header(mo, operator, qc_personnel):
+    """Validation shared by single and batch movements; returns error list"""
+    errors = []
+    if not mo:
+        errors.append("Manufacturing Order (MO) is required")
+    if not operator:
+        errors.append("Operator name is required")
+    if not qc_personnel:
+        errors.append("QC Personnel name is required")
+    if operator == qc_personnel:
+        errors.append("Operator and QC Personnel cannot be the same")
+    return errors
+
+
+def _parse_batch_lines(lines):
+    """Normalise raw batch lines, collecting every problem instead of stopping"""
+    parsed = []
+    errors = []
+    for index, line in enumerate(lines, start=1):
+        if not isinstance(line, dict):
+            errors.append({'line': index, 'error': "Line must be an object"})
+            continue
+        barcode = str(line.get('barcode') or '').strip()
+        event_type = str(line.get('event_type') or 'pull').lower()
+        if not barcode:
+            errors.append({'line': index, 'error': "Barcode is required"})
+        if event_type not in ('pull', 'return'):
+            errors.append({'line': index, 'error': "Invalid event type"})
+        try:
+            quantity = int(line.get('quantity'))
+            if quantity <= 0:
+                errors.append({'line': index, 'error': "Quantity must be greater than 0"})
+        except (ValueError, TypeError):
+            quantity = None
+            errors.append({'line': index, 'error': "Quantity must be a valid number"})
+        parsed.append({
+            'line': index,
+            'barcode': barcode,
+            'event_type': event_type,
+            'quantity': quantity,
+        })
+    return parsed, errors
+
+
+def record_batch(lines, mo, operator, qc_personnel, signature=''):
+    """
+    Apply a list of pull/return lines for one Manufacturing Order.
+
+    Barcodes are resolved with one IN query per IN_CHUNK_SIZE distinct
+    barcodes and every line is validated before anything is written. Lines
+    for the same box are netted into a single conditional UPDATE, then the
+    running quantity of each line is checked so no intermediate step goes
+    negative. PullEvent and ActionLog rows are bulk-inserted and the whole
+    batch commits or rolls back as one transaction. Raises StockMovementError with per-line errors.
+    """
+    header_errors = validate_movement_header(mo, operator, qc_personnel)
+    if not lines:
+        header_errors.append("At least one line is required")
+    parsed, line_errors = _parse_batch_lines(lines or [])
+    if header_errors or line_errors:
+        raise StockMovementError("; ".join(header_errors) or "Invalid batch lines",
+                                 errors=line_errors)
+
+    try:
+        begin_write()
+        boxes = find_boxes_for_movement([p['barcode'] for p in parsed])
+        for p in parsed:
+            if p['barcode'] not in boxes:
+                line_errors.append({'line': p['line'], 'error': "Box with given barcode not found"})
+        if line_errors:
+            raise StockMovementError("Unknown barcodes in batch", errors=line_errors)
+
+        lines_by_box = defaultdict(list)
+        for p in parsed:
+            p['change'] = quantity_change(p['event_type'], p['quantity'])
+            lines_by_box[boxes[p['barcode']].id].append(p)
+
+        pull_events = []
+        action_logs = []
+        summary_deltas = defaultdict(list)
+        for box_pk, box_lines in lines_by_box.items():
+            net_change = sum(p['change'] for p in box_lines)
+            quantities = apply_quantity_change(box_pk, net_change)
+            if quantities is None:
+                line_errors.extend({'line': p['line'], 'error': "Not enough quantity in box"}
+                                   for p in box_lines)
+                continue
+
+            box_row = boxes[box_lines[0]['barcode']]
+            summary_deltas[(box_row.hardware_type_id, box_row.lot_number_id)].append(
+                movement_delta(*quantities))
+
+            running = quantities[0]
+            for p in box_lines:
+                previous_qty = running
+                running += p['change']
+                if running < 0:
+                    line_errors.append({'line': p['line'], 'error': "Not enough quantity in box"})
+                    break
+                p['previous_quantity'] = previous_qty
+                p['remaining_quantity'] = running
+                pull_events.append(_pull_event_values(
+                    box_pk, p['change'], mo, operator, qc_personnel, signature))
+                action_logs.append(_action_log_values(
+                    p['event_type'], box_row, previous_qty, p['change'], running,
+                    mo, operator, qc_personnel, signature))
+
+        if line_errors:
+            raise StockMovementError("Not enough quantity for some lines",
+                                     errors=sorted(line_errors, key=lambda e: e['line']))
+
+        for (type_id, lot_id), deltas in summary_deltas.items():
+            adjust_summary(type_id, lot_id, merge_deltas(*deltas))
+        db.session.execute(insert(PullEvent), pull_events)
+        db.session.execute(insert(ActionLog), action_logs)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    box_info_cache.invalidate(*boxes)
+    for values in action_logs:
+        action_log_filter_options.remember(values['action_type'], values['user'])
+
+    return [{
+        'line': p['line'],
+        'barcode': p['barcode'],
+        'box_id': boxes[p['barcode']].box_id,
+        'event_type': p['event_type'],
+        'quantity_change': p['change'],
+        'previous_quantity': p['previous_quantity'],
+        'remaining_quantity': p['remaining_quantity'],
+    } for p in parsed]